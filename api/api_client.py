@@ -1,37 +1,180 @@
-from flask import Flask, send_file, jsonify, request
-import os
+from flask import Flask, Response, send_file, jsonify, request, stream_with_context
 import logging
-from utils import csv_file_path, fetch_data, collection_csv, collection_historical_exercise
+from utils import collection_csv, collection_historical_exercise, db, init_storage
+from app_state import app_state
+from rollups import ROLLUP_INTERVALS, load_bars
+from ohlc import fetch_ohlc
+from volatility import ESTIMATORS, load_volatility
+from implied_vol import surface_cache
+from metrics import install_metrics
+from export import EXPORT_FORMATS, export_collection
+from queries import find_documents, parse_after, stream_json_array, stream_ndjson
 import pandas as pd
 
 # Initialize Flask app
 app = Flask(__name__)
+install_metrics(app)
 
 # Configure logging for better debugging
 logging.basicConfig(level=logging.INFO)
 
 
+@app.before_request
+def ensure_storage():
+    """Create the indexes on the first request instead of at import time."""
+    init_storage()
+
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Readiness state and startup time of the application."""
+    state = app_state.snapshot()
+    return jsonify(state), 200 if state['status'] in ('ready', 'idle') else 503
+
+
+@app.route('/api/ingestion', methods=['GET'])
+def ingestion_health():
+    """Health and backoff state of each ingestion job, as last saved by the scheduler."""
+    jobs = list(db['ingestion_jobs'].find({}, {"_id": 0}).sort([("kind", 1), ("key", 1)]))
+    return jsonify(jobs)
+
+
+def stream_collection(collection, time_field, empty_message):
+    """
+    Stream documents of a collection filtered by symbol/start/end, projected by
+    `fields` and paginated by keyset (`after=<time>,<_id>` of the last row, `limit`).
+    Returns a JSON array by default or NDJSON with `format=ndjson`.
+    """
+    try:
+        cursor = find_documents(
+            collection, time_field,
+            symbol=request.args.get('symbol'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            after=parse_after(request.args.get('after')),
+            fields=request.args.get('fields'),
+            limit=request.args.get('limit', type=int)
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    first = next(cursor, None)
+    if first is None:
+        logging.warning(f"No data found in '{collection.name}' for {dict(request.args)}.")
+        return jsonify({"message": empty_message}), 404
+
+    ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    if ndjson:
+        return Response(stream_with_context(stream_ndjson(first, cursor)), mimetype='application/x-ndjson')
+    return Response(stream_with_context(stream_json_array(first, cursor)), mimetype='application/json')
+
 @app.route('/api/csv_data', methods=['GET'])
 def get_csv_data():
     """Endpoint to get data from the CSV collection."""
-    df_csv = fetch_data(collection_csv)
-    if not df_csv.empty:
-        logging.info("CSV data found, sending JSON response.")
-        data = df_csv.to_dict(orient='records')
-        return jsonify(data)
-    else:
-        logging.warning("No data found in CSV collection.")
-        return jsonify({"message": "Nenhum dado encontrado na coleção CSV."}), 404
+    return stream_collection(collection_csv, 'time', "Nenhum dado encontrado na coleção CSV.")
 
 @app.route('/api/historical_exercise_data', methods=['GET'])
 def get_historical_exercise_data():
     """Endpoint to get data from the Historical Exercise Records collection."""
-    df_historical_exercise = fetch_data(collection_historical_exercise)
-    if not df_historical_exercise.empty:
-        logging.info("Historical Exercise data found, sending JSON response.")
-        data = df_historical_exercise.to_dict(orient='records')
-        return jsonify(data)
-    else:
-        logging.warning("No data found in Historical Exercise Records collection.")
-        return jsonify({"message": "Nenhum dado encontrado na coleção de Historical Exercise Records."}), 404
+    return stream_collection(
+        collection_historical_exercise, 'expiryDate',
+        "Nenhum dado encontrado na coleção de Historical Exercise Records."
+    )
+
+@app.route('/api/bars', methods=['GET'])
+def get_bars():
+    """Endpoint to get OHLCV bars from the rollup collections."""
+    interval = request.args.get('interval', '1d')
+    if interval not in ROLLUP_INTERVALS:
+        return jsonify({"message": f"Intervalo inválido. Use um de: {', '.join(ROLLUP_INTERVALS)}."}), 400
+    df_bars = load_bars(
+        db, interval,
+        symbol=request.args.get('symbol'),
+        start=request.args.get('start'),
+        end=request.args.get('end')
+    )
+    if df_bars.empty:
+        return jsonify({"message": "Nenhuma barra encontrada."}), 404
+    df_bars = df_bars.drop(columns=['price_sum'], errors='ignore')
+    df_bars['time'] = df_bars['time'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return jsonify(df_bars.to_dict(orient='records'))
+
+@app.route('/api/ohlc', methods=['GET'])
+def get_ohlc():
+    """Endpoint to get OHLCV bars of any interval (1s to 1w) aggregated inside MongoDB."""
+    try:
+        bars = fetch_ohlc(
+            collection_csv,
+            request.args.get('interval', '1h'),
+            symbol=request.args.get('symbol'),
+            start=request.args.get('start'),
+            end=request.args.get('end')
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if not bars:
+        return jsonify({"message": "Nenhum dado encontrado para o intervalo solicitado."}), 404
+    return jsonify([{**bar, "time": bar['time'].strftime('%Y-%m-%dT%H:%M:%S')} for bar in bars])
+
+@app.route('/api/volatility', methods=['GET'])
+def get_volatility():
+    """Endpoint to get the persisted realized-volatility estimates (annualized) of a symbol."""
+    interval = request.args.get('interval', '1d')
+    if interval not in ROLLUP_INTERVALS:
+        return jsonify({"message": f"Intervalo inválido. Use um de: {', '.join(ROLLUP_INTERVALS)}."}), 400
+    symbol = request.args.get('symbol', 'BTCUSDT')
+    window = request.args.get('window', 30, type=int)
+    df_volatility = load_volatility(
+        db, symbol, interval, window,
+        start=request.args.get('start'),
+        end=request.args.get('end')
+    )
+    if df_volatility.empty:
+        return jsonify({"message": "Nenhuma estimativa de volatilidade encontrada."}), 404
+    estimators = [name for name in (request.args.get('estimators') or ','.join(ESTIMATORS)).split(',') if name in ESTIMATORS]
+    df_volatility = df_volatility[['time', *estimators]]
+    df_volatility['time'] = df_volatility['time'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return jsonify(df_volatility.to_dict(orient='records'))
+
+@app.route('/api/iv_surface', methods=['GET'])
+def get_iv_surface():
+    """Endpoint to get the strike × expiry implied-volatility surface of an underlying (cached per snapshot)."""
+    underlying = request.args.get('underlying', 'BTCUSDT')
+    try:
+        snapshot_time, forward, surface = surface_cache.get(underlying)
+    except Exception as e:
+        logging.error(f"Erro ao montar a superfície de IV de {underlying}: {e}")
+        return jsonify({"message": "Erro ao obter as cotações de opções."}), 502
+    if surface.empty:
+        return jsonify({"message": "Nenhuma cotação de opção encontrada."}), 404
+    return jsonify({
+        "underlying": underlying,
+        "snapshot_time": snapshot_time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "forward": forward,
+        "strikes": surface.index.tolist(),
+        "expiries": [expiry.strftime('%Y-%m-%dT%H:%M:%S') for expiry in surface.columns],
+        # NaN (cotação ausente ou fora dos limites de arbitragem) vira null
+        "iv": [[None if pd.isna(value) else float(value) for value in row] for row in surface.to_numpy()],
+    })
 
+@app.route('/api/export/<collection_name>', methods=['GET'])
+def export_data(collection_name):
+    """Endpoint to download a Parquet/Arrow/CSV export of a collection (cached on disk)."""
+    collections = {c.name: c for c in (collection_csv, collection_historical_exercise)}
+    if collection_name not in collections:
+        return jsonify({"message": f"Coleção desconhecida: {collection_name}."}), 404
+    export_format = request.args.get('format', 'parquet')
+    try:
+        path = export_collection(
+            collections[collection_name], export_format,
+            symbol=request.args.get('symbol'),
+            start=request.args.get('start'),
+            end=request.args.get('end')
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return send_file(
+        path,
+        mimetype=EXPORT_FORMATS[export_format][1],
+        as_attachment=True,
+        download_name=f"{collection_name}{EXPORT_FORMATS[export_format][0]}"
+    )
@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Marca o início do processo (primeiro import) para medir o tempo até ficar pronto
+PROCESS_STARTED = time.monotonic()
+
+STATUS_IDLE = 'idle'
+STATUS_LOADING = 'loading'
+STATUS_READY = 'ready'
+STATUS_ERROR = 'error'
+
+
+class AppState:
+    """Readiness of the application data, filled by a background warm-up."""
+
+    def __init__(self):
+        self.status = STATUS_IDLE
+        self.error = None
+        self.warmup_seconds = None
+        self.startup_seconds = None
+        self.ready_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.status == STATUS_READY
+
+    def start_warmup(self, *steps):
+        """Run the warm-up steps in a daemon thread (only once per process)."""
+        with self._lock:
+            if self._thread is not None:
+                return self._thread
+            self.status = STATUS_LOADING
+            self._thread = threading.Thread(target=self._run, args=steps, name='warmup', daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def _run(self, *steps):
+        started = time.monotonic()
+        try:
+            for step in steps:
+                step()
+        except Exception as e:
+            logging.error(f"Erro ao inicializar os dados: {e}")
+            with self._lock:
+                self.status = STATUS_ERROR
+                self.error = str(e)
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.warmup_seconds = now - started
+            self.startup_seconds = now - PROCESS_STARTED
+            self.ready_at = datetime.now(timezone.utc)
+            self.status = STATUS_READY
+        logging.info(f"Aplicação pronta em {self.startup_seconds:.1f}s (warm-up {self.warmup_seconds:.1f}s).")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "error": self.error,
+                "warmup_seconds": self.warmup_seconds,
+                "startup_seconds": self.startup_seconds,
+                "uptime_seconds": time.monotonic() - PROCESS_STARTED,
+                "ready_at": self.ready_at.isoformat() if self.ready_at else None,
+            }
+
+
+app_state = AppState()
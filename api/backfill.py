@@ -0,0 +1,265 @@
+"""
+Parallel, resumable historical backfill of Binance aggTrades.
+
+The requested time range is split into shards that are fetched concurrently
+with aiohttp. Fetched pages go through a bounded queue to a background writer
+that persists them with `insert_data_into_mongo`; a shard is only marked as
+done once every page of it was written, so an interrupted backfill redoes
+just the unfinished shards.
+
+Uso:
+    python api/backfill.py --symbol BTCUSDT --start 2020-01-01 --end 2023-12-31
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+import pandas as pd
+
+from binance_client import backoff_delay, get_client, parse_retry_after
+from utils import (
+    BINANCE_API_URL,
+    AGG_TRADES_WEIGHT,
+    AGG_TRADES_WINDOW_MS,
+    agg_trades_to_records,
+    collection_csv,
+    db,
+    init_storage,
+    insert_data_into_mongo,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Coleção com o estado de cada shard do backfill
+collection_backfill_shards = db['backfill_shards']
+
+DEFAULT_SHARD_HOURS = 24
+DEFAULT_CONCURRENCY = 8
+DEFAULT_QUEUE_SIZE = 64
+MAX_RETRIES = 5
+
+
+def parse_date(value):
+    """Parse an ISO date/datetime (UTC) or epoch milliseconds into epoch milliseconds."""
+    if str(value).isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def build_shards(symbol, start_ms, end_ms, shard_hours=DEFAULT_SHARD_HOURS):
+    """Split [start_ms, end_ms] into contiguous shards of `shard_hours`."""
+    shard_ms = int(shard_hours * 60 * 60 * 1000)
+    shards = []
+    shard_start = start_ms
+    while shard_start <= end_ms:
+        shard_end = min(shard_start + shard_ms - 1, end_ms)
+        shards.append({
+            "_id": f"{symbol}:{shard_start}:{shard_end}",
+            "symbol": symbol,
+            "start": shard_start,
+            "end": shard_end,
+        })
+        shard_start = shard_end + 1
+    return shards
+
+
+def pending_shards(shards):
+    """Drop the shards already recorded as done by a previous run."""
+    done = {
+        doc['_id'] for doc in collection_backfill_shards.find(
+            {"_id": {"$in": [shard['_id'] for shard in shards]}, "status": "done"},
+            {"_id": 1}
+        )
+    }
+    return [shard for shard in shards if shard['_id'] not in done]
+
+
+def mark_shard_done(shard, records):
+    collection_backfill_shards.update_one(
+        {"_id": shard['_id']},
+        {"$set": {
+            "symbol": shard['symbol'],
+            "start": shard['start'],
+            "end": shard['end'],
+            "status": "done",
+            "records": records,
+            "completed_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+
+async def fetch_page(session, semaphore, base_url, params):
+    """
+    GET one aggTrades page, retrying on 429/5xx and network errors.
+    Pacing goes through the shared limiter of the host's BinanceClient.
+    """
+    path = "/api/v3/aggTrades"
+    client = get_client(base_url)
+    for attempt in range(MAX_RETRIES):
+        wait = client.limiter.reserve(AGG_TRADES_WEIGHT)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.get(f"{client.base_url}{path}", params=params) as response:
+                    client.limiter.update_from_headers(response.headers)
+                    latency = time.perf_counter() - start
+                    if response.status == 200:
+                        client.record(path, latency, AGG_TRADES_WEIGHT)
+                        return await response.json()
+                    if response.status in (418, 429):
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        client.record(path, latency, AGG_TRADES_WEIGHT, retry=True, rate_limited=True)
+                        client.limiter.pause(retry_after)
+                        logging.warning(f"Rate limit exceeded on backfill. Waiting {retry_after}s before retry...")
+                        continue
+                    if response.status < 500:
+                        client.record(path, latency, AGG_TRADES_WEIGHT, error=True)
+                        text = await response.text()
+                        raise RuntimeError(f"Error downloading data: {response.status} - {text}")
+                    client.record(path, latency, AGG_TRADES_WEIGHT, error=True, retry=True)
+                    logging.warning(f"Binance returned {response.status} on backfill; retrying.")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                client.record(path, time.perf_counter() - start, AGG_TRADES_WEIGHT, error=True, retry=True)
+                logging.warning(f"Request error on backfill ({e}); retrying.")
+        # Espera fora do semáforo para não bloquear outras requisições
+        await asyncio.sleep(backoff_delay(attempt))
+    raise RuntimeError(f"Giving up on {params} after {MAX_RETRIES} attempts.")
+
+
+async def fetch_shard(session, semaphore, queue, base_url, shard, limit):
+    """Page through one shard and push its trades onto the writer queue."""
+    symbol = shard['symbol']
+    # A Binance limita startTime/endTime a janelas de 1 hora; depois segue por fromId
+    params = {
+        "symbol": symbol,
+        "startTime": shard['start'],
+        "endTime": min(shard['start'] + AGG_TRADES_WINDOW_MS - 1, shard['end']),
+        "limit": limit,
+    }
+    while True:
+        data = await fetch_page(session, semaphore, base_url, params)
+        if not data:
+            if 'startTime' in params and params['endTime'] < shard['end']:
+                params['startTime'] = params['endTime'] + 1
+                params['endTime'] = min(params['startTime'] + AGG_TRADES_WINDOW_MS - 1, shard['end'])
+                continue
+            break
+        trades = [trade for trade in data if trade['T'] <= shard['end']]
+        if trades:
+            await queue.put((shard, trades, False))
+        if len(trades) < len(data) or ('startTime' not in params and len(data) < limit):
+            break
+        params = {"symbol": symbol, "fromId": data[-1]['a'] + 1, "limit": limit}
+    await queue.put((shard, [], True))
+
+
+async def writer(queue, stats):
+    """Background writer: persist queued pages and mark shards done when complete."""
+    written = {}
+    failed = set()
+    while True:
+        item = await queue.get()
+        try:
+            if item is None:
+                return
+            shard, trades, last = item
+            if trades:
+                try:
+                    df = pd.DataFrame(agg_trades_to_records(shard['symbol'], trades))
+                    summary = await asyncio.to_thread(insert_data_into_mongo, df, collection_csv)
+                except Exception as e:
+                    # Página perdida (MongoDB fora, lease de escrita esgotado): o shard não pode ser marcado como feito
+                    logging.error(f"Error writing a page of shard {shard['_id']}: {e}")
+                    summary = {"inserted": 0, "duplicates": 0, "failed": len(trades)}
+                written[shard['_id']] = written.get(shard['_id'], 0) + summary['inserted'] + summary['duplicates']
+                stats['inserted'] += summary['inserted']
+                stats['duplicates'] += summary['duplicates']
+                stats['failed'] += summary['failed']
+                if summary['failed']:
+                    failed.add(shard['_id'])
+            if last:
+                if shard['_id'] in failed:
+                    failed.discard(shard['_id'])
+                    stats['shards_failed'] += 1
+                    logging.error(f"Shard {shard['_id']} had write failures; it will be retried on the next run.")
+                else:
+                    await asyncio.to_thread(mark_shard_done, shard, written.get(shard['_id'], 0))
+                    stats['shards_done'] += 1
+                written.pop(shard['_id'], None)
+        except Exception as e:
+            logging.error(f"Error in backfill writer: {e}")
+        finally:
+            queue.task_done()
+
+
+async def run_backfill(symbol, start_ms, end_ms, shard_hours=DEFAULT_SHARD_HOURS,
+                       concurrency=DEFAULT_CONCURRENCY, queue_size=DEFAULT_QUEUE_SIZE,
+                       base_url=None, limit=1000):
+    """Backfill [start_ms, end_ms] for a symbol and return the run statistics."""
+    base_url = base_url or BINANCE_API_URL
+    shards = pending_shards(build_shards(symbol, start_ms, end_ms, shard_hours))
+    stats = {"shards": len(shards), "shards_done": 0, "shards_failed": 0,
+             "inserted": 0, "duplicates": 0, "failed": 0}
+    logging.info(f"Backfill {symbol}: {len(shards)} shards pending.")
+    if not shards:
+        return stats
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    semaphore = asyncio.Semaphore(concurrency)
+    writer_task = asyncio.create_task(writer(queue, stats))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    headers = {'Accept-Encoding': 'gzip, deflate'}
+    async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                     timeout=aiohttp.ClientTimeout(total=30)) as session:
+        # Cada shard vira uma tarefa; o semáforo limita as requisições simultâneas
+        results = await asyncio.gather(
+            *(fetch_shard(session, semaphore, queue, base_url, shard, limit) for shard in shards),
+            return_exceptions=True
+        )
+    for shard, result in zip(shards, results):
+        if isinstance(result, Exception):
+            stats['shards_failed'] += 1
+            logging.error(f"Shard {shard['_id']} failed: {result}")
+    await queue.put(None)
+    await writer_task
+    logging.info(f"Backfill {symbol} finished: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel historical backfill of Binance aggTrades.")
+    parser.add_argument('--symbol', default='BTCUSDT')
+    parser.add_argument('--start', required=True, help="ISO date (UTC) or epoch ms")
+    parser.add_argument('--end', default=None, help="ISO date (UTC) or epoch ms; defaults to now")
+    parser.add_argument('--shard-hours', type=float, default=DEFAULT_SHARD_HOURS)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--base-url', default=None, help="Binance REST base URL (e.g. a local fake server)")
+    args = parser.parse_args()
+
+    init_storage()
+    start_ms = parse_date(args.start)
+    end_ms = parse_date(args.end) if args.end else int(datetime.now(timezone.utc).timestamp() * 1000)
+    stats = asyncio.run(run_backfill(
+        args.symbol, start_ms, end_ms,
+        shard_hours=args.shard_hours,
+        concurrency=args.concurrency,
+        queue_size=args.queue_size,
+        base_url=args.base_url,
+    ))
+    if stats['shards_failed']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Limite de peso por minuto da Binance (spot: 6000) e margem de segurança usada pelo limitador
+BINANCE_WEIGHT_LIMIT = int(os.getenv('BINANCE_WEIGHT_LIMIT', '6000'))
+BINANCE_WEIGHT_SAFETY = float(os.getenv('BINANCE_WEIGHT_SAFETY', '0.9'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '10'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+
+USED_WEIGHT_HEADER = re.compile(r'^x-mbx-used-weight-(\d+)([smhd])$', re.IGNORECASE)
+
+
+class WeightLimiter:
+    """
+    Token bucket sized to the exchange's request-weight budget per minute.
+    The bucket is corrected from the `X-MBX-USED-WEIGHT-1M` header returned by
+    Binance and paused on `Retry-After`, so requests are paced just under the limit.
+    """
+
+    def __init__(self, limit_per_minute=BINANCE_WEIGHT_LIMIT, safety=BINANCE_WEIGHT_SAFETY):
+        self.capacity = limit_per_minute * safety
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.used_weight = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, weight=1):
+        """Take `weight` tokens and return how many seconds the caller must wait first."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= weight
+            wait = max(0.0, self.paused_until - now)
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def wait_time(self, weight=1):
+        """Seconds until `weight` tokens are available, without taking them."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.paused_until - now)
+            if self.tokens < weight:
+                wait = max(wait, (weight - self.tokens) / self.rate)
+            return wait
+
+    def acquire(self, weight=1):
+        wait = self.reserve(weight)
+        if wait > 0:
+            time.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """Align the bucket with the weight the server reports as already used."""
+        for name, value in headers.items():
+            match = USED_WEIGHT_HEADER.match(name)
+            if not match or (match.group(1), match.group(2).lower()) != ('1', 'm'):
+                continue
+            try:
+                used = int(value)
+            except ValueError:
+                continue
+            with self._lock:
+                self._refill(time.monotonic())
+                self.used_weight = used
+                self.tokens = min(self.tokens, self.capacity - used)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (Retry-After / ban)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)
+
+
+def parse_retry_after(value, default=60.0):
+    """Seconds to wait from a Retry-After header: delta-seconds or an HTTP-date (RFC 9110)."""
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class BinanceClient:
+    """Shared HTTP client for one Binance host: pooled keep-alive session, limiter and counters."""
+
+    def __init__(self, base_url, weight_limit=BINANCE_WEIGHT_LIMIT, pool_size=HTTP_POOL_SIZE,
+                 timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = WeightLimiter(weight_limit)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self._stats = defaultdict(lambda: {
+            "requests": 0, "errors": 0, "retries": 0, "rate_limited": 0,
+            "weight": 0, "latency_total": 0.0, "latency_max": 0.0,
+        })
+        self._stats_lock = threading.Lock()
+
+    def record(self, endpoint, latency=None, weight=0, error=False, retry=False, rate_limited=False):
+        with self._stats_lock:
+            stats = self._stats[endpoint]
+            if latency is not None:
+                stats["requests"] += 1
+                stats["latency_total"] += latency
+                stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["weight"] += weight
+            stats["errors"] += int(error)
+            stats["retries"] += int(retry)
+            stats["rate_limited"] += int(rate_limited)
+
+    def stats(self):
+        """Per-endpoint counters plus the last used weight reported by the server."""
+        with self._stats_lock:
+            snapshot = {endpoint: dict(values) for endpoint, values in self._stats.items()}
+        for values in snapshot.values():
+            values["latency_avg"] = values["latency_total"] / values["requests"] if values["requests"] else 0.0
+        return {"used_weight_1m": self.limiter.used_weight, "endpoints": snapshot}
+
+    def get(self, path, params=None, headers=None, weight=1):
+        """
+        GET `path` pacing on the weight limiter. Retries 429/418 after Retry-After and
+        5xx/timeouts with jittered exponential backoff; other responses are returned as-is.
+        """
+        url = f"{self.base_url}{path}"
+        response = None
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(weight)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self.record(path, time.perf_counter() - start, weight, error=True, retry=attempt < self.max_retries)
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning(f"{path}: {e}; retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+
+            self.limiter.update_from_headers(response.headers)
+            if response.status_code in (418, 429):
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                self.record(path, time.perf_counter() - start, weight, retry=True, rate_limited=True)
+                logging.warning(f"Rate limit exceeded on {path}. Waiting {retry_after}s before retry...")
+                self.limiter.pause(retry_after)
+                continue
+            if response.status_code >= 500:
+                self.record(path, time.perf_counter() - start, weight, error=True, retry=attempt < self.max_retries)
+                if attempt == self.max_retries:
+                    break
+                delay = backoff_delay(attempt)
+                logging.warning(f"{path}: HTTP {response.status_code}; retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+            self.record(path, time.perf_counter() - start, weight, error=response.status_code >= 400)
+            return response
+        return response
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, weight_limit=BINANCE_WEIGHT_LIMIT):
+    """Return the process-wide client for a Binance host, creating it on first use."""
+    key = base_url.rstrip('/')
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = BinanceClient(key, weight_limit=weight_limit)
+        return _clients[key]
+
+
+def all_client_stats():
+    with _clients_lock:
+        clients = dict(_clients)
+    return {base_url: client.stats() for base_url, client in clients.items()}
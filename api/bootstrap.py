@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import logging
+import os
+import struct
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from utils import (
+    collection_checkpoints,
+    collection_csv,
+    csv_file_path,
+    init_storage,
+    insert_data_into_mongo,
+    normalize_time_columns,
+)
+
+try:
+    import pyarrow.csv as pa_csv
+except ImportError:
+    # Sem pyarrow, usa o leitor em chunks do pandas
+    pa_csv = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+BOOTSTRAP_CHUNK_SIZE = int(os.getenv('BOOTSTRAP_CHUNK_SIZE', '200000'))
+BOOTSTRAP_WORKERS = int(os.getenv('BOOTSTRAP_WORKERS', '4'))
+
+
+def file_key(path):
+    """Identify a file by name, size and mtime so a replaced file starts from scratch."""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def checkpoint_id(path):
+    return f"bootstrap:{os.path.abspath(path)}"
+
+
+def load_progress(path):
+    progress = collection_checkpoints.find_one({"_id": checkpoint_id(path)})
+    if progress and progress.get('file_key') != file_key(path):
+        logging.warning(f"{path} changed since the last bootstrap; starting over.")
+        return None
+    return progress
+
+
+def save_progress(path, rows_committed, chunks_committed, done=False):
+    collection_checkpoints.update_one(
+        {"_id": checkpoint_id(path)},
+        {"$set": {
+            "file_key": file_key(path),
+            "rows_committed": rows_committed,
+            "chunks_committed": chunks_committed,
+            "done": done,
+            "updated_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+
+def iter_chunks(path, chunksize, skip_rows=0):
+    """Yield DataFrame chunks, using pyarrow's streaming CSV reader when available."""
+    if pa_csv is not None:
+        read_options = pa_csv.ReadOptions(block_size=1 << 24, skip_rows_after_names=skip_rows)
+        reader = pa_csv.open_csv(path, read_options=read_options)
+        pending = []
+        pending_rows = 0
+        for batch in reader:
+            pending.append(batch.to_pandas())
+            pending_rows += batch.num_rows
+            if pending_rows >= chunksize:
+                df = pd.concat(pending, ignore_index=True)
+                # Mantém o tamanho exato do chunk para que o offset retomável seja estável
+                while len(df) >= chunksize:
+                    yield df.iloc[:chunksize].reset_index(drop=True)
+                    df = df.iloc[chunksize:]
+                pending, pending_rows = ([df], len(df)) if len(df) else ([], 0)
+        if pending_rows:
+            yield pd.concat(pending, ignore_index=True)
+    else:
+        skiprows = range(1, skip_rows + 1) if skip_rows else None
+        for chunk in pd.read_csv(path, chunksize=chunksize, skiprows=skiprows):
+            yield chunk
+
+
+def assign_row_ids(df, key, first_row):
+    """
+    Deterministic ObjectIds per CSV row (row time + hash of file and row number),
+    so re-inserting a chunk after a crash is rejected as duplicate instead of duplicated.
+    """
+    if 'time' in df.columns and pd.api.types.is_datetime64_any_dtype(df['time']):
+        # NaT vira o menor int64 e é levado a 0 pelo clip
+        seconds = np.clip(df['time'].values.astype('datetime64[s]').astype('int64'), 0, 0xFFFFFFFF).tolist()
+    else:
+        seconds = [0] * len(df)
+    prefix = hashlib.sha1(key.encode()).digest()[:3]
+    df['_id'] = [
+        ObjectId(struct.pack('>I', sec) + prefix + struct.pack('>Q', first_row + i)[3:])
+        for i, sec in enumerate(seconds)
+    ]
+    return df
+
+
+def _write_chunk(df):
+    return insert_data_into_mongo(df, collection_csv)
+
+
+def bootstrap_csv(path=csv_file_path, chunksize=BOOTSTRAP_CHUNK_SIZE, workers=BOOTSTRAP_WORKERS):
+    """
+    Load a CSV into `collection_csv` in chunks with parallel writers.
+    Progress (contiguous committed chunks) is checkpointed, so an interrupted
+    load resumes from the last committed chunk offset.
+    """
+    if not os.path.exists(path):
+        logging.error(f"File {path} not found.")
+        return None
+    key = file_key(path)
+    progress = load_progress(path) or {}
+    if progress.get('done'):
+        logging.info(f"{path} already loaded ({progress['rows_committed']} rows).")
+        return progress
+    rows_committed = progress.get('rows_committed', 0)
+    chunks_committed = progress.get('chunks_committed', 0)
+    if rows_committed:
+        logging.info(f"Resuming bootstrap of {path} from row {rows_committed} (chunk {chunks_committed}).")
+
+    totals = {"inserted": 0, "duplicates": 0, "failed": 0}
+    finished = {}
+    started = time.perf_counter()
+    in_flight = {}
+
+    def commit_contiguous():
+        nonlocal rows_committed, chunks_committed
+        # Só avança o offset sobre chunks contíguos totalmente gravados
+        while chunks_committed in finished:
+            rows, summary = finished.pop(chunks_committed)
+            if summary['failed']:
+                return False
+            rows_committed += rows
+            chunks_committed += 1
+            save_progress(path, rows_committed, chunks_committed)
+        return True
+
+    def collect(done_futures):
+        ok = True
+        for future in done_futures:
+            index, rows = in_flight.pop(future)
+            summary = future.result()
+            for name in totals:
+                totals[name] += summary[name]
+            finished[index] = (rows, summary)
+            ok = commit_contiguous() and ok
+        elapsed = time.perf_counter() - started
+        processed = totals['inserted'] + totals['duplicates']
+        logging.info(
+            f"Bootstrap: {rows_committed} rows committed, {processed / elapsed if elapsed else 0:,.0f} rows/s "
+            f"({totals['inserted']} inserted, {totals['duplicates']} duplicates, {totals['failed']} failed)."
+        )
+        return ok
+
+    ok = True
+    index = chunks_committed
+    first_row = rows_committed
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in iter_chunks(path, chunksize, skip_rows=rows_committed):
+            rows = len(chunk)
+            chunk = assign_row_ids(normalize_time_columns(chunk), key, first_row)
+            in_flight[executor.submit(_write_chunk, chunk)] = (index, rows)
+            index += 1
+            first_row += rows
+            # Limita os chunks em memória a dois por worker
+            if len(in_flight) >= workers * 2:
+                done_futures, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                ok = collect(done_futures) and ok
+                if not ok:
+                    break
+        if in_flight:
+            done_futures, _ = wait(list(in_flight))
+            ok = collect(done_futures) and ok
+
+    if ok:
+        save_progress(path, rows_committed, chunks_committed, done=True)
+        logging.info(f"Bootstrap of {path} finished: {rows_committed} rows in {time.perf_counter() - started:.1f}s.")
+    else:
+        logging.error(f"Bootstrap of {path} stopped at row {rows_committed} after write failures; run again to resume.")
+    return {"rows_committed": rows_committed, "chunks_committed": chunks_committed, "done": ok, **totals}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunked, parallel and resumable CSV bootstrap loader.")
+    parser.add_argument('path', nargs='?', default=csv_file_path)
+    parser.add_argument('--chunksize', type=int, default=BOOTSTRAP_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=BOOTSTRAP_WORKERS)
+    args = parser.parse_args()
+    init_storage()
+    result = bootstrap_csv(args.path, chunksize=args.chunksize, workers=args.workers)
+    if not result or not result['done']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
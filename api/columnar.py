@@ -0,0 +1,114 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from queries import build_range_query
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+COLUMNAR_BATCH_SIZE = int(os.getenv('COLUMNAR_BATCH_SIZE', '50000'))
+
+# Campos numéricos conhecidos de `csv_data` e seus dtypes
+NUMERIC_FIELDS = {
+    'price': 'float',
+    'quantity': 'float',
+    'aggId': 'int64',
+}
+DEFAULT_FIELDS = ('symbol', 'price', 'quantity')
+
+
+def _allocate(fields, size, float_dtype):
+    columns = {'time': np.empty(size, dtype='datetime64[ms]')}
+    for field in fields:
+        if field == 'symbol':
+            columns[field] = np.empty(size, dtype=np.int32)
+        elif NUMERIC_FIELDS.get(field) == 'int64':
+            # aggId pode faltar (linhas do CSV); usa -1 como ausente
+            columns[field] = np.full(size, -1, dtype=np.int64)
+        else:
+            columns[field] = np.empty(size, dtype=float_dtype)
+    return columns
+
+
+def _grow(columns, size):
+    for name, array in columns.items():
+        grown = np.empty(size, dtype=array.dtype)
+        grown[:len(array)] = array
+        columns[name] = grown
+
+
+def fetch_trades_frame(collection, start=None, end=None, symbol=None, fields=DEFAULT_FIELDS,
+                       float_dtype='float64', batch_size=COLUMNAR_BATCH_SIZE):
+    """
+    Load trades into a compact DataFrame indexed by time.
+
+    The cursor (projected to `fields`, filtered by [start, end) and symbol) is
+    read in batches of `batch_size` documents that are copied into NumPy arrays
+    grown geometrically: datetime64[ms] time, float32/float64 price and quantity
+    (`float_dtype`) and a categorical symbol. pymongo still decodes each
+    document into a dict, but only one batch of them is alive at a time and no
+    `_id` column or object-dtype frame is built.
+    """
+    fields = [field for field in fields if field != 'time']
+    query = build_range_query('time', symbol, start, end)
+    # Sem count_documents prévio (seria uma varredura extra): os arrays crescem conforme a leitura
+    columns = _allocate(fields, batch_size, float_dtype)
+    categories = {}
+    projection = {"_id": 0, "time": 1, **{field: 1 for field in fields}}
+    cursor = collection.find(query, projection).sort("time", 1).batch_size(batch_size)
+
+    size = 0
+    batch = []
+
+    def flush(batch, size):
+        n = len(batch)
+        if size + n > len(columns['time']):
+            _grow(columns, max(size + n, len(columns['time']) * 2))
+        columns['time'][size:size + n] = [doc.get('time') for doc in batch]
+        for field in fields:
+            if field == 'symbol':
+                # Código -1 = símbolo ausente (NaN no Categorical)
+                columns[field][size:size + n] = [
+                    categories.setdefault(doc['symbol'], len(categories)) if doc.get('symbol') is not None else -1
+                    for doc in batch
+                ]
+            elif NUMERIC_FIELDS.get(field) == 'int64':
+                columns[field][size:size + n] = [
+                    doc.get(field) if doc.get(field) is not None else -1 for doc in batch
+                ]
+            else:
+                columns[field][size:size + n] = [
+                    doc.get(field) if doc.get(field) is not None else np.nan for doc in batch
+                ]
+        return size + n
+
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            size = flush(batch, size)
+            batch = []
+    if batch:
+        size = flush(batch, size)
+
+    if size < len(columns['time']):
+        # Devolve a capacidade não usada em vez de manter views sobre os buffers maiores
+        for name in columns:
+            columns[name] = columns[name][:size].copy()
+
+    data = {}
+    for field in fields:
+        array = columns[field][:size]
+        if field == 'symbol':
+            labels = [None] * len(categories)
+            for label, code in categories.items():
+                labels[code] = label
+            data[field] = pd.Categorical.from_codes(array, categories=pd.Index(labels, dtype=object))
+        else:
+            data[field] = array
+    index = pd.DatetimeIndex(columns['time'][:size], name='time')
+    df = pd.DataFrame(data, index=index, copy=False)
+    logging.info(f"{size} registros carregados de '{collection.name}' em formato colunar.")
+    return df
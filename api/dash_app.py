@@ -1,10 +1,17 @@
 # Import necessary libraries
 import dash
-from dash import dcc, html
+from dash import ctx, dcc, html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import pandas as pd
-from api_client import fetch_data, collection_csv, collection_historical_exercise
+from api_client import collection_csv, collection_historical_exercise, db, init_storage
+from app_state import app_state
+from dashboard_data import DASH_SNAPSHOT_MODE, create_dashboard_data
+from downsample import CHART_POINT_BUDGET, chart_series, lttb
+from exercise_index import ExerciseQueries
+from volatility import ESTIMATORS, VOLATILITY_COLLECTION, VOLATILITY_SPECS, load_volatility
+from export import EXPORT_FORMATS, export_collection
+from metrics import LOAD_SECONDS, install_metrics, timer
 import plotly.express as px
 import plotly.graph_objs as go
 import logging
@@ -15,66 +22,28 @@ logging.basicConfig(level=logging.INFO)
 # Create Dash app with suppress_callback_exceptions=True to allow dynamic layout
 app_dash = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
                      suppress_callback_exceptions=True)
+# /metrics no servidor do Dash, com a latência de cada callback
+install_metrics(app_dash.server)
 
-# Global variables for DataFrames
-df_csv = pd.DataFrame()
-df_historical_exercise = pd.DataFrame()
-df_daily = pd.DataFrame()
+# Dados do dashboard: snapshot imutável trocado atomicamente a cada atualização
+# (local, publicado para outros processos ou anexado do SnapshotStore; ver DASH_SNAPSHOT_MODE)
+dashboard_data = create_dashboard_data(db, collection_csv, collection_historical_exercise)
+# Índices e figuras em cache do gráfico de exercício, por versão do snapshot
+exercise_queries = ExerciseQueries()
 
 # Function to load and process data
 def load_data():
-    global df_csv, df_historical_exercise, df_daily
-    logging.info("Carregando dados das coleções MongoDB.")
+    """Full reload of the dashboard snapshot."""
     try:
-        # Recuperar dados da coleção 'csv_data'
-        df_csv = fetch_data(collection_csv)
-        logging.info(f"Dados do CSV recuperados:\n{df_csv.head()}")
-        logging.info(f"Tipos de dados do df_csv:\n{df_csv.dtypes}")
-        
-        if not df_csv.empty:
-            logging.info("Dados históricos de BTC carregados com sucesso.")
-            if {'price', 'quantity'}.issubset(df_csv.columns):
-                df_csv['price'] = pd.to_numeric(df_csv['price'], errors='coerce')
-                df_csv['quantity'] = pd.to_numeric(df_csv['quantity'], errors='coerce')
-                logging.info("Colunas 'price' e 'quantity' convertidas para numéricas.")
-                
-                # Filtrar dados a partir de 2020 e reamostrar diariamente
-                df_filtered = df_csv[df_csv.index >= pd.Timestamp("2020-01-01")]
-                logging.info(f"Filtrando dados a partir de 2020: {df_filtered.shape[0]} registros restantes.")
-                
-                df_daily = df_filtered.resample('D').agg({
-                    'price': ['mean', 'min', 'max'],
-                    'quantity': 'sum'
-                }).reset_index()
-                df_daily.columns = ['time', 'price_mean', 'price_min', 'price_max', 'total_quantity']
-                logging.info(f"Dados reamostrados diariamente:\n{df_daily.head()}")
-            else:
-                logging.warning("Colunas esperadas 'price' ou 'quantity' estão ausentes nos dados de preço de BTC.")
-                df_daily = pd.DataFrame()
-        else:
-            logging.warning("Dados históricos de BTC estão vazios ou não puderam ser carregados.")
-            df_daily = pd.DataFrame()
-
-        # Recuperar dados da coleção 'historical_exercise_data'
-        df_historical_exercise = fetch_data(collection_historical_exercise)
-        logging.info(f"Dados de exercício histórico recuperados:\n{df_historical_exercise.head()}")
-        logging.info(f"Tipos de dados do df_historical_exercise:\n{df_historical_exercise.dtypes}")
-        
-        if not df_historical_exercise.empty:
-            if 'expiryDate' in df_historical_exercise.columns:
-                if not pd.api.types.is_datetime64_any_dtype(df_historical_exercise['expiryDate']):
-                    df_historical_exercise['expiryDate'] = pd.to_datetime(df_historical_exercise['expiryDate'], errors='coerce')
-                    logging.info("Coluna 'expiryDate' convertida para datetime.")
-            else:
-                logging.warning("Coluna esperada 'expiryDate' está ausente nos dados de exercício histórico.")
-        else:
-            logging.warning("Dados de exercício histórico estão vazios ou não puderam ser carregados.")
-
+        with timer(LOAD_SECONDS, function='load_data', source=DASH_SNAPSHOT_MODE):
+            dashboard_data.full_reload()
     except Exception as e:
         logging.error(f"Erro ao carregar dados: {e}")
 
-# Load data at startup
-load_data()
+def warm_up():
+    """Startup hook: create indexes and load the dashboard data (runs in the background)."""
+    init_storage()
+    load_data()
 
 # Layout
 app_dash.layout = dbc.Container([
@@ -86,6 +55,7 @@ app_dash.layout = dbc.Container([
             dcc.Tabs(id='tabs', value='tab-csv', children=[
                 dcc.Tab(label='Dados CSV', value='tab-csv'),
                 dcc.Tab(label='Historical Exercise Records', value='tab-historical-exercise'),
+                dcc.Tab(label='Volatilidade Realizada', value='tab-volatility'),
             ]),
             width=12
         )
@@ -93,9 +63,11 @@ app_dash.layout = dbc.Container([
     html.Div(id='tabs-content'),
     dcc.Interval(
         id='interval-component',
-        interval=10*60*1000,  # Update every 10 minutes
+        interval=60*1000,  # Atualização incremental a cada minuto
         n_intervals=0
     ),
+    # Verifica a prontidão dos dados enquanto o warm-up roda em segundo plano
+    dcc.Interval(id='readiness-interval', interval=2*1000, n_intervals=0),
     # Componentes de Download Separados
     dcc.Download(id="download-aggregated-csv"),
     dcc.Download(id="download-complete-csv"),
@@ -104,43 +76,87 @@ app_dash.layout = dbc.Container([
 ], fluid=True)
 
 # Callback to render tab content
-@app_dash.callback(Output('tabs-content', 'children'), [Input('tabs', 'value')])
-def render_content(tab):
+@app_dash.callback(
+    [Output('tabs-content', 'children'), Output('readiness-interval', 'disabled')],
+    [Input('tabs', 'value'), Input('readiness-interval', 'n_intervals')]
+)
+def render_content(tab, n_readiness):
+    if not app_state.ready:
+        # Primeiro uso sem warm-up iniciado por main.py (ex.: servidor WSGI)
+        app_state.start_warmup(warm_up)
+        return generate_loading_layout(), False
     if tab == 'tab-csv':
-        return generate_csv_layout()
+        return generate_csv_layout(), True
     elif tab == 'tab-historical-exercise':
-        return generate_historical_exercise_layout()
+        return generate_historical_exercise_layout(), True
+    elif tab == 'tab-volatility':
+        return generate_volatility_layout(), True
+    return None, True
 
-def generate_csv_layout():
-    if not df_daily.empty:
-        # Gráfico para preço médio
-        fig_mean = px.line(
-            df_daily,
-            x='time',
-            y='price_mean',
-            title='Preço Médio Diário ao Longo do Tempo',
-            labels={'time': 'Data', 'price_mean': 'Preço Médio (USD)'},
-            markers=True
-        )
+def generate_loading_layout():
+    state = app_state.snapshot()
+    if state['status'] == 'error':
+        message = f"Erro ao carregar os dados: {state['error']}"
+    else:
+        message = "Carregando dados... a página será atualizada automaticamente."
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col(html.H3(message, className="text-center text-muted my-5"))
+        ])
+    ], fluid=True)
 
-        # Gráfico para preço mínimo e máximo
-        fig_min_max = px.line(
-            df_daily,
-            x='time',
-            y=['price_min', 'price_max'],
-            title='Preços Mínimo e Máximo Diários ao Longo do Tempo',
-            labels={'time': 'Data', 'value': 'Preço (USD)', 'variable': 'Tipo'},
-            markers=True
-        )
+def export_format_selector(component_id):
+    return dcc.RadioItems(
+        id=component_id,
+        options=[{'label': fmt.upper(), 'value': fmt} for fmt in EXPORT_FORMATS],
+        value='parquet',
+        inline=True,
+        inputStyle={'margin-right': '4px', 'margin-left': '12px'}
+    )
 
-        # Gráfico para quantidade total
-        fig_quantity = px.bar(
-            df_daily,
-            x='time',
-            y='total_quantity',
-            title='Quantidade Total Diária de Transações',
-            labels={'time': 'Data', 'total_quantity': 'Quantidade Total'},
-        )
+LEVEL_LABELS = {'1m': 'por minuto', '1h': 'por hora', '1d': 'diário'}
+
+def build_csv_figures(level, df_mean, df_min_max, df_quantity):
+    """Figures of the CSV tab from already downsampled series (bounded number of points)."""
+    label = LEVEL_LABELS.get(level, level)
+    # Gráfico para preço médio
+    fig_mean = px.line(
+        df_mean,
+        x='time',
+        y='price_mean',
+        title=f'Preço Médio ao Longo do Tempo ({label})',
+        labels={'time': 'Data', 'price_mean': 'Preço Médio (USD)'},
+        markers=True
+    )
+
+    # Gráfico para preço mínimo e máximo
+    fig_min_max = px.line(
+        df_min_max,
+        x='time',
+        y=['price_min', 'price_max'],
+        title=f'Preços Mínimo e Máximo ao Longo do Tempo ({label})',
+        labels={'time': 'Data', 'value': 'Preço (USD)', 'variable': 'Tipo'},
+        markers=True
+    )
+
+    # Gráfico para quantidade total
+    fig_quantity = px.bar(
+        df_quantity,
+        x='time',
+        y='total_quantity',
+        title=f'Quantidade Total de Transações ({label})',
+        labels={'time': 'Data', 'total_quantity': 'Quantidade Total'},
+    )
+    figures = [fig_mean, fig_min_max, fig_quantity]
+    for fig in figures:
+        # Mantém o zoom do usuário quando a figura é substituída pela do novo nível
+        fig.update_layout(uirevision='csv-charts')
+    return figures
+
+def generate_csv_layout():
+    df_daily = dashboard_data.snapshot.df_daily
+    if not df_daily.empty:
+        fig_mean, fig_min_max, fig_quantity = build_csv_figures(*chart_series(db, df_daily))
 
         layout = dbc.Container([
             dbc.Row([
@@ -157,8 +173,11 @@ def generate_csv_layout():
                     html.Button("Baixar CSV Agregado", id="btn-download-aggregated", className="mt-3 btn btn-primary"),
                 ], width='auto'),
                 dbc.Col([
-                    html.Button("Baixar CSV Completo", id="btn-download-complete", className="mt-3 btn btn-secondary")
+                    html.Button("Baixar Dados Completos", id="btn-download-complete", className="mt-3 btn btn-secondary")
                 ], width='auto'),
+                dbc.Col([
+                    export_format_selector('export-format-complete')
+                ], width='auto', className="mt-3"),
             ], className="mt-3")
         ], fluid=True)
     else:
@@ -170,18 +189,22 @@ def generate_csv_layout():
     return layout
 
 def generate_historical_exercise_layout():
-    if not df_historical_exercise.empty:
+    snapshot = dashboard_data.snapshot
+    # O índice (ordenado por expiryDate) fornece os filtros sem varrer o DataFrame
+    index = exercise_queries.index(snapshot)
+    if not snapshot.df_historical_exercise.empty and len(index.dates):
+        first_date, last_date = pd.Timestamp(index.dates[0]), pd.Timestamp(index.dates[-1])
         dropdown = dcc.Dropdown(
             id='filter-strikeResult',
-            options=[{'label': res, 'value': res} for res in df_historical_exercise['strikeResult'].unique()],
+            options=[{'label': res, 'value': res} for res in index.results()],
             placeholder="Filtrar por Resultado de Strike"
         )
         date_picker = dcc.DatePickerRange(
             id='date-picker',
-            min_date_allowed=df_historical_exercise['expiryDate'].min(),
-            max_date_allowed=df_historical_exercise['expiryDate'].max(),
-            start_date=df_historical_exercise['expiryDate'].min(),
-            end_date=df_historical_exercise['expiryDate'].max()
+            min_date_allowed=first_date,
+            max_date_allowed=last_date,
+            start_date=first_date,
+            end_date=last_date
         )
         
         layout = dbc.Container([
@@ -196,6 +219,9 @@ def generate_historical_exercise_layout():
                 dbc.Col([
                     html.Button("Download Historical Exercise Data", id="btn-download-historical-exercise", className="mt-3 btn btn-primary"),
                 ], width='auto'),
+                dbc.Col([
+                    export_format_selector('export-format-historical-exercise')
+                ], width='auto', className="mt-3"),
             ], className="mt-3")
         ], fluid=True)
     else:
@@ -206,6 +232,41 @@ def generate_historical_exercise_layout():
         ], fluid=True)
     return layout
 
+def parse_relayout_range(relayout_data):
+    """X range from a Plotly relayoutData event: (start, end), 'auto' on reset, None if unrelated."""
+    if not relayout_data:
+        return None
+    if relayout_data.get('xaxis.autorange'):
+        return 'auto'
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+        return pd.Timestamp(start), pd.Timestamp(end)
+    return None
+
+# Callback de zoom/pan: busca o nível da pirâmide adequado ao intervalo visível
+@app_dash.callback(
+    [Output('mean-price', 'figure'), Output('min-max-price', 'figure'), Output('total-quantity', 'figure')],
+    [Input('mean-price', 'relayoutData'), Input('min-max-price', 'relayoutData'), Input('total-quantity', 'relayoutData')],
+    prevent_initial_call=True
+)
+def update_csv_charts(relayout_mean, relayout_min_max, relayout_quantity):
+    relayout = {
+        'mean-price': relayout_mean,
+        'min-max-price': relayout_min_max,
+        'total-quantity': relayout_quantity,
+    }.get(ctx.triggered_id)
+    visible = parse_relayout_range(relayout)
+    if visible is None:
+        return dash.no_update, dash.no_update, dash.no_update
+    start, end = (None, None) if visible == 'auto' else visible
+    try:
+        return build_csv_figures(*chart_series(db, dashboard_data.snapshot.df_daily, start, end))
+    except Exception as e:
+        logging.error(f"Erro ao atualizar os gráficos para o intervalo {start} - {end}: {e}")
+        return dash.no_update, dash.no_update, dash.no_update
+
 # Callback para download do CSV Agregado
 @app_dash.callback(
     Output("download-aggregated-csv", "data"),
@@ -214,33 +275,46 @@ def generate_historical_exercise_layout():
 )
 def download_aggregated_csv(n_clicks):
     logging.info(f"Botão de download CSV Agregado clicado {n_clicks} vezes.")
+    df_daily = dashboard_data.snapshot.df_daily
     if not df_daily.empty:
         return dcc.send_data_frame(df_daily.to_csv, "dados_resumidos.csv")
     return None
 
-# Callback para download do CSV Completo
+# Callback para download dos dados completos (exportação em disco, reaproveitada entre cliques)
 @app_dash.callback(
     Output("download-complete-csv", "data"),
     Input("btn-download-complete", "n_clicks"),
+    State("export-format-complete", "value"),
     prevent_initial_call=True
 )
-def download_complete_csv(n_clicks):
-    logging.info(f"Botão de download CSV Completo clicado {n_clicks} vezes.")
-    if not df_csv.empty:
-        return dcc.send_data_frame(df_csv.to_csv, "dados_completos.csv")
-    return None
+def download_complete_csv(n_clicks, export_format):
+    logging.info(f"Botão de download Completo clicado {n_clicks} vezes ({export_format}).")
+    try:
+        path = export_collection(collection_csv, export_format or 'parquet')
+    except Exception as e:
+        logging.error(f"Erro ao exportar dados completos: {e}")
+        return None
+    return dcc.send_file(path, filename=f"dados_completos{EXPORT_FORMATS[export_format or 'parquet'][0]}")
 
-# Callback para download do CSV de Exercício Histórico
+# Callback para download dos dados de Exercício Histórico no período selecionado
 @app_dash.callback(
     Output("download-historical-exercise-csv", "data"),
     Input("btn-download-historical-exercise", "n_clicks"),
+    State("export-format-historical-exercise", "value"),
+    State("date-picker", "start_date"),
+    State("date-picker", "end_date"),
     prevent_initial_call=True
 )
-def download_historical_exercise_csv(n_clicks):
-    logging.info(f"Botão de download Histórico de Exercício clicado {n_clicks} vezes.")
-    if not df_historical_exercise.empty:
-        return dcc.send_data_frame(df_historical_exercise.to_csv, "dados_historical_exercise.csv")
-    return None
+def download_historical_exercise_csv(n_clicks, export_format, start_date, end_date):
+    logging.info(f"Botão de download Histórico de Exercício clicado {n_clicks} vezes ({export_format}).")
+    # O DatePickerRange é inclusivo; a exportação usa [start, end)
+    end = pd.Timestamp(end_date) + pd.Timedelta(days=1) if end_date else None
+    try:
+        path = export_collection(collection_historical_exercise, export_format or 'parquet', start=start_date, end=end)
+    except Exception as e:
+        logging.error(f"Erro ao exportar dados de exercício histórico: {e}")
+        return None
+    return dcc.send_file(path, filename=f"dados_historical_exercise{EXPORT_FORMATS[export_format or 'parquet'][0]}")
 
 # Callback para atualizar o gráfico de exercício histórico
 @app_dash.callback(
@@ -248,29 +322,23 @@ def download_historical_exercise_csv(n_clicks):
     [Input('filter-strikeResult', 'value'), Input('date-picker', 'start_date'), Input('date-picker', 'end_date')]
 )
 def update_historical_exercise_graph(strike_result, start_date, end_date):
-    df_filtered = df_historical_exercise.copy()
-    
-    if strike_result:
-        df_filtered = df_filtered[df_filtered['strikeResult'] == strike_result]
-    if start_date and end_date:
-        df_filtered = df_filtered[(df_filtered['expiryDate'] >= start_date) & (df_filtered['expiryDate'] <= end_date)]
-    
-    if df_filtered.empty:
+    # O DatePickerRange é inclusivo: filtra por dias inteiros [start_date, end_date]
+    start_day = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date else None
+    end_day = pd.Timestamp(end_date).strftime('%Y-%m-%d') if end_date else None
+    return exercise_queries.figure(
+        dashboard_data.snapshot, strike_result or None, start_day, end_day, render_exercise_candlestick
+    )
+
+def render_exercise_candlestick(candles):
+    if candles is None or not len(candles['day']):
         return go.Figure()
 
-    df_candlestick = df_filtered.groupby(df_filtered['expiryDate'].dt.date).agg(
-        open_price=('realStrikePrice', 'first'),
-        high_price=('realStrikePrice', 'max'),
-        low_price=('realStrikePrice', 'min'),
-        close_price=('realStrikePrice', 'last')
-    ).reset_index()
-    
     fig = go.Figure(data=[go.Candlestick(
-        x=df_candlestick['expiryDate'],
-        open=df_candlestick['open_price'],
-        high=df_candlestick['high_price'],
-        low=df_candlestick['low_price'],
-        close=df_candlestick['close_price'],
+        x=candles['day'],
+        open=candles['open'],
+        high=candles['high'],
+        low=candles['low'],
+        close=candles['close'],
         increasing_line_color='green', decreasing_line_color='red'
     )])
 
@@ -284,11 +352,80 @@ def update_historical_exercise_graph(strike_result, start_date, end_date):
     
     return fig
 
+ESTIMATOR_LABELS = {
+    'close_to_close': 'Close-to-Close',
+    'parkinson': 'Parkinson',
+    'garman_klass': 'Garman-Klass',
+    'yang_zhang': 'Yang-Zhang',
+}
+
+def generate_volatility_layout():
+    symbols = sorted(db[VOLATILITY_COLLECTION].distinct('symbol'))
+    if not symbols:
+        return dbc.Container([
+            dbc.Row([
+                dbc.Col(html.H3("Nenhuma estimativa de volatilidade calculada ainda.", className="text-center"))
+            ])
+        ], fluid=True)
+    specs = [f"{interval}:{window}" for interval, window in VOLATILITY_SPECS]
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col(dcc.Dropdown(id='volatility-symbol', options=symbols, value=symbols[0], clearable=False), width=3),
+            dbc.Col(dcc.Dropdown(
+                id='volatility-spec',
+                options=[{'label': f"Barras {spec.split(':')[0]}, janela {spec.split(':')[1]}", 'value': spec} for spec in specs],
+                value=specs[-1], clearable=False
+            ), width=3),
+            dbc.Col(dcc.Checklist(
+                id='volatility-estimators',
+                options=[{'label': ESTIMATOR_LABELS[name], 'value': name} for name in ESTIMATORS],
+                value=list(ESTIMATORS), inline=True,
+                inputStyle={'margin-right': '4px', 'margin-left': '12px'}
+            ), width=6, className="mt-2"),
+        ], className="mb-4"),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id='volatility-graph'), md=12)
+        ]),
+    ], fluid=True)
+
+# Callback do gráfico de volatilidade realizada
+@app_dash.callback(
+    Output('volatility-graph', 'figure'),
+    [Input('volatility-symbol', 'value'), Input('volatility-spec', 'value'), Input('volatility-estimators', 'value')]
+)
+def update_volatility_graph(symbol, spec, estimators):
+    if not symbol or not spec:
+        return go.Figure()
+    interval, window = spec.split(':')
+    df_volatility = load_volatility(db, symbol, interval, int(window))
+    fig = go.Figure()
+    if df_volatility.empty:
+        return fig
+    x = df_volatility['time'].to_numpy()
+    for name in estimators or []:
+        y = df_volatility[name].to_numpy()
+        # Cada série é reduzida ao orçamento de pontos com LTTB
+        keep = lttb(x.astype('datetime64[ns]').astype('int64'), y, CHART_POINT_BUDGET)
+        fig.add_trace(go.Scatter(x=x[keep], y=y[keep] * 100, mode='lines', name=ESTIMATOR_LABELS[name]))
+    fig.update_layout(
+        title=f"Volatilidade Realizada Anualizada - {symbol} (barras {interval}, janela {window})",
+        xaxis_title="Data",
+        yaxis_title="Volatilidade (% a.a.)",
+        plot_bgcolor="rgba(240, 240, 240, 0.5)",
+        paper_bgcolor="rgba(255, 255, 255, 1)"
+    )
+    return fig
+
 # Callback para atualizar dados periodicamente
 @app_dash.callback(
     Output('dummy-output', 'children'),
     Input('interval-component', 'n_intervals')
 )
 def update_data(n):
-    load_data()
+    # No modo 'publish' as atualizações são feitas pelo laço do main.py
+    if app_state.ready and DASH_SNAPSHOT_MODE != 'publish':
+        try:
+            dashboard_data.refresh()
+        except Exception as e:
+            logging.error(f"Erro na atualização incremental: {e}")
     return ''
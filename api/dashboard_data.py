@@ -0,0 +1,419 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from columnar import fetch_trades_frame
+from rollups import ROLLUP_INTERVALS, load_bars
+from snapshot_store import SnapshotReader, SnapshotStore
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# O dashboard mostra os dados a partir de 2020
+DAILY_START = pd.Timestamp("2020-01-01")
+# A cada N atualizações incrementais faz uma recarga completa (reconcilia dados atrasados)
+DASH_FULL_RELOAD_EVERY = int(os.getenv('DASH_FULL_RELOAD_EVERY', '60'))
+# 'auto' usa change streams quando o MongoDB é replica set; 'off' usa apenas a marca d'água
+DASH_CHANGE_STREAMS = os.getenv('DASH_CHANGE_STREAMS', 'auto')
+# Margem ao reler os registros de exercício inseridos desde a marca d'água
+# (_id gerados por outros clientes/relógios chegam um pouco fora de ordem)
+DASH_EXERCISE_LOOKBACK_SECONDS = int(os.getenv('DASH_EXERCISE_LOOKBACK_SECONDS', '300'))
+# 'local' mantém o snapshot só neste processo; 'publish' também o grava no SnapshotStore
+# (processo carregador); 'attach' lê do SnapshotStore sem consultar o MongoDB (workers WSGI)
+DASH_SNAPSHOT_MODE = os.getenv('DASH_SNAPSHOT_MODE', 'local')
+# Frames do snapshot compartilhados entre processos
+SHARED_FRAMES = ('df_daily', 'df_historical_exercise')
+
+PART_COLUMNS = ['price_sum', 'count', 'price_min', 'price_max', 'total_quantity']
+DAILY_COLUMNS = ['time', 'price_mean', 'price_min', 'price_max', 'total_quantity']
+EXERCISE_KEY = ['symbol', 'expiryDate']
+
+# Snapshot imutável publicado por troca atômica de referência; nunca é alterado depois de publicado
+Snapshot = namedtuple('Snapshot', [
+    'version',
+    'source',                  # 'bars' (bars_1d) ou 'trades' (csv_data, sem rollups)
+    'daily_parts',             # agregados somáveis por (symbol, time) diário
+    'df_daily',
+    'df_historical_exercise',
+    'csv_watermark',
+    'exercise_watermark',
+    'loaded_at',
+])
+
+EMPTY_SNAPSHOT = Snapshot(0, None, pd.DataFrame(columns=PART_COLUMNS), pd.DataFrame(), pd.DataFrame(),
+                          None, None, None)
+
+
+def _parts_from_bars(bars):
+    """Per-(symbol, day) parts from bars_1d documents (already complete bars)."""
+    if bars.empty:
+        return pd.DataFrame(columns=PART_COLUMNS)
+    # O change stream entrega um evento por atualização: vale só a última versão de cada barra
+    bars = bars.drop_duplicates(['symbol', 'time'], keep='last')
+    parts = bars.rename(columns={'low': 'price_min', 'high': 'price_max', 'volume': 'total_quantity'})
+    parts['time'] = pd.to_datetime(parts['time'])
+    return parts.set_index(['symbol', 'time'])[PART_COLUMNS].sort_index()
+
+
+def _parts_from_trades(trades):
+    """Per-(symbol, day) parts aggregated from raw trades indexed by time."""
+    if trades.empty:
+        return pd.DataFrame(columns=PART_COLUMNS)
+    frame = pd.DataFrame({
+        'symbol': trades['symbol'].astype(str).to_numpy(),
+        'time': trades.index.floor('D'),
+        'price': trades['price'].to_numpy(),
+        'quantity': trades['quantity'].to_numpy(),
+    })
+    return frame.groupby(['symbol', 'time']).agg(
+        price_sum=('price', 'sum'),
+        count=('price', 'size'),
+        price_min=('price', 'min'),
+        price_max=('price', 'max'),
+        total_quantity=('quantity', 'sum'),
+    )
+
+
+def _replace_parts(parts, new_parts):
+    """Replace whole buckets (bars are totals, not deltas)."""
+    if new_parts.empty:
+        return parts
+    if parts.empty:
+        return new_parts
+    kept = parts.drop(index=new_parts.index, errors='ignore')
+    return pd.concat([kept, new_parts]).sort_index()
+
+
+def _combine_parts(parts, new_parts):
+    """Merge delta parts of raw trades into the existing buckets."""
+    if new_parts.empty:
+        return parts
+    if parts.empty:
+        return new_parts
+    combined = pd.concat([parts, new_parts])
+    return combined.groupby(level=['symbol', 'time']).agg({
+        'price_sum': 'sum', 'count': 'sum', 'price_min': 'min', 'price_max': 'max', 'total_quantity': 'sum',
+    })
+
+
+def _daily_rows(parts):
+    # Combina os símbolos por dia, como o resample sobre todos os trades
+    daily = parts.groupby(level='time').agg({
+        'price_sum': 'sum', 'count': 'sum', 'price_min': 'min', 'price_max': 'max', 'total_quantity': 'sum',
+    })
+    daily['price_mean'] = daily['price_sum'] / daily['count']
+    return daily.reset_index()[DAILY_COLUMNS]
+
+
+def daily_from_parts(parts, df_daily=None, days=None):
+    """
+    Build the daily frame from parts. With `days`, only those buckets are
+    recomputed and spliced into a new copy of `df_daily`.
+    """
+    if parts.empty:
+        return pd.DataFrame()
+    if days is None or df_daily is None or df_daily.empty:
+        return _daily_rows(parts)
+    days = pd.DatetimeIndex(sorted(set(days)))
+    affected = parts[parts.index.get_level_values('time').isin(days)]
+    kept = df_daily[~df_daily['time'].isin(days)]
+    return pd.concat([kept, _daily_rows(affected)], ignore_index=True).sort_values('time', ignore_index=True)
+
+
+def _insert_watermark(df, watermark=None):
+    """Latest `_id` generation time among the records, or `watermark` when newer."""
+    if df.empty or '_id' not in df.columns:
+        return watermark
+    times = [object_id.generation_time for object_id in df['_id'] if isinstance(object_id, ObjectId)]
+    if not times:
+        return watermark
+    newest = pd.Timestamp(max(times))
+    return newest if watermark is None or pd.isna(watermark) else max(newest, pd.Timestamp(watermark))
+
+
+def load_exercise(collection, after=None):
+    """
+    Exercise records and their insertion watermark. With `after`, only the
+    records inserted since then (by `_id`, minus DASH_EXERCISE_LOOKBACK_SECONDS)
+    are read, whatever their expiryDate, so late records for old expiries or
+    other underlyings are not skipped; `_append_exercise` drops the overlap.
+    """
+    query = {}
+    if after is not None and not pd.isna(after):
+        since = pd.Timestamp(after).to_pydatetime() - timedelta(seconds=DASH_EXERCISE_LOOKBACK_SECONDS)
+        query = {'_id': {'$gte': ObjectId.from_datetime(since)}}
+    df = pd.DataFrame(list(collection.find(query)))
+    watermark = _insert_watermark(df, after)
+    df = df.drop(columns=['_id'], errors='ignore')
+    if not df.empty and 'expiryDate' in df.columns:
+        df['expiryDate'] = pd.to_datetime(df['expiryDate'], errors='coerce')
+    return df, watermark
+
+
+def _append_exercise(df, new):
+    if new.empty:
+        return df
+    combined = pd.concat([df, new], ignore_index=True) if not df.empty else new
+    if set(EXERCISE_KEY).issubset(combined.columns):
+        combined = combined.drop_duplicates(subset=EXERCISE_KEY, keep='last')
+    return combined.sort_values('expiryDate', ignore_index=True) if 'expiryDate' in combined.columns else combined
+
+
+class ChangeFeed:
+    """
+    Collect documents from a MongoDB change stream in a background thread.
+    Change streams need a replica set; on a standalone server the feed marks
+    itself unavailable and callers fall back to watermark polling.
+    """
+
+    def __init__(self, collection, operations, full_document=None):
+        self.collection = collection
+        self.pipeline = [{'$match': {'operationType': {'$in': list(operations)}}}]
+        self.full_document = full_document
+        self.available = None
+        self._documents = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, start_at_operation_time=None):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(start_at_operation_time,),
+            name=f"changefeed-{self.collection.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, start_at_operation_time):
+        resume_token = None
+        while True:
+            try:
+                options = {'resume_after': resume_token} if resume_token else \
+                    {'start_at_operation_time': start_at_operation_time}
+                with self.collection.watch(self.pipeline, full_document=self.full_document, **options) as stream:
+                    self.available = True
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get('fullDocument')
+                        if document is not None:
+                            with self._lock:
+                                self._documents.append(document)
+            except OperationFailure as e:
+                if e.code in (40573, 40324) or 'replica set' in str(e):
+                    logging.info(f"Change streams indisponíveis para '{self.collection.name}'; usando polling.")
+                    self.available = False
+                    return
+                logging.warning(f"Change stream de '{self.collection.name}' falhou: {e}")
+            except PyMongoError as e:
+                logging.warning(f"Change stream de '{self.collection.name}' falhou: {e}")
+            time.sleep(5)
+
+    def drain(self):
+        with self._lock:
+            documents, self._documents = self._documents, []
+        return documents
+
+
+class DashboardData:
+    """
+    Dashboard data kept as an immutable Snapshot. `refresh()` only fetches what
+    is newer than the high-water marks (or what the change streams delivered),
+    recomputes the affected daily buckets and publishes a new snapshot with
+    an atomic reference swap, so callbacks never see a half-updated state.
+    """
+
+    def __init__(self, db, collection_csv, collection_historical_exercise, store=None):
+        self.db = db
+        self.store = store
+        self.collection_csv = collection_csv
+        self.collection_historical_exercise = collection_historical_exercise
+        self.snapshot = EMPTY_SNAPSHOT
+        self._refresh_lock = threading.Lock()
+        self._refreshes = 0
+        bars_collection = db[ROLLUP_INTERVALS['1d'][0]]
+        self.bars_feed = ChangeFeed(bars_collection, ('insert', 'update', 'replace'), full_document='updateLookup')
+        self.exercise_feed = ChangeFeed(collection_historical_exercise, ('insert',))
+
+    def _operation_time(self):
+        try:
+            with self.db.client.start_session() as session:
+                self.db.command('ping', session=session)
+                return session.operation_time
+        except PyMongoError:
+            return None
+
+    def _publish(self, **changes):
+        snapshot = self.snapshot._replace(
+            version=self.snapshot.version + 1,
+            loaded_at=datetime.now(timezone.utc),
+            **changes
+        )
+        self.snapshot = snapshot
+        if self.store is not None:
+            self._publish_shared(snapshot)
+        return snapshot
+
+    def _publish_shared(self, snapshot):
+        meta = {
+            "source": snapshot.source,
+            "csv_watermark": snapshot.csv_watermark,
+            "exercise_watermark": snapshot.exercise_watermark,
+            "loaded_at": snapshot.loaded_at,
+        }
+        try:
+            version = self.store.publish({name: getattr(snapshot, name) for name in SHARED_FRAMES}, meta)
+            logging.info(f"Snapshot v{version} publicado em {self.store.root}.")
+        except Exception as e:
+            # Os workers continuam na versão anterior; a próxima atualização tenta de novo
+            logging.error(f"Erro ao publicar o snapshot compartilhado: {e}")
+
+    def full_reload(self):
+        with self._refresh_lock:
+            return self._full_reload()
+
+    def _full_reload(self):
+        logging.info("Carregando dados das coleções MongoDB (recarga completa).")
+        # Eventos anteriores a esta recarga já estarão nela
+        self.bars_feed.drain()
+        self.exercise_feed.drain()
+        if DASH_CHANGE_STREAMS != 'off':
+            operation_time = self._operation_time()
+            self.bars_feed.start(operation_time)
+            self.exercise_feed.start(operation_time)
+
+        # Barras diárias vêm da coleção de rollups (bars_1d), sem reamostrar todos os trades
+        bars = load_bars(self.db, '1d', start=DAILY_START)
+        if not bars.empty:
+            source = 'bars'
+            parts = _parts_from_bars(bars)
+            csv_watermark = pd.Timestamp(bars['time'].max())
+        else:
+            # Rollups ainda não gerados: agrega os trades brutos a partir de 2020
+            source = 'trades'
+            trades = fetch_trades_frame(self.collection_csv, start=DAILY_START)
+            parts = _parts_from_trades(trades)
+            csv_watermark = trades.index.max() if not trades.empty else None
+        df_daily = daily_from_parts(parts)
+        logging.info(f"{len(df_daily)} dias carregados (fonte: {source}).")
+
+        loaded, exercise_watermark = load_exercise(self.collection_historical_exercise)
+        df_exercise = _append_exercise(pd.DataFrame(), loaded)
+        logging.info(f"{len(df_exercise)} registros de exercício histórico carregados.")
+
+        return self._publish(
+            source=source, daily_parts=parts, df_daily=df_daily, df_historical_exercise=df_exercise,
+            csv_watermark=csv_watermark, exercise_watermark=exercise_watermark
+        )
+
+    def refresh(self):
+        """Incremental refresh; falls back to a full reload periodically or before the first load."""
+        with self._refresh_lock:
+            self._refreshes += 1
+            snapshot = self.snapshot
+            if snapshot.version == 0 or self._refreshes % max(1, DASH_FULL_RELOAD_EVERY) == 0:
+                return self._full_reload()
+
+            parts, csv_watermark = snapshot.daily_parts, snapshot.csv_watermark
+            if snapshot.source == 'bars':
+                if self.bars_feed.available:
+                    new_parts = _parts_from_bars(pd.DataFrame(self.bars_feed.drain()))
+                    if not new_parts.empty:
+                        new_parts = new_parts[new_parts.index.get_level_values('time') >= DAILY_START]
+                else:
+                    # O último dia ainda está aberto: relê a partir do bucket da marca d'água
+                    new_parts = _parts_from_bars(load_bars(self.db, '1d', start=csv_watermark or DAILY_START))
+                parts = _replace_parts(parts, new_parts)
+            else:
+                start = csv_watermark + pd.Timedelta(milliseconds=1) if csv_watermark is not None else DAILY_START
+                trades = fetch_trades_frame(self.collection_csv, start=start)
+                new_parts = _parts_from_trades(trades)
+                parts = _combine_parts(parts, new_parts)
+                if not trades.empty:
+                    csv_watermark = trades.index.max()
+            if not new_parts.empty:
+                days = new_parts.index.get_level_values('time')
+                if snapshot.source == 'bars':
+                    csv_watermark = days.max() if csv_watermark is None else max(csv_watermark, days.max())
+                df_daily = daily_from_parts(parts, snapshot.df_daily, days)
+            else:
+                df_daily = snapshot.df_daily
+
+            if self.exercise_feed.available:
+                new_exercise = pd.DataFrame(self.exercise_feed.drain())
+                exercise_watermark = _insert_watermark(new_exercise, snapshot.exercise_watermark)
+                new_exercise = new_exercise.drop(columns=['_id'], errors='ignore')
+                if not new_exercise.empty and 'expiryDate' in new_exercise.columns:
+                    new_exercise['expiryDate'] = pd.to_datetime(new_exercise['expiryDate'], errors='coerce')
+            else:
+                new_exercise, exercise_watermark = load_exercise(
+                    self.collection_historical_exercise, after=snapshot.exercise_watermark
+                )
+            df_exercise = _append_exercise(snapshot.df_historical_exercise, new_exercise)
+            # Registros de exercício não mudam depois de gravados: só chaves novas contam
+            exercise_added = len(df_exercise) - len(snapshot.df_historical_exercise)
+
+            if new_parts.empty and not exercise_added:
+                return snapshot
+            logging.info(
+                f"Atualização incremental: {len(new_parts)} buckets diários e {exercise_added} registros de exercício novos."
+            )
+            return self._publish(
+                daily_parts=parts, df_daily=df_daily, df_historical_exercise=df_exercise,
+                csv_watermark=csv_watermark, exercise_watermark=exercise_watermark
+            )
+
+
+class AttachedDashboardData:
+    """
+    Read-only view of the snapshots published by the loader process. Workers
+    attach to the memory-mapped frames instead of loading their own copy and
+    switch to a new version as soon as `CURRENT` moves.
+    """
+
+    def __init__(self, store, wait_interval=1.0):
+        self.reader = SnapshotReader(store)
+        self.wait_interval = wait_interval
+        self._snapshot = EMPTY_SNAPSHOT
+
+    @property
+    def snapshot(self):
+        version, meta, frames = self.reader.get()
+        snapshot = self._snapshot
+        if version and version != snapshot.version:
+            snapshot = Snapshot(
+                version=version,
+                source=meta.get('source'),
+                daily_parts=EMPTY_SNAPSHOT.daily_parts,
+                df_daily=frames.get('df_daily', pd.DataFrame()),
+                df_historical_exercise=frames.get('df_historical_exercise', pd.DataFrame()),
+                csv_watermark=pd.Timestamp(meta['csv_watermark']) if meta.get('csv_watermark') else None,
+                exercise_watermark=pd.Timestamp(meta['exercise_watermark']) if meta.get('exercise_watermark') else None,
+                loaded_at=pd.Timestamp(meta['loaded_at']).to_pydatetime() if meta.get('loaded_at') else None,
+            )
+            self._snapshot = snapshot
+        return snapshot
+
+    def full_reload(self):
+        """Wait until the loader has published a first version."""
+        while self.snapshot.version == 0:
+            logging.info(f"Aguardando o primeiro snapshot em {self.reader.store.root}...")
+            time.sleep(self.wait_interval)
+        return self.snapshot
+
+    def refresh(self):
+        return self.snapshot
+
+
+def create_dashboard_data(db, collection_csv, collection_historical_exercise, mode=DASH_SNAPSHOT_MODE):
+    """Dashboard data source for this process according to `DASH_SNAPSHOT_MODE`."""
+    if mode == 'attach':
+        return AttachedDashboardData(SnapshotStore())
+    store = SnapshotStore() if mode == 'publish' else None
+    return DashboardData(db, collection_csv, collection_historical_exercise, store=store)
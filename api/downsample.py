@@ -0,0 +1,117 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from rollups import bar_summary
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Máximo de pontos por série enviados ao navegador
+CHART_POINT_BUDGET = int(os.getenv('CHART_POINT_BUDGET', '2000'))
+# Um nível da pirâmide serve enquanto tiver até N x o orçamento de pontos no intervalo
+CHART_LEVEL_OVERSAMPLE = float(os.getenv('CHART_LEVEL_OVERSAMPLE', '4'))
+
+# Pirâmide de resolução: coleções de rollups (bars_1m, bars_1h, bars_1d), da mais fina à mais grossa
+PYRAMID_LEVELS = [
+    ('1m', pd.Timedelta(minutes=1)),
+    ('1h', pd.Timedelta(hours=1)),
+    ('1d', pd.Timedelta(days=1)),
+]
+
+
+def choose_level(start, end, budget=CHART_POINT_BUDGET):
+    """Finest pyramid level whose bar count over [start, end] stays within the oversampled budget."""
+    if start is None or end is None:
+        return PYRAMID_LEVELS[-1][0]
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    for level, width in PYRAMID_LEVELS:
+        if span / width <= budget * CHART_LEVEL_OVERSAMPLE:
+            return level
+    return PYRAMID_LEVELS[-1][0]
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indexes of `threshold` points that keep the
+    visual shape of the series (first and last points are always kept).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    every = (n - 2) / (threshold - 2)
+    indexes = np.empty(threshold, dtype=np.int64)
+    indexes[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Área do triângulo (ponto escolhido anterior, candidato, média do próximo bucket)
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indexes[i + 1] = a
+    indexes[-1] = n - 1
+    return indexes
+
+
+def _bucket_edges(n, buckets):
+    return np.unique(np.linspace(0, n, buckets + 1).astype(np.int64)[:-1])
+
+
+def downsample_summary(df, budget=CHART_POINT_BUDGET):
+    """
+    Reduce a summary frame (time, price_mean, price_min, price_max, total_quantity)
+    to at most `budget` points per series: LTTB for the mean price, min/max
+    preserving buckets for the price range and summed buckets for the volume.
+    Returns (mean, min_max, quantity) frames.
+    """
+    df = df.dropna(subset=['price_mean']).sort_values('time', ignore_index=True)
+    if len(df) <= budget:
+        return (df[['time', 'price_mean']], df[['time', 'price_min', 'price_max']],
+                df[['time', 'total_quantity']])
+
+    times = df['time'].to_numpy()
+    keep = lttb(times.astype('datetime64[ns]').astype('int64'), df['price_mean'].to_numpy(), budget)
+    mean = df.iloc[keep][['time', 'price_mean']]
+
+    edges = _bucket_edges(len(df), budget)
+    bucket_times = times[edges]
+    # Os extremos de cada bucket sobrevivem, então picos e vales nunca somem do gráfico
+    min_max = pd.DataFrame({
+        'time': bucket_times,
+        'price_min': np.fmin.reduceat(df['price_min'].to_numpy(dtype='float64'), edges),
+        'price_max': np.fmax.reduceat(df['price_max'].to_numpy(dtype='float64'), edges),
+    })
+    quantity = pd.DataFrame({
+        'time': bucket_times,
+        'total_quantity': np.add.reduceat(np.nan_to_num(df['total_quantity'].to_numpy(dtype='float64')), edges),
+    })
+    return mean, min_max, quantity
+
+
+def chart_series(db, df_daily, start=None, end=None, budget=CHART_POINT_BUDGET):
+    """
+    Downsampled series for [start, end] from the right pyramid level. The daily
+    level comes from the in-memory dashboard snapshot; finer levels are read
+    from the rollup collections for the visible range only.
+    Returns (level, mean, min_max, quantity).
+    """
+    level = choose_level(start, end, budget)
+    if level == '1d':
+        df = df_daily
+        if not df.empty and start is not None and end is not None:
+            df = df[(df['time'] >= pd.Timestamp(start).floor('D')) & (df['time'] <= pd.Timestamp(end))]
+    else:
+        df = bar_summary(db, level, start=start, end=end)
+    if df.empty:
+        return (level, pd.DataFrame(columns=['time', 'price_mean']),
+                pd.DataFrame(columns=['time', 'price_min', 'price_max']),
+                pd.DataFrame(columns=['time', 'total_quantity']))
+    return (level, *downsample_summary(df, budget))
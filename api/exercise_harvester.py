@@ -0,0 +1,170 @@
+"""
+Complete and incremental harvesting of Binance options exercise records.
+
+For every underlying the history is walked forward in time windows starting
+from a per-underlying checkpoint. A window that returns a full page is split
+in half until each request fits in one page. Once the walk reaches the
+present, the harvester only polls the recent window on a schedule, because
+expiries happen at most once a day.
+
+Uso:
+    python api/exercise_harvester.py --underlying BTCUSDT --underlying ETHUSDT
+    python api/exercise_harvester.py --once
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from backfill import parse_date
+from utils import (
+    EXERCISE_PAGE_LIMIT,
+    INGEST_CAUGHT_UP,
+    INGEST_ERROR,
+    INGEST_MORE,
+    collection_checkpoints,
+    collection_historical_exercise,
+    fetch_historical_exercise_records,
+    init_storage,
+    insert_data_into_mongo,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+EXERCISE_UNDERLYINGS = [
+    underlying.strip() for underlying in
+    os.getenv('EXERCISE_UNDERLYINGS', 'BTCUSDT,ETHUSDT,BNBUSDT,SOLUSDT,XRPUSDT,DOGEUSDT').split(',')
+    if underlying.strip()
+]
+EXERCISE_HISTORY_START = os.getenv('EXERCISE_HISTORY_START', '2020-01-01')
+# Janela inicial de cada requisição; é dividida quando a página volta cheia
+EXERCISE_WINDOW_MS = int(float(os.getenv('EXERCISE_WINDOW_DAYS', '7')) * 24 * 60 * 60 * 1000)
+# Os resultados de um vencimento podem ser publicados depois dele: o cursor fica esse tempo atrás do presente
+EXERCISE_SETTLE_MS = int(float(os.getenv('EXERCISE_SETTLE_HOURS', '24')) * 60 * 60 * 1000)
+# Intervalo (segundos) entre consultas depois de alcançar o presente
+EXERCISE_POLL_INTERVAL = int(os.getenv('EXERCISE_POLL_INTERVAL', '3600'))
+EXERCISE_RETRY_INTERVAL = 30
+
+
+def checkpoint_id(underlying):
+    return f"exercise:{underlying}"
+
+
+def load_exercise_checkpoint(underlying):
+    return collection_checkpoints.find_one({"_id": checkpoint_id(underlying)})
+
+
+def save_exercise_checkpoint(underlying, cursor, last_expiry):
+    """Persist the harvested window end (`cursor`, ms) and the last expiryDate seen."""
+    collection_checkpoints.update_one(
+        {"_id": checkpoint_id(underlying)},
+        {"$set": {
+            "cursor": cursor,
+            "last_expiry": last_expiry,
+            "updated_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+
+def fetch_window(underlying, start_ms, end_ms, limit=EXERCISE_PAGE_LIMIT):
+    """
+    All records of [start_ms, end_ms]: a full page means the window may have
+    more records, so it is split in half and each half fetched again.
+    Returns a list of DataFrames, or None on error.
+    """
+    page = fetch_historical_exercise_records(underlying, start_ms, end_ms, limit=limit)
+    if page is None or len(page) < limit:
+        return page if page is None else [page]
+    if page['expiryDate'].nunique() <= 1 or end_ms - start_ms < 1000:
+        # Todos os registros num mesmo vencimento: dividir o tempo não ajuda
+        logging.warning(
+            f"{underlying}: página cheia para um único vencimento em [{start_ms}, {end_ms}]; "
+            f"registros além de {limit} podem faltar."
+        )
+        return [page]
+    middle = start_ms + (end_ms - start_ms) // 2
+    first = fetch_window(underlying, start_ms, middle, limit)
+    if first is None:
+        return None
+    second = fetch_window(underlying, middle + 1, end_ms, limit)
+    if second is None:
+        return None
+    return first + second
+
+
+def harvest_underlying(underlying, history_start=EXERCISE_HISTORY_START, window_ms=EXERCISE_WINDOW_MS,
+                       max_windows=None):
+    """
+    Walk the history of an underlying from its checkpoint towards the present,
+    at most `max_windows` windows per call. Returns INGEST_CAUGHT_UP, INGEST_MORE
+    or INGEST_ERROR (the checkpoint stays at the last fully written window).
+    """
+    checkpoint = load_exercise_checkpoint(underlying) or {}
+    cursor = checkpoint.get('cursor') or parse_date(history_start)
+    last_expiry = checkpoint.get('last_expiry')
+    now = int(time.time() * 1000)
+    windows = 0
+    records = 0
+    position = cursor
+    while position < now:
+        if max_windows is not None and windows >= max_windows:
+            break
+        end_ms = min(position + window_ms - 1, now)
+        pages = fetch_window(underlying, position, end_ms)
+        if pages is None:
+            return INGEST_ERROR
+        df = pd.concat(pages, ignore_index=True)
+        if not df.empty:
+            df = df.drop_duplicates(subset=['symbol', 'expiryDate'])
+            summary = insert_data_into_mongo(df, collection_historical_exercise)
+            if summary['failed']:
+                logging.error(f"{underlying}: {summary['failed']} registros de exercício não gravados; tentando de novo depois.")
+                return INGEST_ERROR
+            records += summary['inserted']
+            window_last = int(df['expiryDate'].max().value // 10**6)
+            last_expiry = window_last if last_expiry is None else max(last_expiry, window_last)
+        # O checkpoint não entra na janela em que resultados de vencimentos ainda podem ser publicados;
+        # ela é consultada de novo a cada rodada (as duplicatas são descartadas pelo índice único)
+        cursor = max(cursor, min(end_ms + 1, now - EXERCISE_SETTLE_MS))
+        save_exercise_checkpoint(underlying, cursor, last_expiry)
+        position = end_ms + 1
+        windows += 1
+    if windows:
+        logging.info(f"{underlying}: {windows} janelas consultadas, {records} registros de exercício novos.")
+    return INGEST_MORE if position < now else INGEST_CAUGHT_UP
+
+
+def run_harvester(underlyings=None, poll_interval=EXERCISE_POLL_INTERVAL, once=False):
+    """Harvest every underlying until caught up, then poll for new expiries every `poll_interval` seconds."""
+    underlyings = underlyings or EXERCISE_UNDERLYINGS
+    while True:
+        caught_up = True
+        for underlying in underlyings:
+            try:
+                caught_up = harvest_underlying(underlying) == INGEST_CAUGHT_UP and caught_up
+            except Exception as e:
+                logging.error(f"Erro ao coletar registros de exercício de {underlying}: {e}")
+                caught_up = False
+        if once:
+            return caught_up
+        time.sleep(poll_interval if caught_up else EXERCISE_RETRY_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--underlying', action='append', help="Underlying (repeatable); default EXERCISE_UNDERLYINGS")
+    parser.add_argument('--once', action='store_true', help="Harvest up to the present and exit")
+    args = parser.parse_args()
+    init_storage()
+    ok = run_harvester(args.underlying, once=args.once)
+    if args.once and not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ohlc import OHLCCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+EXERCISE_FIGURE_CACHE_SIZE = int(os.getenv('EXERCISE_FIGURE_CACHE_SIZE', '128'))
+# As chaves incluem a versão dos dados, então as figuras nunca ficam obsoletas; o TTL só limpa a memória
+EXERCISE_FIGURE_CACHE_TTL = float(os.getenv('EXERCISE_FIGURE_CACHE_TTL', '3600'))
+
+ALL_RESULTS = None
+
+
+def _daily_ohlc(days, prices):
+    """Daily OHLC of a day-sorted price array, vectorized with reduceat over the day boundaries."""
+    if not len(days):
+        empty = np.empty(0, dtype='float64')
+        return {'day': days, 'open': empty, 'high': empty, 'low': empty, 'close': empty}
+    starts = np.concatenate(([0], np.flatnonzero(days[1:] != days[:-1]) + 1))
+    ends = np.concatenate((starts[1:], [len(days)])) - 1
+    return {
+        'day': days[starts],
+        'open': prices[starts],
+        'high': np.maximum.reduceat(prices, starts),
+        'low': np.minimum.reduceat(prices, starts),
+        'close': prices[ends],
+    }
+
+
+class ExerciseIndex:
+    """
+    Query-ready form of the exercise records of one data version: rows sorted
+    by expiryDate, row positions per strikeResult and the daily OHLC of
+    realStrikePrice per strikeResult (and for all results together). Date
+    ranges are answered with `searchsorted` on the sorted day arrays.
+    """
+
+    def __init__(self, df, version):
+        self.version = version
+        self.positions = {}
+        self.daily = {}
+        if df.empty or not {'expiryDate', 'realStrikePrice'}.issubset(df.columns):
+            self.dates = np.empty(0, dtype='datetime64[ns]')
+            self.daily[ALL_RESULTS] = _daily_ohlc(np.empty(0, dtype='datetime64[D]'), np.empty(0))
+            return
+        # Linhas sem data ou preço não entram no candlestick (o groupby original também as ignorava)
+        valid = df['expiryDate'].notna() & df['realStrikePrice'].notna()
+        dates = df['expiryDate'].to_numpy(dtype='datetime64[ns]')[valid.to_numpy()]
+        prices = df['realStrikePrice'].to_numpy(dtype='float64')[valid.to_numpy()]
+        order = np.argsort(dates, kind='stable')
+        self.dates = dates[order]
+        prices = prices[order]
+        days = self.dates.astype('datetime64[D]')
+
+        self.daily[ALL_RESULTS] = _daily_ohlc(days, prices)
+        if 'strikeResult' in df.columns:
+            results = df['strikeResult'].to_numpy(dtype=object)[valid.to_numpy()][order]
+            codes, labels = pd.factorize(results, use_na_sentinel=True)
+            # Um único argsort estável agrupa as posições por resultado mantendo a ordem por data
+            grouped = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[grouped], np.arange(len(labels) + 1))
+            for code, label in enumerate(labels):
+                positions = grouped[bounds[code]:bounds[code + 1]]
+                self.positions[label] = positions
+                self.daily[label] = _daily_ohlc(days[positions], prices[positions])
+
+    def results(self):
+        return list(self.positions)
+
+    def candles(self, strike_result=ALL_RESULTS, start_day=None, end_day=None):
+        """Daily OHLC of a result over the inclusive day range [start_day, end_day]."""
+        daily = self.daily.get(strike_result)
+        if daily is None:
+            return None
+        days = daily['day']
+        lo = np.searchsorted(days, np.datetime64(start_day, 'D'), 'left') if start_day is not None else 0
+        hi = np.searchsorted(days, np.datetime64(end_day, 'D'), 'right') if end_day is not None else len(days)
+        return {name: values[lo:hi] for name, values in daily.items()}
+
+
+class ExerciseQueries:
+    """Per-version ExerciseIndex plus an LRU cache of rendered figures keyed by (filter, range, version)."""
+
+    def __init__(self, maxsize=EXERCISE_FIGURE_CACHE_SIZE):
+        self.figures = OHLCCache(maxsize=maxsize)
+        self._index = None
+        self._lock = threading.Lock()
+
+    def index(self, snapshot):
+        index = self._index
+        if index is not None and index.version == snapshot.version:
+            return index
+        with self._lock:
+            if self._index is None or self._index.version != snapshot.version:
+                self._index = ExerciseIndex(snapshot.df_historical_exercise, snapshot.version)
+                logging.info(f"Índice de exercício histórico reconstruído (versão {snapshot.version}).")
+            return self._index
+
+    def figure(self, snapshot, strike_result, start_day, end_day, render):
+        """Cached figure for the filter; `render(candles)` builds it on a miss."""
+        key = (strike_result, start_day, end_day, snapshot.version)
+        figure = self.figures.get(key)
+        if figure is None:
+            figure = render(self.index(snapshot).candles(strike_result, start_day, end_day))
+            self.figures.set(key, figure, EXERCISE_FIGURE_CACHE_TTL)
+        return figure
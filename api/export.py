@@ -0,0 +1,214 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from queries import build_range_query
+from ohlc import to_naive_utc
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(current_dir, 'exports'))
+EXPORT_ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', '250000'))
+EXPORT_COMPRESSION = os.getenv('EXPORT_COMPRESSION', 'zstd')
+EXPORT_MAX_FILES = int(os.getenv('EXPORT_MAX_FILES', '50'))
+
+EXPORT_FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+    'csv': ('.csv', 'text/csv'),
+}
+
+# Esquemas fixos das coleções conhecidas; as demais têm o esquema inferido do primeiro lote
+EXPORT_SCHEMAS = {
+    'csv_data': pa.schema([
+        ('symbol', pa.string()),
+        ('aggId', pa.int64()),
+        ('time', pa.timestamp('ms')),
+        ('price', pa.float64()),
+        ('quantity', pa.float64()),
+    ]),
+}
+
+TIME_FIELDS = {
+    'csv_data': 'time',
+    'historical_exercise_data': 'expiryDate',
+}
+
+# Coleções de controle da ingestão de trades (utils.collection_checkpoints e backfill.collection_backfill_shards)
+CHECKPOINTS_COLLECTION = 'ingestion_checkpoints'
+BACKFILL_SHARDS_COLLECTION = 'backfill_shards'
+
+
+def _to_millis(value):
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def trades_watermark(db, symbol=None, end=None):
+    """
+    Watermark of the trades collection from the ingestion bookkeeping instead of the data:
+    the per-symbol checkpoints (last aggTrade id and time) kept by the REST and stream
+    ingestion, the CSV bootstrap progress and the latest finished backfill shard.
+    """
+    end_ms = _to_millis(end) if end else None
+    parts = []
+    for checkpoint in db[CHECKPOINTS_COLLECTION].find({}).sort("_id", 1):
+        key = str(checkpoint['_id'])
+        if 'rows_committed' in checkpoint:
+            # Progresso da carga do CSV (bootstrap:<arquivo>)
+            parts.append(f"{key}={checkpoint.get('file_key')}/{checkpoint['rows_committed']}")
+            continue
+        if symbol and key != symbol:
+            continue
+        last_time = checkpoint.get('last_time')
+        if end_ms is not None and last_time is not None and last_time >= end_ms:
+            # A ingestão já passou do fim do intervalo: novos trades não entram nele
+            parts.append(f"{key}=done")
+        else:
+            parts.append(f"{key}={checkpoint.get('last_agg_id')}@{last_time}")
+    shard_query = {"status": "done", **({"symbol": symbol} if symbol else {})}
+    shard = db[BACKFILL_SHARDS_COLLECTION].find_one(shard_query, {"completed_at": 1}, sort=[("completed_at", -1)])
+    if shard and shard.get('completed_at'):
+        parts.append(f"backfill={shard['completed_at'].isoformat()}")
+    return "|".join(parts)
+
+
+def data_watermark(collection, query, time_field, symbol=None, end=None):
+    """
+    Token that changes whenever the exported range may have changed. Trades use the
+    ingestion checkpoints; other collections the count and latest time of the range.
+    """
+    if collection.name == 'csv_data':
+        return trades_watermark(collection.database, symbol, end)
+    # Exportação da coleção inteira: a contagem dos metadados evita varrer tudo a cada clique
+    count = collection.estimated_document_count() if not query else collection.count_documents(query)
+    latest = collection.find_one(query, {time_field: 1}, sort=[(time_field, -1)])
+    latest_time = latest.get(time_field) if latest else None
+    return f"{count}:{latest_time.isoformat() if latest_time else ''}"
+
+
+def export_path(collection_name, fmt, symbol, start, end, watermark):
+    key = f"{collection_name}|{fmt}|{symbol}|{start}|{end}|{watermark}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    start_label = start.strftime('%Y%m%d') if start else 'inicio'
+    end_label = end.strftime('%Y%m%d') if end else 'fim'
+    extension = EXPORT_FORMATS[fmt][0]
+    return os.path.join(EXPORT_DIR, f"{collection_name}_{start_label}_{end_label}_{digest}{extension}")
+
+
+class _Writer:
+    """Uniform row-group writer over Parquet, Arrow IPC and CSV."""
+
+    def __init__(self, path, fmt, schema):
+        self.fmt = fmt
+        if fmt == 'parquet':
+            self.writer = pq.ParquetWriter(path, schema, compression=EXPORT_COMPRESSION)
+        elif fmt == 'arrow':
+            self.sink = pa.OSFile(path, 'wb')
+            options = pa.ipc.IpcWriteOptions(compression=EXPORT_COMPRESSION)
+            self.writer = pa.ipc.new_file(self.sink, schema, options=options)
+        else:
+            self.writer = pa_csv.CSVWriter(path, schema)
+
+    def write(self, table):
+        if self.fmt == 'parquet':
+            self.writer.write_table(table, row_group_size=table.num_rows)
+        else:
+            self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+        if self.fmt == 'arrow':
+            self.sink.close()
+
+
+def _iter_batches(cursor, row_group_size):
+    rows = []
+    for document in cursor:
+        rows.append(document)
+        if len(rows) >= row_group_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def write_export(collection, path, fmt, query, time_field, row_group_size=EXPORT_ROW_GROUP_SIZE):
+    """Stream the query result from Mongo into `path`, one row group at a time."""
+    schema = EXPORT_SCHEMAS.get(collection.name)
+    projection = {"_id": 0}
+    if schema is not None:
+        projection = {"_id": 0, **{name: 1 for name in schema.names}}
+    cursor = collection.find(query, projection).sort(time_field, 1).batch_size(min(row_group_size, 10000))
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    writer = None
+    rows_written = 0
+    try:
+        try:
+            for rows in _iter_batches(cursor, row_group_size):
+                if schema is None:
+                    schema = pa.Table.from_pylist(rows).schema
+                table = pa.Table.from_pylist(rows, schema=schema)
+                if writer is None:
+                    writer = _Writer(tmp_path, fmt, schema)
+                writer.write(table)
+                rows_written += table.num_rows
+            if writer is None:
+                writer = _Writer(tmp_path, fmt, schema or pa.schema([]))
+        finally:
+            if writer is not None:
+                writer.close()
+        # Renomeia só no fim para nunca servir um arquivo incompleto
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Não deixa o arquivo parcial em EXPORT_DIR
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return rows_written
+
+
+def prune_exports(max_files=EXPORT_MAX_FILES):
+    files = sorted(
+        (path for path in glob.glob(os.path.join(EXPORT_DIR, '*')) if not path.endswith('.tmp')),
+        key=os.path.getmtime
+    )
+    for path in files[:-max(1, max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def export_collection(collection, fmt='parquet', symbol=None, start=None, end=None):
+    """
+    Export a collection (optionally filtered by symbol and [start, end)) and return
+    the file path. Finished exports are reused while the data watermark is unchanged.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    time_field = TIME_FIELDS.get(collection.name, 'time')
+    start, end = to_naive_utc(start), to_naive_utc(end)
+    query = build_range_query(time_field, symbol, start, end)
+    path = export_path(collection.name, fmt, symbol, start, end, data_watermark(collection, query, time_field, symbol, end))
+    if os.path.exists(path):
+        logging.info(f"Export cache hit: {path}")
+        os.utime(path)
+        return path
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    started = time.perf_counter()
+    rows = write_export(collection, path, fmt, query, time_field)
+    logging.info(f"Exported {rows} rows of '{collection.name}' to {path} in {time.perf_counter() - started:.1f}s.")
+    prune_exports()
+    return path
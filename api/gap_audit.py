@@ -0,0 +1,397 @@
+"""
+Gap detection and targeted repair of the stored aggTrades history.
+
+The audit runs two index-backed passes per symbol:
+
+- aggTrade id continuity: the ids are read in chunks, in (symbol, aggId)
+  index order and projected to aggId, and every jump larger than one is a
+  missing id range. On a standard collection this is a covered index scan; on
+  the time-series storage the matching buckets still have to be unpacked;
+- time density: the 1-minute bars are scanned for runs of empty minutes in
+  stretches where the symbol normally trades every minute. This catches holes
+  in data without aggId (CSV imports). A time gap whose bordering trades have
+  consecutive ids is a quiet market, not missing data.
+
+Gaps are recorded in `trade_gaps` and only those ranges are fetched again
+from /api/v3/aggTrades, paging with `fromId`. The audit is incremental (it
+resumes after the last audited id) and never looks past the ingestion
+checkpoint, so the tail still being ingested is not reported.
+
+Uso:
+    python api/gap_audit.py audit --symbol BTCUSDT [--full] [--output gaps.json]
+    python api/gap_audit.py repair --symbol BTCUSDT --max-pages 500
+    python api/gap_audit.py list --status open
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+from binance_client import get_client
+from rollups import ROLLUP_INTERVALS
+from utils import (
+    AGG_TRADES_WEIGHT,
+    AGG_TRADES_WINDOW_MS,
+    BINANCE_API_URL,
+    INGEST_CAUGHT_UP,
+    INGEST_ERROR,
+    INGEST_MORE,
+    agg_trades_to_records,
+    collection_checkpoints,
+    collection_csv,
+    db,
+    init_storage,
+    insert_data_into_mongo,
+    to_millis,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Ids lidos do índice por consulta
+GAP_AUDIT_CHUNK = int(os.getenv('GAP_AUDIT_CHUNK', '1000000'))
+# Minutos seguidos sem barra que contam como buraco, e mediana mínima de trades/minuto
+# na hora anterior para o símbolo ser considerado denso naquele trecho
+GAP_TIME_MINUTES = int(os.getenv('GAP_TIME_MINUTES', '5'))
+GAP_DENSE_TRADES_PER_MINUTE = float(os.getenv('GAP_DENSE_TRADES_PER_MINUTE', '10'))
+GAP_AUDIT_INTERVAL = int(os.getenv('GAP_AUDIT_INTERVAL', '3600'))
+# Páginas de aggTrades por execução do reparo no agendador
+GAP_REPAIR_SLICE_PAGES = int(os.getenv('GAP_REPAIR_SLICE_PAGES', '20'))
+AGG_TRADES_LIMIT = 1000
+
+GAP_OPEN = 'open'
+GAP_REPAIRED = 'repaired'
+GAP_UNRECOVERABLE = 'unrecoverable'
+# Buraco de tempo cujos trades vizinhos têm ids consecutivos (ou já coberto por um buraco de ids)
+GAP_QUIET = 'quiet'
+
+collection_trade_gaps = db['trade_gaps']
+ID_INDEX = [("symbol", ASCENDING), ("aggId", ASCENDING)]
+
+
+def create_gap_indexes():
+    collection_trade_gaps.create_index([("symbol", ASCENDING), ("status", ASCENDING)], name="idx_symbol_status")
+
+
+def _audit_checkpoint_id(symbol):
+    return f"gap_audit:{symbol}"
+
+
+def _id_bounds(symbol, full=False):
+    """First id to audit (resuming after the last audit) and the last id ingested."""
+    checkpoint = None if full else collection_checkpoints.find_one({"_id": _audit_checkpoint_id(symbol)})
+    if checkpoint and checkpoint.get('last_id') is not None:
+        start = checkpoint['last_id']
+    else:
+        first = collection_csv.find_one(
+            {"symbol": symbol, "aggId": {"$exists": True}}, {"_id": 0, "aggId": 1}, sort=[("aggId", ASCENDING)]
+        )
+        start = first['aggId'] if first else None
+    ingested = collection_checkpoints.find_one({"_id": symbol}) or {}
+    end = ingested.get('last_agg_id')
+    if end is None:
+        last = collection_csv.find_one(
+            {"symbol": symbol, "aggId": {"$exists": True}}, {"_id": 0, "aggId": 1}, sort=[("aggId", DESCENDING)]
+        )
+        end = last['aggId'] if last else None
+    return start, end
+
+
+def _read_ids(query, hinted):
+    cursor = collection_csv.find(query, {"_id": 0, "aggId": 1}).sort("aggId", ASCENDING).batch_size(100000)
+    if hinted:
+        cursor = cursor.hint(ID_INDEX)
+    return np.fromiter((doc['aggId'] for doc in cursor), dtype='int64')
+
+
+def find_id_gaps(symbol, start_id, end_id, chunk=GAP_AUDIT_CHUNK):
+    """
+    Missing aggId ranges (inclusive) of a symbol within [start_id, end_id],
+    reading the ids in chunks of `chunk` through the (symbol, aggId) index.
+    Returns (gaps, ids scanned, repeated ids).
+    """
+    gaps = []
+    scanned = repeated = 0
+    previous = None
+    hinted = True
+    for low in range(start_id, end_id + 1, chunk):
+        high = min(low + chunk - 1, end_id)
+        query = {"symbol": symbol, "aggId": {"$gte": low, "$lte": high}}
+        try:
+            ids = _read_ids(query, hinted)
+        except OperationFailure as e:
+            if not hinted:
+                raise
+            # O índice pode não existir (criação falhou em create_indexes): deixa o planner escolher
+            logging.warning(f"Hint {ID_INDEX} rejeitado para {symbol} ({e}); lendo os ids sem hint.")
+            hinted = False
+            ids = _read_ids(query, hinted)
+        if not len(ids):
+            continue
+        scanned += len(ids)
+        if previous is not None:
+            ids = np.concatenate(([previous], ids))
+        steps = np.diff(ids)
+        repeated += int((steps == 0).sum())
+        for i in np.flatnonzero(steps > 1):
+            gaps.append((int(ids[i]) + 1, int(ids[i + 1]) - 1))
+        previous = int(ids[-1])
+    return gaps, scanned, repeated
+
+
+def _neighbour_trade(symbol, time_value, before):
+    query = {"symbol": symbol, "time": {"$lt": time_value} if before else {"$gte": time_value}}
+    return collection_csv.find_one(
+        query, {"_id": 0, "aggId": 1, "time": 1}, sort=[("time", DESCENDING if before else ASCENDING)]
+    )
+
+
+def find_time_gaps(symbol, since=None, minutes=GAP_TIME_MINUTES, dense=GAP_DENSE_TRADES_PER_MINUTE):
+    """
+    Runs of at least `minutes` minutes without any 1-minute bar, in stretches
+    where the median of the previous hour is at least `dense` trades/minute.
+    Each gap carries the ids of the trades bordering it (None when unknown).
+    """
+    query = {"symbol": symbol}
+    if since is not None:
+        query['time'] = {"$gte": since}
+    bars = pd.DataFrame(list(db[ROLLUP_INTERVALS['1m'][0]].find(
+        query, {"_id": 0, "time": 1, "count": 1}
+    ).sort("time", ASCENDING)))
+    if len(bars) < 2:
+        return []
+    times = bars['time'].to_numpy(dtype='datetime64[ns]')
+    # Mediana dos últimos 60 minutos com barra antes de cada ponto
+    density = bars['count'].rolling(60, min_periods=10).median().to_numpy()
+    missing = (np.diff(times) / np.timedelta64(1, 'm')) - 1
+    gaps = []
+    for i in np.flatnonzero((missing >= minutes) & (density[:-1] >= dense)):
+        start = pd.Timestamp(times[i]).to_pydatetime() + timedelta(minutes=1)
+        end = pd.Timestamp(times[i + 1]).to_pydatetime()
+        before = _neighbour_trade(symbol, start, before=True)
+        after = _neighbour_trade(symbol, end, before=False)
+        gaps.append({
+            "start_time": start,
+            "end_time": end,
+            "before_id": before.get('aggId') if before else None,
+            "after_id": after.get('aggId') if after else None,
+        })
+    return gaps
+
+
+def record_gaps(symbol, id_gaps, time_gaps):
+    """Upsert the detected gaps into `trade_gaps`; gaps already known keep their status."""
+    now = datetime.now(timezone.utc)
+    operations = []
+    for from_id, to_id in id_gaps:
+        operations.append(UpdateOne(
+            {"_id": f"{symbol}:ids:{from_id}-{to_id}"},
+            {"$setOnInsert": {
+                "symbol": symbol, "kind": "ids", "from_id": from_id, "to_id": to_id,
+                "missing": to_id - from_id + 1, "status": GAP_OPEN, "detected_at": now,
+            }},
+            upsert=True
+        ))
+    for gap in time_gaps:
+        before_id, after_id = gap['before_id'], gap['after_id']
+        # Com os dois ids vizinhos conhecidos o trecho já é coberto pela continuidade de ids
+        known = before_id is not None and after_id is not None
+        operations.append(UpdateOne(
+            {"_id": f"{symbol}:time:{to_millis(gap['start_time'])}-{to_millis(gap['end_time'])}"},
+            {"$setOnInsert": {
+                "symbol": symbol, "kind": "time", **gap,
+                "minutes": int((gap['end_time'] - gap['start_time']).total_seconds() // 60),
+                "status": GAP_QUIET if known else GAP_OPEN, "detected_at": now,
+            }},
+            upsert=True
+        ))
+    if operations:
+        collection_trade_gaps.bulk_write(operations, ordered=False)
+
+
+def audit_symbol(symbol, full=False):
+    """
+    Audit the trades of a symbol stored since the last audit (everything with
+    `full`), record the gaps found and advance the audit checkpoint.
+    """
+    start_id, end_id = _id_bounds(symbol, full)
+    checkpoint = None if full else collection_checkpoints.find_one({"_id": _audit_checkpoint_id(symbol)})
+    id_gaps, scanned, repeated = ([], 0, 0)
+    if start_id is not None and end_id is not None and end_id >= start_id:
+        id_gaps, scanned, repeated = find_id_gaps(symbol, start_id, end_id)
+    # Uma hora de sobreposição para enxergar buracos que cruzam o fim da auditoria anterior
+    since = checkpoint['last_time'] - timedelta(hours=1) if checkpoint and checkpoint.get('last_time') else None
+    time_gaps = find_time_gaps(symbol, since)
+    record_gaps(symbol, id_gaps, time_gaps)
+
+    last_bar = db[ROLLUP_INTERVALS['1m'][0]].find_one({"symbol": symbol}, {"_id": 0, "time": 1}, sort=[("time", DESCENDING)])
+    collection_checkpoints.update_one(
+        {"_id": _audit_checkpoint_id(symbol)},
+        {"$set": {
+            "last_id": end_id if end_id is not None else (checkpoint or {}).get('last_id'),
+            "last_time": last_bar['time'] if last_bar else None,
+            "updated_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+    summary = {
+        "symbol": symbol, "ids_scanned": scanned, "repeated_ids": repeated,
+        "id_gaps": len(id_gaps), "missing_ids": sum(to_id - from_id + 1 for from_id, to_id in id_gaps),
+        "time_gaps": len(time_gaps),
+    }
+    if id_gaps or time_gaps:
+        logging.warning(f"Buracos em {symbol}: {summary}")
+    else:
+        logging.info(f"Auditoria de {symbol}: {scanned} ids sem buracos.")
+    return summary
+
+
+def _fetch(client, params):
+    response = client.get("/api/v3/aggTrades", params=params, weight=AGG_TRADES_WEIGHT)
+    if response.status_code != 200:
+        logging.error(f"Erro ao baixar aggTrades para reparo: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+
+def _repair_gap(client, gap, budget):
+    """
+    Fetch the trades of one gap, at most `budget` pages. Progress (`next_id`)
+    is saved on the gap, so a repair split across runs resumes where it stopped.
+    Returns (pages used, finished, error).
+    """
+    symbol = gap['symbol']
+    to_id = gap.get('to_id')
+    end_ms = to_millis(gap['end_time']) if gap.get('end_time') else None
+    next_id = gap.get('next_id', gap.get('from_id'))
+    if next_id is None and gap.get('before_id') is not None:
+        next_id = gap['before_id'] + 1
+    pages = 0
+    if next_id is None:
+        # Sem id conhecido antes do buraco: localiza o primeiro trade por janelas de tempo
+        cursor = gap.get('cursor_ms', to_millis(gap['start_time']))
+        while next_id is None:
+            if cursor >= end_ms:
+                return pages, True, False
+            if pages >= budget:
+                collection_trade_gaps.update_one({"_id": gap['_id']}, {"$set": {"cursor_ms": cursor}})
+                return pages, False, False
+            data = _fetch(client, {
+                "symbol": symbol, "startTime": cursor, "endTime": min(cursor + AGG_TRADES_WINDOW_MS, end_ms) - 1, "limit": 1
+            })
+            pages += 1
+            if data is None:
+                return pages, False, True
+            if data:
+                next_id = data[0]['a']
+            else:
+                cursor += AGG_TRADES_WINDOW_MS
+    while pages < budget:
+        data = _fetch(client, {"symbol": symbol, "fromId": next_id, "limit": AGG_TRADES_LIMIT})
+        pages += 1
+        if data is None:
+            return pages, False, True
+        wanted = [
+            trade for trade in data
+            if (to_id is None or trade['a'] <= to_id) and (end_ms is None or trade['T'] < end_ms)
+        ]
+        if wanted:
+            summary = insert_data_into_mongo(pd.DataFrame(agg_trades_to_records(symbol, wanted)), collection_csv)
+            if summary['failed']:
+                return pages, False, True
+        if len(wanted) < len(data) or len(data) < AGG_TRADES_LIMIT:
+            return pages, True, False
+        next_id = data[-1]['a'] + 1
+    collection_trade_gaps.update_one({"_id": gap['_id']}, {"$set": {"next_id": next_id}})
+    return pages, False, False
+
+
+def _close_gap(gap):
+    """Mark a fetched gap as repaired, or unrecoverable when ids are still missing."""
+    update = {"repaired_at": datetime.now(timezone.utc)}
+    if gap['kind'] == 'ids':
+        stored = collection_csv.count_documents(
+            {"symbol": gap['symbol'], "aggId": {"$gte": gap['from_id'], "$lte": gap['to_id']}}
+        )
+        update['still_missing'] = gap['missing'] - stored
+        update['status'] = GAP_REPAIRED if update['still_missing'] <= 0 else GAP_UNRECOVERABLE
+    else:
+        update['status'] = GAP_REPAIRED
+    collection_trade_gaps.update_one({"_id": gap['_id']}, {"$set": update})
+    return update['status']
+
+
+def repair_gaps(symbol, max_pages=None):
+    """
+    Re-fetch the open gaps of a symbol, oldest first, within `max_pages` pages.
+    Returns INGEST_CAUGHT_UP when no open gap is left, INGEST_MORE when the page
+    budget ran out first and INGEST_ERROR on a failed request or write.
+    """
+    client = get_client(BINANCE_API_URL)
+    budget = max_pages if max_pages is not None else float('inf')
+    gaps = collection_trade_gaps.find({"symbol": symbol, "status": GAP_OPEN}).sort([("from_id", ASCENDING), ("start_time", ASCENDING)])
+    for gap in gaps:
+        if budget <= 0:
+            return INGEST_MORE
+        pages, finished, error = _repair_gap(client, gap, budget)
+        budget -= pages
+        if error:
+            return INGEST_ERROR
+        if not finished:
+            return INGEST_MORE
+        status = _close_gap(gap)
+        logging.info(f"Buraco {gap['_id']} reparado ({status}, {pages} páginas).")
+    return INGEST_CAUGHT_UP
+
+
+def list_gaps(symbol=None, status=None):
+    query = {}
+    if symbol:
+        query['symbol'] = symbol
+    if status:
+        query['status'] = status
+    return list(collection_trade_gaps.find(query).sort([("symbol", ASCENDING), ("detected_at", ASCENDING)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    audit = subparsers.add_parser('audit', help="Scan stored trades and record the gaps")
+    audit.add_argument('--full', action='store_true', help="Rescan the whole history instead of resuming")
+    repair = subparsers.add_parser('repair', help="Re-fetch the open gaps")
+    repair.add_argument('--max-pages', type=int, default=None)
+    listing = subparsers.add_parser('list', help="Print the recorded gaps")
+    listing.add_argument('--status', choices=[GAP_OPEN, GAP_REPAIRED, GAP_UNRECOVERABLE, GAP_QUIET])
+    for subparser in (audit, repair, listing):
+        subparser.add_argument('--symbol', action='append', help="Symbol (repeatable); default all stored symbols")
+        subparser.add_argument('--output', help="Write the gap list as JSON to this file")
+    args = parser.parse_args()
+
+    init_storage()
+    create_gap_indexes()
+    symbols = args.symbol or collection_csv.distinct('symbol')
+    ok = True
+    for symbol in symbols:
+        if args.command == 'audit':
+            audit_symbol(symbol, full=args.full)
+        elif args.command == 'repair':
+            ok = repair_gaps(symbol, args.max_pages) != INGEST_ERROR and ok
+    gaps = [gap for symbol in symbols for gap in list_gaps(symbol, getattr(args, 'status', None))]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(gaps, f, indent=2, default=str)
+    else:
+        for gap in gaps:
+            logging.info(f"{gap['_id']}: {gap['status']}")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
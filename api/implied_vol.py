@@ -0,0 +1,253 @@
+import logging
+import math
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from binance_client import get_client
+from ohlc import OHLCCache
+
+try:
+    from scipy.special import ndtr as _norm_cdf
+except ImportError:
+    # Sem scipy, usa a aproximação de erf de Abramowitz-Stegun (7.1.26, erro < 1.5e-7)
+    _norm_cdf = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Limites de volatilidade do solver (o bracket da bisseção)
+IV_MIN = 1e-4
+IV_MAX = 10.0
+IV_TOLERANCE = 1e-8
+IV_MAX_ITERATIONS = 100
+# Snapshots de cotações agrupados por N segundos (chave do cache de superfícies)
+IV_SNAPSHOT_SECONDS = int(os.getenv('IV_SNAPSHOT_SECONDS', '60'))
+IV_SURFACE_CACHE_SIZE = int(os.getenv('IV_SURFACE_CACHE_SIZE', '32'))
+
+SECONDS_PER_YEAR = 365 * 86400
+# Símbolos de opções da Binance: BTC-240628-60000-C (vencimento às 08:00 UTC)
+OPTION_SYMBOL = re.compile(r'^(?P<base>[A-Z0-9]+)-(?P<expiry>\d{6})-(?P<strike>[\d.]+)-(?P<side>[CP])$')
+OPTION_EXPIRY_HOUR = 8
+MARK_WEIGHT = 5
+INDEX_WEIGHT = 1
+
+_SQRT_2PI = math.sqrt(2.0 * math.pi)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+def norm_cdf(x):
+    if _norm_cdf is not None:
+        return _norm_cdf(x)
+    z = np.abs(x) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def black76_price(forward, strike, t, vol, is_call, discount=1.0):
+    """Black-76 price of European options on a forward (vectorized over all arguments)."""
+    forward, strike, t, vol = (np.asarray(a, dtype='float64') for a in (forward, strike, t, vol))
+    sqrt_t = np.sqrt(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(forward / strike) + 0.5 * vol * vol * t) / (vol * sqrt_t)
+    d2 = d1 - vol * sqrt_t
+    call = discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+    put = discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+    return np.where(is_call, call, put)
+
+
+def black76_vega(forward, strike, t, vol, discount=1.0):
+    forward, strike, t, vol = (np.asarray(a, dtype='float64') for a in (forward, strike, t, vol))
+    sqrt_t = np.sqrt(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(forward / strike) + 0.5 * vol * vol * t) / (vol * sqrt_t)
+    return discount * forward * norm_pdf(d1) * sqrt_t
+
+
+def black_scholes_price(spot, strike, t, vol, is_call, rate=0.0, dividend=0.0):
+    """Black-Scholes price, as Black-76 on the forward S*exp((r-q)T) discounted at r."""
+    t = np.asarray(t, dtype='float64')
+    forward = np.asarray(spot, dtype='float64') * np.exp((rate - dividend) * t)
+    return black76_price(forward, strike, t, vol, is_call, discount=np.exp(-rate * t))
+
+
+def implied_vol(price, forward, strike, t, is_call, discount=1.0, tol=IV_TOLERANCE, max_iter=IV_MAX_ITERATIONS):
+    """
+    Invert Black-76 for all quotes at once. Each iteration takes a Newton step
+    on the options still unresolved; a step that leaves the current bracket (or
+    has no vega) is replaced by bisection, so every quote converges. Quotes
+    outside the no-arbitrage bounds get NaN.
+    """
+    price, forward, strike, t = np.broadcast_arrays(*(np.asarray(a, dtype='float64') for a in (price, forward, strike, t)))
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), price.shape)
+    discount = np.broadcast_to(np.asarray(discount, dtype='float64'), price.shape)
+
+    intrinsic = discount * np.where(is_call, np.maximum(forward - strike, 0.0), np.maximum(strike - forward, 0.0))
+    upper = discount * np.where(is_call, forward, strike)
+    valid = (t > 0) & (forward > 0) & (strike > 0) & (price > intrinsic) & (price < upper)
+
+    vol = np.full(price.shape, np.nan)
+    lo = np.full(price.shape, IV_MIN)
+    hi = np.full(price.shape, IV_MAX)
+    # Chute inicial: Brenner-Subrahmanyam (ATM) combinado com Manaster-Koehler (fora do dinheiro)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = np.maximum(
+            _SQRT_2PI / np.sqrt(t) * price / (discount * forward),
+            np.sqrt(2.0 * np.abs(np.log(forward / strike)) / t),
+        )
+    vol[valid] = np.clip(guess[valid], 0.05, 3.0)
+
+    active = np.flatnonzero(valid)
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        sigma = vol[active]
+        f, k, tt, d, c = forward[active], strike[active], t[active], discount[active], is_call[active]
+        diff = black76_price(f, k, tt, sigma, c, d) - price[active]
+        # O preço cresce com a volatilidade: o sinal do erro estreita o bracket
+        too_high = diff > 0
+        hi[active] = np.where(too_high, sigma, hi[active])
+        lo[active] = np.where(too_high, lo[active], sigma)
+        vega = black76_vega(f, k, tt, sigma, d)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = sigma - diff / vega
+        bisect = 0.5 * (lo[active] + hi[active])
+        inside = np.isfinite(newton) & (newton > lo[active]) & (newton < hi[active])
+        step = np.where(inside, newton, bisect)
+        vol[active] = step
+        done = (np.abs(diff) < tol * np.maximum(price[active], 1e-12)) | (np.abs(step - sigma) < tol) | \
+            (hi[active] - lo[active] < tol)
+        active = active[~done]
+    return vol
+
+
+def implied_vol_scalar(price, forward, strike, t, is_call, discount=1.0, tol=IV_TOLERANCE, max_iter=IV_MAX_ITERATIONS):
+    """Per-option reference implementation of `implied_vol` (same algorithm, plain floats)."""
+    def cdf(x):
+        return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+    def price_and_vega(sigma):
+        sqrt_t = math.sqrt(t)
+        d1 = (math.log(forward / strike) + 0.5 * sigma * sigma * t) / (sigma * sqrt_t)
+        d2 = d1 - sigma * sqrt_t
+        if is_call:
+            value = discount * (forward * cdf(d1) - strike * cdf(d2))
+        else:
+            value = discount * (strike * cdf(-d2) - forward * cdf(-d1))
+        vega = discount * forward * math.exp(-0.5 * d1 * d1) / _SQRT_2PI * sqrt_t
+        return value, vega
+
+    intrinsic = discount * max(forward - strike, 0.0) if is_call else discount * max(strike - forward, 0.0)
+    upper = discount * (forward if is_call else strike)
+    if t <= 0 or forward <= 0 or strike <= 0 or not intrinsic < price < upper:
+        return math.nan
+    lo, hi = IV_MIN, IV_MAX
+    guess = max(_SQRT_2PI / math.sqrt(t) * price / (discount * forward),
+                math.sqrt(2.0 * abs(math.log(forward / strike)) / t))
+    sigma = min(max(guess, 0.05), 3.0)
+    for _ in range(max_iter):
+        value, vega = price_and_vega(sigma)
+        diff = value - price
+        if diff > 0:
+            hi = sigma
+        else:
+            lo = sigma
+        newton = sigma - diff / vega if vega > 0 else math.nan
+        step = newton if lo < newton < hi else 0.5 * (lo + hi)
+        if abs(diff) < tol * max(price, 1e-12) or abs(step - sigma) < tol or hi - lo < tol:
+            return step
+        sigma = step
+    return sigma
+
+
+def parse_option_symbols(symbols):
+    """Expiry (UTC), strike and call flag of Binance option symbols; unparseable ones are dropped."""
+    parsed = pd.Series(symbols, dtype=object).str.extract(OPTION_SYMBOL)
+    parsed['symbol'] = symbols
+    parsed = parsed.dropna(subset=['expiry'])
+    parsed['expiry'] = pd.to_datetime(parsed['expiry'], format='%y%m%d') + pd.Timedelta(hours=OPTION_EXPIRY_HOUR)
+    parsed['strike'] = parsed['strike'].astype('float64')
+    parsed['is_call'] = parsed['side'] == 'C'
+    return parsed[['symbol', 'expiry', 'strike', 'is_call']]
+
+
+def fetch_option_quotes(underlying='BTCUSDT', base_url=None):
+    """
+    Mark prices of every listed option of an underlying plus its index price,
+    from the Binance options API. Returns (quotes DataFrame, index price, snapshot time).
+    """
+    from utils import BINANCE_OPTIONS_API_URL, BINANCE_OPTIONS_WEIGHT_LIMIT
+    client = get_client(base_url or BINANCE_OPTIONS_API_URL, weight_limit=BINANCE_OPTIONS_WEIGHT_LIMIT)
+    index = client.get("/eapi/v1/index", params={"underlying": underlying}, weight=INDEX_WEIGHT)
+    index.raise_for_status()
+    index = index.json()
+    marks = client.get("/eapi/v1/mark", weight=MARK_WEIGHT)
+    marks.raise_for_status()
+    marks = pd.DataFrame(marks.json())
+    base = underlying[:-4] if underlying.endswith('USDT') else underlying
+    if marks.empty:
+        return marks, float(index['indexPrice']), pd.Timestamp(int(index['time']), unit='ms')
+    marks = marks[marks['symbol'].str.startswith(f"{base}-")]
+    quotes = parse_option_symbols(marks['symbol'].tolist()).merge(
+        marks[['symbol', 'markPrice']].astype({'markPrice': 'float64'}), on='symbol'
+    )
+    return quotes, float(index['indexPrice']), pd.Timestamp(int(index['time']), unit='ms')
+
+
+def build_surface(quotes, forward, snapshot_time):
+    """
+    Strike × expiry implied-volatility surface. Each strike uses the
+    out-of-the-money side (puts below the forward, calls above), which is the
+    more liquid and better conditioned one. The index is used as forward,
+    with no discounting (crypto options settle in the quote currency).
+    """
+    if quotes.empty:
+        return pd.DataFrame()
+    t = (quotes['expiry'] - pd.Timestamp(snapshot_time)).dt.total_seconds().to_numpy() / SECONDS_PER_YEAR
+    otm = np.where(quotes['is_call'], quotes['strike'] >= forward, quotes['strike'] < forward)
+    quotes = quotes.assign(t=t)[otm & (t > 0)]
+    quotes = quotes.assign(iv=implied_vol(
+        quotes['markPrice'].to_numpy(), forward, quotes['strike'].to_numpy(), quotes['t'].to_numpy(),
+        quotes['is_call'].to_numpy()
+    ))
+    return quotes.pivot_table(index='strike', columns='expiry', values='iv', aggfunc='mean').sort_index()
+
+
+class SurfaceCache:
+    """Implied-volatility surfaces cached per (underlying, snapshot timestamp)."""
+
+    def __init__(self, maxsize=IV_SURFACE_CACHE_SIZE):
+        self.cache = OHLCCache(maxsize=maxsize)
+
+    def get(self, underlying='BTCUSDT'):
+        """
+        Surface of the current snapshot bucket (IV_SNAPSHOT_SECONDS). Quotes are
+        only fetched and inverted once per bucket; later calls reuse the result.
+        Returns (snapshot time, forward, surface).
+        """
+        bucket = int(time.time()) // IV_SNAPSHOT_SECONDS * IV_SNAPSHOT_SECONDS
+        key = (underlying, bucket)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        quotes, forward, snapshot_time = fetch_option_quotes(underlying)
+        started = time.perf_counter()
+        surface = build_surface(quotes, forward, snapshot_time)
+        logging.info(
+            f"Superfície de IV de {underlying}: {len(quotes)} cotações invertidas em "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms."
+        )
+        result = (snapshot_time, forward, surface)
+        self.cache.set(key, result, ttl=IV_SNAPSHOT_SECONDS * IV_SURFACE_CACHE_SIZE)
+        return result
+
+
+surface_cache = SurfaceCache()
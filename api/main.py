@@ -1,81 +1,92 @@
 import os
 import pandas as pd
 from utils import (
-    read_csv_file,
-    insert_data_into_mongo,
     collection_csv,
-    download_and_save_btcusd,
-    fetch_and_store_historical_exercise_data,
-    csv_file_path
+    csv_file_path,
+    init_storage
 )
-from dash_app import app_dash
+from scheduler import IngestionScheduler, build_jobs, install_signal_handlers
+from bootstrap import bootstrap_csv, load_progress
+from dash_app import app_dash, dashboard_data, load_data
+from dashboard_data import DASH_SNAPSHOT_MODE
+from app_state import app_state
 import threading
 import time
-from datetime import datetime
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Lock para sincronizar o acesso aos DataFrames
-data_lock = threading.Lock()
+# Intervalo (segundos) de atualização do snapshot publicado para os workers
+DASH_REFRESH_INTERVAL = int(os.getenv('DASH_REFRESH_INTERVAL', '60'))
 
 def load_csv_once():
-    """Load CSV data into MongoDB if the collection is empty."""
-    if collection_csv.estimated_document_count() == 0 and os.path.exists(csv_file_path):
-        logging.info("Arquivo CSV detectado, iniciando leitura.")
-        df_csv = read_csv_file()
-        if not df_csv.empty:
-            insert_data_into_mongo(df_csv, collection_csv)
-            logging.info("Dados do CSV inseridos no MongoDB.")
+    """Load CSV data into MongoDB if the collection is empty or a previous load was interrupted."""
+    if not os.path.exists(csv_file_path):
+        logging.info("Arquivo CSV não existe. Pulando carregamento do CSV.")
+        return
+    progress = load_progress(csv_file_path)
+    # Retoma uma carga interrompida; sem registro de carga, só carrega numa coleção vazia
+    interrupted = progress is not None and not progress.get('done')
+    if interrupted or (progress is None and collection_csv.estimated_document_count() == 0):
+        logging.info("Arquivo CSV detectado, iniciando carga em chunks.")
+        result = bootstrap_csv(csv_file_path)
+        if result and result['done']:
+            logging.info(f"Dados do CSV inseridos no MongoDB: {result['rows_committed']} linhas.")
         else:
-            logging.warning("DataFrame está vazio ou não foi carregado corretamente.")
+            logging.warning("Carga do CSV incompleta; será retomada na próxima inicialização.")
     else:
-        logging.info("Coleção 'csv_data' já possui dados ou o arquivo CSV não existe. Pulando carregamento do CSV.")
+        logging.info("Coleção 'csv_data' já possui dados. Pulando carregamento do CSV.")
 
 def start_dash_server():
     """Start the Dash server."""
     app_dash.run_server(debug=False, host='127.0.0.1', port=8050)
 
-def continuous_btc_download(symbol, start_time, end_time):
-    """Continuous loop to download BTCUSD data."""
+def continuous_dashboard_refresh():
+    """Refresh loop of the loader process, publishing a new snapshot version for the workers."""
     while True:
-        download_and_save_btcusd(symbol, start_time, end_time)
-        time.sleep(1)  # Aumentar o intervalo para 1 minuto para evitar sobrecarga
-
-def continuous_historical_data(start_time, end_time):
-    """Continuous loop to fetch historical exercise data."""
-    while True:
-        fetch_and_store_historical_exercise_data(start_time, end_time)
-        time.sleep(1)  # Aumentar o intervalo para 1 minuto para evitar sobrecarga
+        time.sleep(DASH_REFRESH_INTERVAL)
+        if not app_state.ready:
+            continue
+        try:
+            dashboard_data.refresh()
+        except Exception as e:
+            logging.error(f"Erro na atualização do snapshot: {e}")
 
 def main():
-    load_csv_once()
+    init_storage()
 
-    # Start the Dash server in a separate thread
+    # Start the Dash server in a separate thread; it serves a loading page until the warm-up finishes
     dash_thread = threading.Thread(target=start_dash_server)
     dash_thread.daemon = True
     dash_thread.start()
     logging.info("Dash server started in a separate thread.")
 
-    # Define parameters for BTCUSD and historical data download
-    symbol = "BTCUSDT"
-    start_time = int(datetime(2020, 1, 1).timestamp() * 1000)
-    end_time = int(datetime(2023, 12, 31, 23, 59, 59).timestamp() * 1000)
+    # A carga do CSV termina antes da ingestão: com a coleção vazia o bootstrap decide
+    # pela contagem de documentos, e trades gravados antes disso o fariam ser pulado
+    load_csv_once()
 
-    # Threads for continuous BTCUSD and historical data download
-    btc_download_thread = threading.Thread(target=continuous_btc_download, args=(symbol, start_time, end_time))
-    btc_download_thread.daemon = True
-    btc_download_thread.start()
-    logging.info("Thread de download contínuo de BTCUSDT iniciada.")
+    # Só os dados do dashboard são aquecidos em segundo plano
+    app_state.start_warmup(load_data)
 
-    historical_data_thread = threading.Thread(target=continuous_historical_data, args=(start_time, end_time))
-    historical_data_thread.daemon = True
-    historical_data_thread.start()
-    logging.info("Thread de download contínuo de dados históricos de exercício iniciada.")
+    # No modo 'publish' este processo é o único carregador dos workers do dashboard
+    if DASH_SNAPSHOT_MODE == 'publish':
+        refresh_thread = threading.Thread(target=continuous_dashboard_refresh)
+        refresh_thread.daemon = True
+        refresh_thread.start()
+        logging.info("Thread de publicação de snapshots do dashboard iniciada.")
 
-    while True:
-        time.sleep(1)
+    # Ingestão (trades, exercício e rollups) dos símbolos configurados em INGESTION_SYMBOLS / INGESTION_JOBS
+    jobs, streams = build_jobs()
+    scheduler = IngestionScheduler(jobs, streams)
+    scheduler.start()
+
+    # SIGINT/SIGTERM encerram com a gravação dos lotes pendentes
+    stop_event = threading.Event()
+    install_signal_handlers(stop_event)
+    while not stop_event.wait(1):
+        pass
+    scheduler.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,332 @@
+"""
+In-process metrics for the ingestion, storage and dashboard hot paths, exposed
+in the Prometheus text format at /metrics by `install_metrics(flask_app)`.
+
+Counters, gauges, histograms and sliding-window summaries are kept in a
+module-level registry (one per process), so the Flask API and the Dash server
+running in the same process publish the same numbers. With
+METRICS_PROFILE_SAMPLE_RATE > 0 a fraction of the requests also runs under
+cProfile; the last reports are served at /metrics/profiles.
+"""
+import cProfile
+import io
+import logging
+import math
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, request
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Fração das requisições perfiladas com cProfile (0 desliga)
+METRICS_PROFILE_SAMPLE_RATE = float(os.getenv('METRICS_PROFILE_SAMPLE_RATE', '0'))
+# Relatórios de perfil mantidos em memória e linhas de cada relatório
+METRICS_PROFILE_KEEP = int(os.getenv('METRICS_PROFILE_KEEP', '20'))
+METRICS_PROFILE_LINES = int(os.getenv('METRICS_PROFILE_LINES', '25'))
+# Observações recentes usadas nos quantis dos summaries (p50/p99 dos callbacks)
+METRICS_SUMMARY_WINDOW = int(os.getenv('METRICS_SUMMARY_WINDOW', '1024'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+DASH_CALLBACK_PATH = '_dash-update-component'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    """Base of the metric types: a value per label combination, guarded by a lock."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, **extra):
+        return list(zip(self.labelnames, key)) + list(extra.items())
+
+    def samples(self):
+        """(suffix, labels, value) of every series of the metric."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('_total', self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [('', self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; quantiles are derived by the Prometheus server (histogram_quantile)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append(('_bucket', self._labels(key, le=_format_value(bound)), cumulative))
+                samples.append(('_sum', self._labels(key), state['sum']))
+                samples.append(('_count', self._labels(key), cumulative))
+        return samples
+
+
+class Summary(Metric):
+    """Quantiles (p50/p90/p99) over the last METRICS_SUMMARY_WINDOW observations, plus total sum and count."""
+
+    kind = 'summary'
+
+    def __init__(self, name, documentation, labelnames=(), window=METRICS_SUMMARY_WINDOW):
+        super().__init__(name, documentation, labelnames)
+        self.window = window
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'recent': deque(maxlen=self.window), 'sum': 0.0, 'count': 0}
+            state['recent'].append(value)
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                recent = sorted(state['recent'])
+                for quantile in SUMMARY_QUANTILES:
+                    # Nearest-rank sobre a janela recente
+                    value = recent[min(len(recent) - 1, int(math.ceil(quantile * len(recent))) - 1)] if recent else math.nan
+                    samples.append(('', self._labels(key, quantile=str(quantile)), value))
+                samples.append(('_sum', self._labels(key), state['sum']))
+                samples.append(('_count', self._labels(key), state['count']))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# Ingestão
+INGEST_RECORDS = Counter(
+    'volatiledger_ingest_records', "Records fetched from the exchange.", ('source', 'symbol'))
+INGEST_RECORDS_PER_SECOND = Gauge(
+    'volatiledger_ingest_records_per_second', "Throughput of the last ingestion call (fetch + write).", ('source', 'symbol'))
+INGEST_LAG = Gauge(
+    'volatiledger_ingest_lag_seconds', "Wall clock minus the exchange time of the newest ingested record.", ('source', 'symbol'))
+INGEST_SECONDS = Histogram(
+    'volatiledger_ingest_seconds', "Duration of ingestion calls.", ('source', 'status'))
+# Armazenamento
+MONGO_SECONDS = Histogram(
+    'volatiledger_mongo_operation_seconds', "MongoDB operation latency.", ('operation', 'collection'))
+MONGO_RECORDS = Counter(
+    'volatiledger_mongo_records', "Records written to MongoDB by outcome.", ('collection', 'outcome'))
+MONGO_WRITE_RECORDS_PER_SECOND = Gauge(
+    'volatiledger_mongo_write_records_per_second', "Throughput of the last insert_data_into_mongo call.", ('collection',))
+# Leitura e dashboard
+LOAD_SECONDS = Histogram(
+    'volatiledger_load_seconds', "Duration of the data loading functions (fetch_data, load_data).", ('function', 'source'))
+LOAD_ROWS = Gauge(
+    'volatiledger_load_rows', "Rows returned by the last load.", ('function', 'source'))
+DASH_CALLBACK_SECONDS = Summary(
+    'volatiledger_dash_callback_seconds', "Dash callback latency (server side, including serialization).", ('callback',))
+HTTP_REQUEST_SECONDS = Histogram(
+    'volatiledger_http_request_seconds', "Flask request latency.", ('endpoint', 'status'))
+
+
+@contextmanager
+def timer(metric, **labels):
+    """Observe the duration of the block (seconds) in a Histogram or Summary."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - started, **labels)
+
+
+def timed(metric, **labels):
+    """Decorator form of `timer`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(metric, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_ingest(source, symbol, records, elapsed, newest_time=None):
+    """Count fetched records, their throughput and the lag of the newest one (epoch seconds)."""
+    INGEST_RECORDS.inc(records, source=source, symbol=symbol)
+    if elapsed > 0:
+        INGEST_RECORDS_PER_SECOND.set(records / elapsed, source=source, symbol=symbol)
+    if newest_time is not None:
+        INGEST_LAG.set(max(0.0, time.time() - newest_time), source=source, symbol=symbol)
+
+
+# Perfis por requisição (cProfile)
+_profiles = deque(maxlen=METRICS_PROFILE_KEEP)
+# Só um perfilador pode estar ativo por vez no interpretador
+_profile_lock = threading.Lock()
+
+
+def _start_profile():
+    if METRICS_PROFILE_SAMPLE_RATE <= 0 or random.random() >= METRICS_PROFILE_SAMPLE_RATE:
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        _profile_lock.release()
+        return
+    g.metrics_profiler = profiler
+
+
+def _finish_profile(label, elapsed):
+    profiler = g.pop('metrics_profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    _profile_lock.release()
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(METRICS_PROFILE_LINES)
+    _profiles.append(f"== {label} ({elapsed * 1000:.1f} ms) ==\n{report.getvalue()}")
+
+
+def install_metrics(flask_app):
+    """
+    Register /metrics and /metrics/profiles on a Flask app (the API or the Dash
+    server) and time every request. Requests to the Dash callback route are
+    recorded per callback output in DASH_CALLBACK_SECONDS.
+    """
+    @flask_app.before_request
+    def _metrics_before_request():
+        g.metrics_started = time.perf_counter()
+        _start_profile()
+
+    @flask_app.after_request
+    def _metrics_after_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        if request.path.endswith(DASH_CALLBACK_PATH):
+            body = request.get_json(silent=True) or {}
+            label = body.get('output', 'unknown')
+            DASH_CALLBACK_SECONDS.observe(elapsed, callback=label)
+        else:
+            label = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=label, status=response.status_code)
+        _finish_profile(label, elapsed)
+        return response
+
+    @flask_app.teardown_request
+    def _metrics_teardown(exc):
+        # Requisição interrompida por exceção: libera o perfilador
+        if exc is not None and g.get('metrics_profiler') is not None:
+            _finish_profile('error', 0.0)
+
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    def profiles():
+        if not _profiles:
+            return Response("Nenhum perfil coletado (METRICS_PROFILE_SAMPLE_RATE=0?).\n", mimetype='text/plain')
+        return Response('\n'.join(reversed(_profiles)), mimetype='text/plain')
+
+    flask_app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
+    flask_app.add_url_rule('/metrics/profiles', 'metrics_profiles', profiles, methods=['GET'])
@@ -0,0 +1,152 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Unidades aceitas no parâmetro interval e seus equivalentes no $dateTrunc / pandas
+INTERVAL_UNITS = {
+    's': ('second', 's'),
+    'm': ('minute', 'min'),
+    'h': ('hour', 'h'),
+    'd': ('day', 'D'),
+    'w': ('week', 'W-MON'),
+}
+INTERVAL_PATTERN = re.compile(r'^(\d+)([smhdw])$')
+
+OHLC_CACHE_SIZE = int(os.getenv('OHLC_CACHE_SIZE', '256'))
+# Intervalos que tocam o presente ainda mudam; os fechados podem ficar mais tempo em cache
+OHLC_CACHE_TTL_LIVE = float(os.getenv('OHLC_CACHE_TTL_LIVE', '30'))
+OHLC_CACHE_TTL_CLOSED = float(os.getenv('OHLC_CACHE_TTL_CLOSED', '3600'))
+
+
+def parse_interval(interval):
+    """Parse '1s' ... '1w' into (bin size, $dateTrunc unit, pandas frequency)."""
+    match = INTERVAL_PATTERN.match(str(interval).strip().lower())
+    if not match:
+        raise ValueError(f"Invalid interval '{interval}'. Use e.g. 1s, 15m, 1h, 1d, 1w.")
+    size, unit = int(match.group(1)), match.group(2)
+    if size < 1:
+        raise ValueError("Interval size must be positive.")
+    mongo_unit, pandas_unit = INTERVAL_UNITS[unit]
+    return size, mongo_unit, f"{size}{pandas_unit}"
+
+
+def build_ohlc_pipeline(interval, symbol=None, start=None, end=None):
+    """Aggregation pipeline bucketing raw trades into OHLCV bars inside MongoDB."""
+    size, unit, _ = parse_interval(interval)
+    match = {}
+    if symbol:
+        match['symbol'] = symbol
+    time_range = {}
+    if start is not None:
+        time_range['$gte'] = start
+    if end is not None:
+        time_range['$lt'] = end
+    match['time'] = time_range or {"$type": "date"}
+    trunc = {"date": "$time", "unit": unit, "binSize": size}
+    if unit == 'week':
+        trunc['startOfWeek'] = 'monday'
+    return [
+        {"$match": match},
+        # Ordenar antes do $group permite usar o índice (symbol, time) e dá sentido a $first/$last
+        {"$sort": {"time": 1}},
+        {"$group": {
+            "_id": {"$dateTrunc": trunc},
+            "open": {"$first": "$price"},
+            "high": {"$max": "$price"},
+            "low": {"$min": "$price"},
+            "close": {"$last": "$price"},
+            "mean": {"$avg": "$price"},
+            "volume": {"$sum": "$quantity"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "time": "$_id", "open": 1, "high": 1, "low": 1,
+                      "close": 1, "mean": 1, "volume": 1, "count": 1}},
+    ]
+
+
+class OHLCCache:
+    """Small thread-safe LRU cache with per-entry expiry."""
+
+    def __init__(self, maxsize=OHLC_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+ohlc_cache = OHLCCache()
+
+
+def to_naive_utc(value):
+    """Parse a query parameter into a naive UTC datetime (as stored by PyMongo)."""
+    if value is None or value == '':
+        return None
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.to_pydatetime()
+
+
+def fetch_ohlc(collection, interval, symbol=None, start=None, end=None, use_cache=True):
+    """
+    Return OHLCV bars for [start, end) computed by MongoDB, as a list of dicts.
+    Results are cached per (symbol, interval, start, end).
+    """
+    parse_interval(interval)
+    start, end = to_naive_utc(start), to_naive_utc(end)
+    key = (collection.name, symbol, interval, start, end)
+    if use_cache:
+        cached = ohlc_cache.get(key)
+        if cached is not None:
+            return cached
+    bars = list(collection.aggregate(build_ohlc_pipeline(interval, symbol, start, end), allowDiskUse=True))
+    if use_cache:
+        closed = end is not None and end < pd.Timestamp.utcnow().tz_localize(None).to_pydatetime()
+        ohlc_cache.set(key, bars, OHLC_CACHE_TTL_CLOSED if closed else OHLC_CACHE_TTL_LIVE)
+    return bars
+
+
+def resample_ohlc(df, interval):
+    """pandas reference implementation (used by the benchmark against the pushdown path)."""
+    _, _, freq = parse_interval(interval)
+    bars = df.resample(freq, label='left', closed='left').agg(
+        open=('price', 'first'),
+        high=('price', 'max'),
+        low=('price', 'min'),
+        close=('price', 'last'),
+        mean=('price', 'mean'),
+        volume=('quantity', 'sum'),
+        count=('price', 'size'),
+    )
+    return bars[bars['count'] > 0].reset_index()
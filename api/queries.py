@@ -0,0 +1,104 @@
+import json
+import math
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from ohlc import to_naive_utc
+
+# Tamanho dos lotes lidos do cursor ao transmitir respostas grandes
+API_CURSOR_BATCH_SIZE = int(os.getenv('API_CURSOR_BATCH_SIZE', '5000'))
+API_MAX_LIMIT = int(os.getenv('API_MAX_LIMIT', '100000'))
+
+
+def parse_fields(fields):
+    """Turn 'price,quantity' into a Mongo projection (the sort keys are always kept)."""
+    if not fields:
+        return None
+    projection = {field.strip(): 1 for field in fields.split(',') if field.strip()}
+    return projection or None
+
+
+def parse_after(after):
+    """
+    Parse the keyset cursor '<ISO time>,<_id>' built from the last row of a page.
+    Raises ValueError on malformed input.
+    """
+    if not after:
+        return None
+    try:
+        time_value, object_id = after.rsplit(',', 1)
+        return to_naive_utc(time_value), ObjectId(object_id)
+    except (ValueError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor '{after}': expected '<ISO time>,<_id>'.") from e
+
+
+def build_range_query(time_field, symbol=None, start=None, end=None, after=None):
+    """Filter on symbol and [start, end) plus the keyset condition after (time, _id)."""
+    query = {}
+    if symbol:
+        query['symbol'] = symbol
+    time_range = {}
+    if start is not None:
+        time_range['$gte'] = to_naive_utc(start)
+    if end is not None:
+        time_range['$lt'] = to_naive_utc(end)
+    if time_range:
+        query[time_field] = time_range
+    if after is not None:
+        after_time, after_id = after
+        query['$or'] = [
+            {time_field: {"$gt": after_time}},
+            {time_field: after_time, "_id": {"$gt": after_id}},
+        ]
+    return query
+
+
+def find_documents(collection, time_field, symbol=None, start=None, end=None, after=None,
+                   fields=None, limit=None, batch_size=API_CURSOR_BATCH_SIZE):
+    """Cursor over a collection ordered by (time_field, _id), ready for keyset pagination."""
+    query = build_range_query(time_field, symbol, start, end, after)
+    projection = parse_fields(fields)
+    if projection is not None:
+        projection[time_field] = 1
+    cursor = collection.find(query, projection).sort([(time_field, 1), ("_id", 1)]).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(min(int(limit), API_MAX_LIMIT))
+    return cursor
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='milliseconds')
+    if isinstance(value, ObjectId):
+        return str(value)
+    return str(value)
+
+
+def _clean(document):
+    # NaN não é JSON válido
+    return {
+        key: (None if isinstance(value, float) and math.isnan(value) else value)
+        for key, value in document.items()
+    }
+
+
+def dumps_document(document):
+    return json.dumps(_clean(document), default=_json_default, separators=(',', ':'))
+
+
+def stream_ndjson(first, cursor):
+    """Yield one JSON document per line, straight from the cursor."""
+    yield dumps_document(first) + '\n'
+    for document in cursor:
+        yield dumps_document(document) + '\n'
+
+
+def stream_json_array(first, cursor):
+    """Yield a JSON array incrementally, so memory stays flat for any result size."""
+    yield '[' + dumps_document(first)
+    for document in cursor:
+        yield ',' + dumps_document(document)
+    yield ']'
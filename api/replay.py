@@ -0,0 +1,366 @@
+"""
+Streaming replay of the stored trades (or OHLCV rollup bars) for backtesting.
+
+`Replay` reads every symbol in time-ordered chunks on a background thread and
+keeps up to REPLAY_PREFETCH merged batches ready ahead of the consumer. Each
+chunk is one indexed range query on (symbol, time) capped at REPLAY_CHUNK_ROWS
+rows: a capped chunk ends just before its last timestamp and the next query
+resumes there, so memory stays bounded however dense the history is, and no
+cursor is left open while a paced replay waits.
+
+The symbols are merged by timestamp without touching rows in Python: every
+round emits the rows older than the smallest position already read across the
+symbols (concatenation plus a stable argsort, ties keep the symbol order).
+Batches are NumPy structured arrays (`TRADE_DTYPE` / `BAR_DTYPE`) with the
+symbol as an int32 code into `Replay.symbols`.
+
+`speed` replays as fast as possible (None or 0) or paced against the wall
+clock: speed=1 is real time, speed=3600 plays one market hour per second.
+With pymongoarrow installed the chunks are decoded straight into Arrow
+columns instead of one dict per document.
+
+Uso:
+    python api/replay.py --symbol BTCUSDT --symbol ETHUSDT --start 2024-01-01 --end 2024-02-01
+    python api/replay.py --symbol BTCUSDT --bars 1m --speed 3600
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from pymongo import ASCENDING
+
+from ohlc import to_naive_utc
+from queries import build_range_query
+from rollups import ROLLUP_INTERVALS
+
+try:
+    from pymongoarrow.api import Schema, find_arrow_all
+    import pyarrow as pa
+except ImportError:
+    # Sem pymongoarrow, decodifica os documentos com o pymongo
+    find_arrow_all = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Máximo de linhas lidas por consulta (por símbolo); limita a memória de cada chunk
+REPLAY_CHUNK_ROWS = int(os.getenv('REPLAY_CHUNK_ROWS', '200000'))
+# Lotes já mesclados mantidos à frente do consumidor pela thread de leitura
+REPLAY_PREFETCH = int(os.getenv('REPLAY_PREFETCH', '4'))
+# Linhas por lote entregue
+REPLAY_BATCH_ROWS = int(os.getenv('REPLAY_BATCH_ROWS', '65536'))
+# Janela inicial de cada consulta; dobra enquanto os chunks vêm pela metade
+REPLAY_WINDOW_SECONDS = int(os.getenv('REPLAY_WINDOW_SECONDS', '3600'))
+# Granularidade do ritmo em tempo real (segundos de relógio por fatia)
+REPLAY_PACE_SECONDS = float(os.getenv('REPLAY_PACE_SECONDS', '0.05'))
+
+TRADES_COLLECTION = 'csv_data'
+
+TRADE_DTYPE = np.dtype([
+    ('time', 'datetime64[ms]'),
+    ('symbol', np.int32),
+    ('price', np.float64),
+    ('quantity', np.float64),
+    ('aggId', np.int64),
+])
+BAR_DTYPE = np.dtype([
+    ('time', 'datetime64[ms]'),
+    ('symbol', np.int32),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+    ('count', np.int64),
+])
+# Valor usado quando o campo falta no documento (aggId das linhas do CSV)
+MISSING_VALUES = {'aggId': -1, 'count': 0}
+
+_END = object()
+
+
+def _to_ms(value):
+    return int(np.datetime64(to_naive_utc(value), 'ms').astype(np.int64))
+
+
+def _from_ms(ms):
+    return np.datetime64(int(ms), 'ms').item()
+
+
+def merge_sorted(parts, dtype=TRADE_DTYPE):
+    """Merge time-sorted record arrays into one, stable on ties (order of `parts`)."""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return np.empty(0, dtype=dtype)
+    if len(parts) == 1:
+        return parts[0]
+    merged = np.concatenate(parts)
+    # mergesort sobre trechos já ordenados: praticamente linear
+    return merged[np.argsort(merged['time'], kind='stable')]
+
+
+class _Source:
+    """Read position and unconsumed rows of one symbol."""
+
+    def __init__(self, symbol, code, start_ms, end_ms, dtype):
+        self.symbol = symbol
+        self.code = code
+        self.position = start_ms
+        self.end = end_ms
+        self.window = REPLAY_WINDOW_SECONDS * 1000
+        self.buffer = np.empty(0, dtype=dtype)
+
+    @property
+    def exhausted(self):
+        return self.position >= self.end
+
+    def take(self, horizon):
+        """Pop the buffered rows older than `horizon` (epoch ms); all of them when None."""
+        if horizon is None:
+            rows, self.buffer = self.buffer, self.buffer[:0]
+            return rows
+        cut = np.searchsorted(self.buffer['time'], np.datetime64(horizon, 'ms'), side='left')
+        rows, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return rows
+
+
+class Replay:
+    """
+    Time-ordered replay of stored trades (or bars with `bars='1m'|'1h'|'1d'`)
+    of `symbols` in [start, end). Iterate `batches()` for record arrays or
+    `records()` for one tuple per row; a Replay runs once.
+    """
+
+    def __init__(self, db, symbols, start=None, end=None, bars=None, speed=None,
+                 chunk_rows=REPLAY_CHUNK_ROWS, prefetch=REPLAY_PREFETCH, batch_rows=REPLAY_BATCH_ROWS):
+        if bars is not None and bars not in ROLLUP_INTERVALS:
+            raise ValueError(f"Unknown bar interval '{bars}', expected one of {list(ROLLUP_INTERVALS)}")
+        self.symbols = list(symbols)
+        if not self.symbols:
+            raise ValueError("At least one symbol is required.")
+        self.collection = db[ROLLUP_INTERVALS[bars][0] if bars else TRADES_COLLECTION]
+        self.dtype = BAR_DTYPE if bars else TRADE_DTYPE
+        self.fields = [name for name in self.dtype.names if name not in ('time', 'symbol')]
+        self.start = start
+        self.end = end
+        self.speed = speed or None
+        self.chunk_rows = chunk_rows
+        self.batch_rows = batch_rows
+        self.stats = {'rows': 0, 'batches': 0, 'queries': 0, 'read_seconds': 0.0, 'wait_seconds': 0.0}
+        self._queue = queue.Queue(maxsize=max(1, prefetch))
+        self._stop = threading.Event()
+        self._thread = None
+        self._clock = None
+
+    # Leitura (thread de prefetch)
+
+    def _bounds(self, symbol):
+        """[start, end) in epoch ms; open ends are taken from the stored data."""
+        start = _to_ms(self.start) if self.start is not None else None
+        end = _to_ms(self.end) if self.end is not None else None
+        if start is None or end is None:
+            first = self.collection.find_one({'symbol': symbol}, {'time': 1}, sort=[('time', ASCENDING)])
+            last = self.collection.find_one({'symbol': symbol}, {'time': 1}, sort=[('time', -1)])
+            if first is None:
+                return 0, 0
+            if start is None:
+                start = _to_ms(first['time'])
+            if end is None:
+                end = _to_ms(last['time']) + 1
+        return start, end
+
+    def _decode(self, query, limit):
+        """Run a time-sorted query into a record array of `self.dtype` (symbol left unset)."""
+        if find_arrow_all is not None:
+            schema = Schema({'time': pa.timestamp('ms'), **{
+                field: pa.int64() if self.dtype[field].kind == 'i' else pa.float64() for field in self.fields
+            }})
+            options = {'limit': limit} if limit else {}
+            table = find_arrow_all(self.collection, query, schema=schema, sort=[('time', ASCENDING)], **options)
+            rows = np.empty(table.num_rows, dtype=self.dtype)
+            rows['time'] = table.column('time').to_numpy()
+            for field in self.fields:
+                rows[field] = table.column(field).fill_null(MISSING_VALUES.get(field, np.nan)).to_numpy()
+            return rows
+
+        projection = {'_id': 0, 'time': 1, **{field: 1 for field in self.fields}}
+        cursor = self.collection.find(query, projection).sort('time', ASCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        documents = list(cursor.batch_size(min(limit or self.chunk_rows, self.chunk_rows)))
+        rows = np.empty(len(documents), dtype=self.dtype)
+        rows['time'] = [document['time'] for document in documents]
+        for field in self.fields:
+            missing = MISSING_VALUES.get(field, np.nan)
+            rows[field] = [
+                document.get(field) if document.get(field) is not None else missing for document in documents
+            ]
+        return rows
+
+    def _read_window(self, symbol, start_ms, end_ms, limit):
+        """Rows of `symbol` in [start_ms, end_ms), sorted by time, at most `limit` (None = all)."""
+        query = build_range_query('time', symbol, _from_ms(start_ms), _from_ms(end_ms))
+        return self._decode(query, limit)
+
+    def _read(self, source):
+        """Append the next chunk of `source` to its buffer and advance its position."""
+        started = time.perf_counter()
+        until = min(source.position + source.window, source.end)
+        rows = self._read_window(source.symbol, source.position, until, self.chunk_rows + 1)
+        self.stats['queries'] += 1
+        if len(rows) > self.chunk_rows:
+            # Chunk cheio: fica só com os timestamps completos e a próxima consulta recomeça no último
+            last = rows['time'][-1]
+            complete = rows[:np.searchsorted(rows['time'], last, side='left')]
+            if len(complete):
+                rows, until = complete, int(last.astype(np.int64))
+            else:
+                # Mais de chunk_rows trades no mesmo milissegundo: lê esse milissegundo inteiro
+                until = source.position + 1
+                rows = self._read_window(source.symbol, source.position, until, None)
+                self.stats['queries'] += 1
+        elif len(rows) < self.chunk_rows // 4:
+            source.window *= 2
+        rows['symbol'] = source.code
+        source.buffer = np.concatenate([source.buffer, rows]) if len(source.buffer) else rows
+        source.position = until
+        self.stats['read_seconds'] += time.perf_counter() - started
+
+    def _put(self, item):
+        # Bloqueia com o buffer cheio (memória limitada) mas atende close()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            sources = []
+            for code, symbol in enumerate(self.symbols):
+                start_ms, end_ms = self._bounds(symbol)
+                sources.append(_Source(symbol, code, start_ms, end_ms, self.dtype))
+            for source in sources:
+                if not source.exhausted:
+                    self._read(source)
+            while not self._stop.is_set():
+                active = [source for source in sources if not source.exhausted]
+                # Nenhum símbolo ainda pode trazer linhas antes do menor ponto já lido
+                horizon = min(source.position for source in active) if active else None
+                merged = merge_sorted([source.take(horizon) for source in sources], self.dtype)
+                for offset in range(0, len(merged), self.batch_rows):
+                    if not self._put(merged[offset:offset + self.batch_rows]):
+                        return
+                if not active:
+                    break
+                for source in active:
+                    if source.position == horizon:
+                        self._read(source)
+            self._put(_END)
+        except Exception as e:
+            logging.error(f"Erro na leitura do replay: {e}")
+            self._put(e)
+
+    # Consumo
+
+    def _pace(self, batch):
+        """Split `batch` into REPLAY_PACE_SECONDS slices and sleep until each one is due."""
+        times = batch['time'].astype(np.int64)
+        if self._clock is None:
+            self._clock = (int(times[0]), time.monotonic())
+        origin, wall_origin = self._clock
+        step = max(1, int(REPLAY_PACE_SECONDS * 1000 * self.speed))
+        slots = (times - origin) // step
+        cuts = np.flatnonzero(np.diff(slots)) + 1
+        for part, first in zip(np.split(batch, cuts), np.concatenate([[0], cuts])):
+            delay = wall_origin + (times[first] - origin) / 1000 / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            yield part
+
+    def batches(self):
+        """Yield record arrays in time order (at most `batch_rows` rows each)."""
+        if self._thread is not None:
+            raise RuntimeError("A Replay can only be iterated once.")
+        self._thread = threading.Thread(target=self._produce, name='replay-prefetch', daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                started = time.perf_counter()
+                item = self._queue.get()
+                self.stats['wait_seconds'] += time.perf_counter() - started
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                parts = self._pace(item) if self.speed else (item,)
+                for part in parts:
+                    self.stats['rows'] += len(part)
+                    self.stats['batches'] += 1
+                    yield part
+        finally:
+            self.close()
+
+    def records(self):
+        """Yield one tuple per row, in `self.dtype` field order (time as datetime)."""
+        for batch in self.batches():
+            yield from batch.tolist()
+
+    def __iter__(self):
+        return self.batches()
+
+    def close(self):
+        """Stop the prefetch thread (safe to call more than once)."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbol', action='append', help="Symbol (repeatable); default all stored symbols")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--bars', choices=list(ROLLUP_INTERVALS), default=None, help="Replay rollup bars instead of trades")
+    parser.add_argument('--speed', type=float, default=None, help="Market seconds per wall second; default as fast as possible")
+    parser.add_argument('--chunk-rows', type=int, default=REPLAY_CHUNK_ROWS)
+    parser.add_argument('--prefetch', type=int, default=REPLAY_PREFETCH)
+    parser.add_argument('--batch-rows', type=int, default=REPLAY_BATCH_ROWS)
+    args = parser.parse_args()
+
+    from utils import collection_csv, db
+    symbols = args.symbol or sorted(collection_csv.distinct('symbol'))
+    replay = Replay(db, symbols, start=args.start, end=args.end, bars=args.bars, speed=args.speed,
+                    chunk_rows=args.chunk_rows, prefetch=args.prefetch, batch_rows=args.batch_rows)
+    started = time.perf_counter()
+    first = last = None
+    for batch in replay.batches():
+        if first is None:
+            first = batch['time'][0]
+        last = batch['time'][-1]
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "symbols": symbols,
+        "first": str(first),
+        "last": str(last),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(replay.stats['rows'] / elapsed) if elapsed > 0 else None,
+        **{name: round(value, 3) if isinstance(value, float) else value for name, value in replay.stats.items()},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
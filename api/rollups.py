@@ -0,0 +1,230 @@
+import argparse
+import logging
+import os
+import uuid
+
+import pandas as pd
+from pymongo import ASCENDING, UpdateOne
+
+from timeseries import retained_since, trade_write_lock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Intervalos mantidos: nome -> (coleção, frequência pandas, unidade do $dateTrunc)
+ROLLUP_INTERVALS = {
+    '1m': ('bars_1m', 'min', 'minute'),
+    '1h': ('bars_1h', 'h', 'hour'),
+    '1d': ('bars_1d', 'D', 'day'),
+}
+
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'mean', 'volume', 'count']
+# Lease de escrita mantido durante a reconstrução de um intervalo de um símbolo (segundos)
+ROLLUP_REBUILD_LOCK_TTL = float(os.getenv('ROLLUP_REBUILD_LOCK_TTL', '600'))
+
+
+def create_rollup_indexes(db):
+    for collection_name, _, _ in ROLLUP_INTERVALS.values():
+        db[collection_name].create_index(
+            [("symbol", ASCENDING), ("time", ASCENDING)], name="uniq_symbol_time", unique=True
+        )
+        db[collection_name].create_index([("time", ASCENDING)], name="idx_time")
+
+
+def _aggregate_batch(df, freq):
+    """Pre-aggregate a batch of trades per (symbol, bucket) before touching Mongo."""
+    df = df.sort_values('time', kind='stable')
+    df = df.assign(bucket=df['time'].dt.floor(freq))
+    grouped = df.groupby(['symbol', 'bucket'], sort=False)
+    return grouped.agg(
+        open=('price', 'first'),
+        open_time=('time', 'first'),
+        high=('price', 'max'),
+        low=('price', 'min'),
+        close=('price', 'last'),
+        close_time=('time', 'last'),
+        price_sum=('price', 'sum'),
+        volume=('quantity', 'sum'),
+        count=('price', 'size'),
+    ).reset_index()
+
+
+def _bar_update(row):
+    """
+    Pipeline update merging a partial bar into the stored one. Open/close only
+    move when the batch has an earlier/later trade, so late trades are merged
+    correctly; high/low/volume/count are commutative.
+    """
+    open_time = row.open_time.to_pydatetime()
+    close_time = row.close_time.to_pydatetime()
+    return [
+        {"$set": {
+            "open": {"$cond": [
+                {"$or": [{"$not": ["$open_time"]}, {"$lt": [open_time, "$open_time"]}]},
+                float(row.open), "$open"
+            ]},
+            "close": {"$cond": [
+                {"$or": [{"$not": ["$close_time"]}, {"$gte": [close_time, "$close_time"]}]},
+                float(row.close), "$close"
+            ]},
+            "open_time": {"$min": ["$open_time", open_time]},
+            "close_time": {"$max": ["$close_time", close_time]},
+            "high": {"$max": ["$high", float(row.high)]},
+            "low": {"$min": ["$low", float(row.low)]},
+            "price_sum": {"$add": [{"$ifNull": ["$price_sum", 0]}, float(row.price_sum)]},
+            "volume": {"$add": [{"$ifNull": ["$volume", 0]}, float(row.volume)]},
+            "count": {"$add": [{"$ifNull": ["$count", 0]}, int(row.count)]},
+        }},
+        {"$set": {"mean": {"$divide": ["$price_sum", "$count"]}}},
+    ]
+
+
+def update_rollups(db, trades):
+    """
+    Fold newly inserted trades into every rollup collection.
+    Only pass trades that were really inserted (not duplicates), otherwise
+    volume and count would be counted twice.
+    """
+    if not trades:
+        return 0
+    df = pd.DataFrame(trades, columns=['symbol', 'time', 'price', 'quantity'])
+    df = df.dropna(subset=['time', 'price'])
+    if df.empty:
+        return 0
+    df['time'] = pd.to_datetime(df['time'])
+    df['quantity'] = df['quantity'].fillna(0.0)
+    updated = 0
+    for collection_name, freq, _ in ROLLUP_INTERVALS.values():
+        bars = _aggregate_batch(df, freq)
+        operations = [
+            UpdateOne({"symbol": row.symbol, "time": row.bucket.to_pydatetime()}, _bar_update(row), upsert=True)
+            for row in bars.itertuples(index=False)
+        ]
+        db[collection_name].bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
+
+
+def rebuild_rollups(db, symbol=None, intervals=None, since=None, until=None):
+    """
+    Regenerate rollup collections from the raw trades in `csv_data` inside MongoDB.
+    With `since`/`until`, only the buckets of the days in [since, until) are
+    rebuilt (reconciliation of recent bars, compaction); otherwise the whole
+    history of the symbol. Days whose ticks may already have expired
+    (TRADES_RETENTION_DAYS) are never rebuilt, since their bars are all that is left.
+
+    The bars are merged over the existing ones (never deleted first, so readers
+    always see every bucket) and only the buckets left without trades are
+    removed afterwards. Each (interval, symbol) pass holds the symbol's
+    `trade_write_lock`, so no concurrent insert + `update_rollups` can land
+    between the aggregation and the merge.
+    """
+    symbols = [symbol] if symbol else db['csv_data'].distinct('symbol')
+    # Começa num limite de dia, comum a todos os intervalos, para não reconstruir barras parciais
+    since = pd.Timestamp(since).floor('D').to_pydatetime() if since is not None else None
+    horizon = retained_since()
+    if horizon is not None and (since is None or since < horizon):
+        since = horizon
+    until = pd.Timestamp(until).floor('D').to_pydatetime() if until is not None else None
+    time_range = {}
+    if since is not None:
+        time_range['$gte'] = since
+    if until is not None:
+        time_range['$lt'] = until
+    time_match = time_range or {"$type": "date"}
+    for interval in intervals or ROLLUP_INTERVALS:
+        collection_name, _, unit = ROLLUP_INTERVALS[interval]
+        for sym in symbols:
+            scope = {"symbol": sym, "time": time_range} if time_range else {"symbol": sym}
+            # Marca as barras desta reconstrução; as que ficarem sem a marca não têm mais trades
+            rebuild_id = uuid.uuid4().hex
+            pipeline = [
+                {"$match": {"symbol": sym, "time": time_match}},
+                {"$sort": {"time": 1}},
+                {"$group": {
+                    "_id": {"$dateTrunc": {"date": "$time", "unit": unit}},
+                    "open": {"$first": "$price"},
+                    "open_time": {"$first": "$time"},
+                    "high": {"$max": "$price"},
+                    "low": {"$min": "$price"},
+                    "close": {"$last": "$price"},
+                    "close_time": {"$last": "$time"},
+                    "price_sum": {"$sum": "$price"},
+                    "volume": {"$sum": "$quantity"},
+                    "count": {"$sum": 1},
+                }},
+                {"$project": {
+                    "_id": 0, "symbol": sym, "time": "$_id",
+                    "open": 1, "open_time": 1, "high": 1, "low": 1, "close": 1, "close_time": 1,
+                    "price_sum": 1, "volume": 1, "count": 1,
+                    "mean": {"$divide": ["$price_sum", "$count"]},
+                    "rebuild_id": rebuild_id,
+                }},
+                {"$merge": {"into": collection_name, "on": ["symbol", "time"],
+                            "whenMatched": "replace", "whenNotMatched": "insert"}},
+            ]
+            with trade_write_lock(db, [sym], ttl=ROLLUP_REBUILD_LOCK_TTL):
+                db['csv_data'].aggregate(pipeline, allowDiskUse=True)
+                removed = db[collection_name].delete_many({**scope, "rebuild_id": {"$ne": rebuild_id}}).deleted_count
+            logging.info(
+                f"Rollup '{collection_name}' rebuilt for {sym}: {db[collection_name].count_documents(scope)} bars "
+                f"({removed} removed)."
+            )
+
+
+def load_bars(db, interval='1d', symbol=None, start=None, end=None):
+    """Read bars of an interval as a DataFrame ordered by time."""
+    collection_name = ROLLUP_INTERVALS[interval][0]
+    query = {}
+    if symbol:
+        query['symbol'] = symbol
+    if start is not None or end is not None:
+        query['time'] = {}
+        if start is not None:
+            query['time']['$gte'] = pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            query['time']['$lte'] = pd.Timestamp(end).to_pydatetime()
+    projection = {"_id": 0, "symbol": 1, "time": 1, "price_sum": 1, **{field: 1 for field in BAR_FIELDS}}
+    return pd.DataFrame(list(db[collection_name].find(query, projection).sort("time", ASCENDING)))
+
+
+def bar_summary(db, interval='1d', symbol=None, start=None, end=None):
+    """
+    Bars of an interval in the layout produced by `utils.resample_daily`
+    (time, price_mean, price_min, price_max, total_quantity).
+    """
+    bars = load_bars(db, interval, symbol=symbol, start=start, end=end)
+    if bars.empty:
+        return pd.DataFrame()
+    # Combina os símbolos por bucket, como o resample sobre todos os trades
+    summary = bars.groupby('time').agg(
+        price_sum=('price_sum', 'sum'),
+        count=('count', 'sum'),
+        price_min=('low', 'min'),
+        price_max=('high', 'max'),
+        total_quantity=('volume', 'sum'),
+    ).reset_index()
+    summary['price_mean'] = summary['price_sum'] / summary['count']
+    return summary[['time', 'price_mean', 'price_min', 'price_max', 'total_quantity']]
+
+
+def daily_summary(db, symbol=None):
+    return bar_summary(db, '1d', symbol=symbol)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain OHLCV rollup collections.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild = subparsers.add_parser('rebuild', help="Regenerate rollups from raw trades")
+    rebuild.add_argument('--symbol', default=None)
+    rebuild.add_argument('--interval', choices=list(ROLLUP_INTERVALS), action='append')
+    args = parser.parse_args()
+
+    from utils import db, init_storage
+    init_storage()
+    if args.command == 'rebuild':
+        rebuild_rollups(db, symbol=args.symbol, intervals=args.interval)
+
+
+if __name__ == "__main__":
+    main()
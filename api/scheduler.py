@@ -0,0 +1,433 @@
+"""
+Ingestion scheduler for many symbols.
+
+Every (job type, symbol) pair is a job: `trades` (REST aggTrades, or one
+WebSocket stream per symbol with INGESTION_MODE=stream), `exercise` (exercise
+records per underlying), `rollups` (periodic reconciliation of the recent
+bars), `volatility` (incremental realized-volatility estimates),
+`compaction` (trade ticks about to expire rebuilt into bars) and `gaps`
+(audit of the stored trades and re-fetch of the missing ranges). A pool of
+workers runs the due jobs in bounded slices, so a symbol with a long history
+to catch up never holds a worker for long. The most urgent job
+goes first: lower priority value, aged by how long it has been waiting, so
+every job keeps running. Jobs whose Binance host has no request weight left
+are skipped until it refills, because the weight budget is shared by every
+job of that host.
+
+Uso:
+    python api/scheduler.py --symbols BTCUSDT,ETHUSDT,SOLUSDT --jobs trades,rollups
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+from backfill import parse_date
+from binance_client import get_client
+from exercise_harvester import EXERCISE_POLL_INTERVAL, EXERCISE_UNDERLYINGS, harvest_underlying
+from gap_audit import GAP_AUDIT_INTERVAL, GAP_REPAIR_SLICE_PAGES, audit_symbol, create_gap_indexes, repair_gaps
+from rollups import rebuild_rollups
+from stream import TradeStream
+from timeseries import TRADES_COMPACTION_INTERVAL, compact_trades
+from volatility import update_all_volatility
+from utils import (
+    AGG_TRADES_WEIGHT,
+    BINANCE_API_URL,
+    BINANCE_OPTIONS_API_URL,
+    BINANCE_OPTIONS_WEIGHT_LIMIT,
+    EXERCISE_HISTORY_WEIGHT,
+    INGEST_CAUGHT_UP,
+    INGEST_ERROR,
+    INGEST_MORE,
+    db,
+    download_trades_slice,
+    init_storage,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+
+def _env_list(name, default):
+    return [item.strip() for item in os.getenv(name, default).split(',') if item.strip()]
+
+
+INGESTION_SYMBOLS = _env_list('INGESTION_SYMBOLS', 'BTCUSDT')
+INGESTION_JOBS = _env_list('INGESTION_JOBS', 'trades,exercise,rollups,volatility,compaction,gaps')
+# Modo de ingestão de trades: 'rest' (polling) ou 'stream' (WebSocket)
+INGESTION_MODE = os.getenv('INGESTION_MODE', 'rest')
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', '8'))
+# A cada N segundos de espera um job sobe um nível de prioridade (evita starvation)
+SCHEDULER_AGING_SECONDS = float(os.getenv('SCHEDULER_AGING_SECONDS', '30'))
+SCHEDULER_HEALTH_INTERVAL = int(os.getenv('SCHEDULER_HEALTH_INTERVAL', '30'))
+SCHEDULER_SHUTDOWN_TIMEOUT = float(os.getenv('SCHEDULER_SHUTDOWN_TIMEOUT', '60'))
+
+TRADES_HISTORY_START = os.getenv('TRADES_HISTORY_START', '2020-01-01')
+# Intervalo (segundos) entre consultas de um símbolo em dia e páginas por fatia
+TRADES_POLL_INTERVAL = float(os.getenv('TRADES_POLL_INTERVAL', '1'))
+TRADES_SLICE_PAGES = int(os.getenv('TRADES_SLICE_PAGES', '10'))
+EXERCISE_SLICE_WINDOWS = int(os.getenv('EXERCISE_SLICE_WINDOWS', '10'))
+ROLLUP_RECONCILE_INTERVAL = int(os.getenv('ROLLUP_RECONCILE_INTERVAL', '3600'))
+ROLLUP_RECONCILE_DAYS = int(os.getenv('ROLLUP_RECONCILE_DAYS', '2'))
+VOLATILITY_UPDATE_INTERVAL = int(os.getenv('VOLATILITY_UPDATE_INTERVAL', '60'))
+
+# Backoff após falhas consecutivas: base * 2^(falhas - 1), limitado, com jitter
+JOB_BACKOFF_BASE = float(os.getenv('JOB_BACKOFF_BASE', '5'))
+JOB_BACKOFF_CAP = float(os.getenv('JOB_BACKOFF_CAP', '600'))
+
+# Menor valor = mais urgente
+JOB_PRIORITIES = {'trades': 0, 'exercise': 1, 'rollups': 2, 'volatility': 2, 'compaction': 3, 'gaps': 3}
+
+# Último estado de saúde de cada job, lido por /api/ingestion
+collection_ingestion_jobs = db['ingestion_jobs']
+
+
+class Job:
+    """A recurring ingestion task with its schedule, health and backoff state."""
+
+    def __init__(self, kind, key, run, interval, priority=None, client=None, weight=0):
+        self.kind = kind
+        self.key = key
+        self.name = f"{kind}:{key}"
+        self.run = run
+        self.interval = interval
+        self.priority = JOB_PRIORITIES.get(kind, 0) if priority is None else priority
+        self.client = client
+        self.weight = weight
+        self.next_run = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.total_failures = 0
+        self.last_status = None
+        self.last_error = None
+        self.last_duration = None
+        self.last_run_at = None
+        self.last_success_at = None
+
+    def urgency(self, now):
+        return self.priority - (now - self.next_run) / SCHEDULER_AGING_SECONDS
+
+    def finished(self, status, error, duration, now):
+        self.runs += 1
+        self.last_status = status
+        self.last_duration = duration
+        self.last_run_at = datetime.now(timezone.utc)
+        if status == INGEST_ERROR:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = error
+            backoff = min(JOB_BACKOFF_CAP, JOB_BACKOFF_BASE * 2 ** (self.failures - 1))
+            self.next_run = now + max(self.interval, backoff * random.uniform(0.5, 1.0))
+            return
+        self.failures = 0
+        self.last_error = None
+        self.last_success_at = self.last_run_at
+        # Ainda há trabalho: volta para a fila na hora, competindo com os outros jobs
+        self.next_run = now if status == INGEST_MORE else now + self.interval
+
+    def health(self, now):
+        if self.running:
+            state = 'running'
+        elif self.failures:
+            state = 'backoff'
+        else:
+            state = 'ok'
+        return {
+            "kind": self.kind,
+            "key": self.key,
+            "state": state,
+            "runs": self.runs,
+            "consecutive_failures": self.failures,
+            "total_failures": self.total_failures,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "last_duration_s": self.last_duration,
+            "last_run_at": self.last_run_at,
+            "last_success_at": self.last_success_at,
+            "next_run_in_s": max(0.0, self.next_run - now),
+        }
+
+
+def reconcile_rollups(symbol):
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=ROLLUP_RECONCILE_DAYS)
+    rebuild_rollups(db, symbol=symbol, since=since)
+    return INGEST_CAUGHT_UP
+
+
+def update_volatility_job(symbol):
+    update_all_volatility(db, symbol)
+    return INGEST_CAUGHT_UP
+
+
+def compaction_job(symbol):
+    compact_trades(db, symbol)
+    return INGEST_CAUGHT_UP
+
+
+def gap_audit_job(symbol):
+    # Auditoria incremental; o reparo roda em fatias e devolve INGEST_MORE enquanto houver buracos abertos
+    audit_symbol(symbol)
+    return repair_gaps(symbol, max_pages=GAP_REPAIR_SLICE_PAGES)
+
+
+def build_jobs(symbols=None, kinds=None, underlyings=None, mode=INGESTION_MODE):
+    """Jobs (and WebSocket streams, in stream mode) for the configured symbols and job types."""
+    symbols = symbols or INGESTION_SYMBOLS
+    kinds = kinds or INGESTION_JOBS
+    underlyings = underlyings or EXERCISE_UNDERLYINGS
+    jobs = []
+    streams = []
+    if 'trades' in kinds:
+        if mode == 'stream':
+            streams = [TradeStream(symbol) for symbol in symbols]
+        else:
+            spot = get_client(BINANCE_API_URL)
+            start_time = parse_date(TRADES_HISTORY_START)
+            for symbol in symbols:
+                jobs.append(Job(
+                    'trades', symbol,
+                    lambda symbol=symbol: download_trades_slice(symbol, start_time, max_pages=TRADES_SLICE_PAGES),
+                    TRADES_POLL_INTERVAL, client=spot, weight=AGG_TRADES_WEIGHT
+                ))
+    if 'exercise' in kinds:
+        options = get_client(BINANCE_OPTIONS_API_URL, weight_limit=BINANCE_OPTIONS_WEIGHT_LIMIT)
+        for underlying in underlyings:
+            jobs.append(Job(
+                'exercise', underlying,
+                lambda underlying=underlying: harvest_underlying(underlying, max_windows=EXERCISE_SLICE_WINDOWS),
+                EXERCISE_POLL_INTERVAL, client=options, weight=EXERCISE_HISTORY_WEIGHT
+            ))
+    if 'rollups' in kinds:
+        for symbol in symbols:
+            jobs.append(Job('rollups', symbol, lambda symbol=symbol: reconcile_rollups(symbol), ROLLUP_RECONCILE_INTERVAL))
+    if 'volatility' in kinds:
+        for symbol in symbols:
+            jobs.append(Job('volatility', symbol, lambda symbol=symbol: update_volatility_job(symbol), VOLATILITY_UPDATE_INTERVAL))
+    if 'compaction' in kinds:
+        for symbol in symbols:
+            jobs.append(Job('compaction', symbol, lambda symbol=symbol: compaction_job(symbol), TRADES_COMPACTION_INTERVAL))
+    if 'gaps' in kinds:
+        create_gap_indexes()
+        spot = get_client(BINANCE_API_URL)
+        for symbol in symbols:
+            jobs.append(Job(
+                'gaps', symbol, lambda symbol=symbol: gap_audit_job(symbol),
+                GAP_AUDIT_INTERVAL, client=spot, weight=AGG_TRADES_WEIGHT
+            ))
+    return jobs, streams
+
+
+class IngestionScheduler:
+    """Worker pool running the due jobs by aged priority within the shared weight budget."""
+
+    def __init__(self, jobs, streams=(), workers=SCHEDULER_WORKERS):
+        self.jobs = list(jobs)
+        self.streams = list(streams)
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._stream_loop = None
+        self._stream_thread = None
+        # Estado dos streams para /api/ingestion: reinícios após falhas não tratadas em run()
+        self._stream_status = {
+            stream.symbol: {"restarts": 0, "last_error": None, "last_failure_at": None, "running": False}
+            for stream in self.streams
+        }
+
+    def start(self):
+        for i in range(min(self.workers, len(self.jobs))):
+            thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.streams:
+            self._stream_loop = asyncio.new_event_loop()
+            self._stream_thread = threading.Thread(target=self._run_streams, name='ingest-streams', daemon=True)
+            self._stream_thread.start()
+        health_thread = threading.Thread(target=self._health_loop, name='ingest-health', daemon=True)
+        health_thread.start()
+        logging.info(
+            f"Agendador de ingestão iniciado: {len(self.jobs)} jobs, {len(self.streams)} streams, "
+            f"{len(self._threads)} workers."
+        )
+
+    def _pick(self, now):
+        """Most urgent due job with weight available, or (None, seconds to wait)."""
+        best = None
+        wait = 1.0
+        for job in self.jobs:
+            if job.running:
+                continue
+            if job.next_run > now:
+                wait = min(wait, job.next_run - now)
+                continue
+            budget_wait = job.client.limiter.wait_time(job.weight) if job.client is not None else 0.0
+            if budget_wait > 0:
+                # Sem peso disponível no host: não ocupa um worker bloqueado no limitador
+                wait = min(wait, budget_wait)
+                continue
+            if best is None or (job.urgency(now), job.next_run) < (best.urgency(now), best.next_run):
+                best = job
+        return best, max(wait, 0.01)
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            with self._cond:
+                job = None
+                while not self._stopping.is_set():
+                    job, wait = self._pick(time.monotonic())
+                    if job is not None:
+                        job.running = True
+                        break
+                    self._cond.wait(timeout=wait)
+            if job is None:
+                return
+            started = time.monotonic()
+            error = None
+            try:
+                status = job.run()
+            except Exception as e:
+                status, error = INGEST_ERROR, str(e)
+                logging.error(f"Job {job.name} falhou: {e}")
+            if status == INGEST_ERROR and error is None:
+                error = 'slice reported an error'
+            with self._cond:
+                now = time.monotonic()
+                job.finished(status, error, now - started, now)
+                job.running = False
+                self._cond.notify_all()
+
+    async def _supervise(self, stream):
+        """Run a stream and restart it with backoff whenever run() escapes with an error."""
+        status = self._stream_status[stream.symbol]
+        failures = 0
+        while not stream.stopped.is_set():
+            status["running"] = True
+            try:
+                await stream.run()
+                return
+            except Exception as e:
+                failures += 1
+                status.update(restarts=status["restarts"] + 1, last_error=f"{type(e).__name__}: {e}",
+                              last_failure_at=datetime.now(timezone.utc))
+                logging.error(f"Stream {stream.symbol} falhou ({e}); reiniciando.")
+            finally:
+                status["running"] = False
+            delay = min(JOB_BACKOFF_CAP, JOB_BACKOFF_BASE * 2 ** (failures - 1))
+            try:
+                await asyncio.wait_for(stream.stopped.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _run_streams(self):
+        asyncio.set_event_loop(self._stream_loop)
+        try:
+            # return_exceptions: a falha de um símbolo não encerra os outros streams
+            results = self._stream_loop.run_until_complete(asyncio.gather(
+                *(self._supervise(stream) for stream in self.streams), return_exceptions=True
+            ))
+            for stream, result in zip(self.streams, results):
+                if isinstance(result, BaseException):
+                    logging.error(f"Stream {stream.symbol} encerrado: {result!r}")
+        finally:
+            self._stream_loop.close()
+
+    def health(self):
+        now = time.monotonic()
+        with self._cond:
+            jobs = [job.health(now) for job in self.jobs]
+        for symbol, status in self._stream_status.items():
+            jobs.append({
+                "kind": "stream",
+                "key": symbol,
+                "state": 'ok' if status["running"] else ('backoff' if status["last_error"] else 'stopped'),
+                "restarts": status["restarts"],
+                "last_error": status["last_error"],
+                "last_failure_at": status["last_failure_at"],
+            })
+        return jobs
+
+    def _save_health(self):
+        jobs = self.health()
+        if not jobs:
+            return
+        collection_ingestion_jobs.bulk_write([
+            UpdateOne({"_id": f"{job['kind']}:{job['key']}"}, {"$set": job}, upsert=True) for job in jobs
+        ], ordered=False)
+        failing = [f"{job['kind']}:{job['key']}" for job in jobs if job['state'] == 'backoff']
+        if failing:
+            logging.warning(f"Jobs de ingestão em backoff: {', '.join(failing)}")
+
+    def _health_loop(self):
+        while not self._stopping.wait(SCHEDULER_HEALTH_INTERVAL):
+            try:
+                self._save_health()
+            except Exception as e:
+                logging.warning(f"Erro ao gravar a saúde dos jobs de ingestão: {e}")
+
+    def stop(self, timeout=SCHEDULER_SHUTDOWN_TIMEOUT):
+        """
+        Stop dispatching, let the running slices finish (each one writes and
+        checkpoints its pages) and flush the buffered WebSocket batches.
+        """
+        logging.info("Encerrando o agendador de ingestão...")
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._stream_loop is not None and not self._stream_loop.is_closed():
+            # TradeStream.run grava o micro-batch pendente ao sair
+            self._stream_loop.call_soon_threadsafe(lambda: [stream.stop() for stream in self.streams])
+        deadline = time.monotonic() + timeout
+        for thread in self._threads + ([self._stream_thread] if self._stream_thread else []):
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                logging.warning(f"{thread.name} não terminou em {timeout:.0f}s.")
+        try:
+            self._save_health()
+        except Exception as e:
+            logging.warning(f"Erro ao gravar a saúde dos jobs de ingestão: {e}")
+        logging.info("Agendador de ingestão encerrado.")
+
+
+def install_signal_handlers(stop_event):
+    """Turn SIGINT/SIGTERM into a graceful shutdown request (main thread only)."""
+    def request_shutdown(signum, frame):
+        logging.info(f"Sinal {signum} recebido; encerrando.")
+        stop_event.set()
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', default=','.join(INGESTION_SYMBOLS))
+    parser.add_argument('--jobs', default=','.join(INGESTION_JOBS))
+    parser.add_argument('--underlyings', default=','.join(EXERCISE_UNDERLYINGS))
+    parser.add_argument('--mode', choices=['rest', 'stream'], default=INGESTION_MODE)
+    parser.add_argument('--workers', type=int, default=SCHEDULER_WORKERS)
+    args = parser.parse_args()
+
+    init_storage()
+    jobs, streams = build_jobs(
+        [s for s in args.symbols.split(',') if s], [k for k in args.jobs.split(',') if k],
+        [u for u in args.underlyings.split(',') if u], args.mode
+    )
+    scheduler = IngestionScheduler(jobs, streams, workers=args.workers)
+    stop_event = threading.Event()
+    install_signal_handlers(stop_event)
+    scheduler.start()
+    while not stop_event.wait(1):
+        pass
+    scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import pyarrow as pa
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(current_dir, 'snapshots'))
+# Versões antigas mantidas em disco para leitores que ainda não trocaram de versão
+SNAPSHOT_KEEP = int(os.getenv('SNAPSHOT_KEEP', '3'))
+# Intervalo mínimo (segundos) entre verificações do ponteiro CURRENT por um leitor
+SNAPSHOT_POLL_INTERVAL = float(os.getenv('SNAPSHOT_POLL_INTERVAL', '1'))
+
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+FRAME_EXT = '.arrow'
+
+
+def _version_dir(version):
+    return f"v{version:010d}"
+
+
+def _atomic_write(path, text):
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SnapshotStore:
+    """
+    Versioned, read-only columnar snapshots on disk.
+
+    A single publisher writes every frame of a version as an uncompressed Arrow
+    IPC file into `v<version>/`, then flips the `CURRENT` pointer with an atomic
+    rename. Readers memory-map the files, so any number of processes share the
+    same page cache pages instead of holding one copy per worker.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+        self.root = root
+        self.keep = keep
+        os.makedirs(root, exist_ok=True)
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _latest_dir_version(self):
+        """Highest version with a complete `v<version>/` directory, current or not."""
+        latest = 0
+        for entry in os.listdir(self.root):
+            if not entry.startswith('v') or '.tmp-' in entry:
+                continue
+            try:
+                latest = max(latest, int(entry[1:]))
+            except ValueError:
+                continue
+        return latest
+
+    def publish(self, frames, meta=None):
+        """Write `frames` (name -> DataFrame) as a new version and make it current."""
+        # Uma queda entre o rename e a troca do CURRENT deixa um diretório órfão acima do
+        # CURRENT; a próxima versão passa por cima dele (e o prune o remove depois)
+        version = max(self.current_version(), self._latest_dir_version()) + 1
+        final_dir = os.path.join(self.root, _version_dir(version))
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, df in frames.items():
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            # Um único record batch: a leitura vira uma visão contígua do arquivo mapeado
+            table = table.combine_chunks()
+            with pa.OSFile(os.path.join(tmp_dir, name + FRAME_EXT), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+        _atomic_write(os.path.join(tmp_dir, META_FILE), json.dumps(
+            {"version": version, "frames": list(frames), "published_at": time.time(), **(meta or {})},
+            default=str
+        ))
+        os.rename(tmp_dir, final_dir)
+        _atomic_write(os.path.join(self.root, CURRENT_FILE), str(version))
+        self.prune(version)
+        return version
+
+    def prune(self, current=None):
+        current = current or self.current_version()
+        for entry in os.listdir(self.root):
+            if not entry.startswith('v'):
+                continue
+            try:
+                version = int(entry[1:].split('.')[0])
+            except ValueError:
+                continue
+            if version <= current - self.keep or ('.tmp-' in entry and version < current):
+                try:
+                    # No Linux os mapeamentos abertos continuam válidos após a remoção
+                    shutil.rmtree(os.path.join(self.root, entry))
+                except OSError as e:
+                    logging.debug(f"Snapshot {entry} ainda em uso: {e}")
+
+    def open(self, version=None):
+        """
+        Attach to a version (the current one by default) and return
+        (version, meta, frames). Numeric and timestamp columns without nulls
+        are zero-copy, read-only views of the memory-mapped files.
+        """
+        version = version or self.current_version()
+        if not version:
+            return 0, {}, {}
+        path = os.path.join(self.root, _version_dir(version))
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        frames = {}
+        for name in meta['frames']:
+            source = pa.memory_map(os.path.join(path, name + FRAME_EXT), 'r')
+            table = pa.ipc.open_file(source).read_all()
+            frames[name] = table.to_pandas(split_blocks=True, self_destruct=False)
+        return version, meta, frames
+
+
+class SnapshotReader:
+    """Keep the latest attached version, re-checking `CURRENT` at most every `poll_interval` seconds."""
+
+    def __init__(self, store, poll_interval=SNAPSHOT_POLL_INTERVAL):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._current = (0, {}, {})
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_interval:
+            return self._current
+        with self._lock:
+            if now - self._checked_at >= self.poll_interval:
+                version = self.store.current_version()
+                if version and version != self._current[0]:
+                    try:
+                        self._current = self.store.open(version)
+                        logging.info(f"Snapshot v{version} anexado de {self.store.root}.")
+                    except (FileNotFoundError, OSError) as e:
+                        # Versão removida entre a leitura do ponteiro e a abertura; tenta na próxima
+                        logging.warning(f"Falha ao anexar o snapshot v{version}: {e}")
+                self._checked_at = now
+        return self._current
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import suppress
+
+import aiohttp
+import pandas as pd
+
+from binance_client import backoff_delay
+from utils import (
+    agg_trades_to_records,
+    collection_csv,
+    download_and_save_btcusd,
+    insert_data_into_mongo,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# WebSocket da Binance (pode apontar para um servidor local em testes)
+BINANCE_WS_URL = os.getenv('BINANCE_WS_URL', 'wss://stream.binance.com:9443')
+
+# Limiares do micro-batch: grava ao atingir N trades ou após X segundos
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+STREAM_FLUSH_INTERVAL = float(os.getenv('STREAM_FLUSH_INTERVAL', '1.0'))
+STREAM_HEARTBEAT = 30
+# Mensagens recebidas e ainda não processadas (durante o backfill ou escritas lentas);
+# com a fila cheia a leitura do socket pausa em vez de crescer a memória
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '10000'))
+
+
+class StreamWriteError(Exception):
+    pass
+
+
+class TradeStream:
+    """
+    Ingest `<symbol>@aggTrade` from the Binance WebSocket into `collection_csv`.
+    Trades are micro-batched by size or time; after every (re)connect and on any
+    aggTrade id jump the gap is filled through the REST aggTrades path.
+    Messages wait in a queue of at most `queue_size` entries: the long catch-up
+    runs before connecting, and while the short one after connecting runs a
+    full queue pauses the socket reader instead of growing memory.
+    """
+
+    def __init__(self, symbol, ws_url=None, batch_size=STREAM_BATCH_SIZE,
+                 flush_interval=STREAM_FLUSH_INTERVAL, queue_size=STREAM_QUEUE_SIZE):
+        self.symbol = symbol
+        self.ws_url = (ws_url or BINANCE_WS_URL).rstrip('/')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.buffer = []
+        self.buffer_started = None
+        self.last_agg_id = None
+        self.stopped = asyncio.Event()
+
+    @property
+    def stream_url(self):
+        return f"{self.ws_url}/ws/{self.symbol.lower()}@aggTrade"
+
+    def stop(self):
+        self.stopped.set()
+
+    async def backfill_gap(self):
+        """Catch up through REST from the stored checkpoint, then resync the last seen id."""
+        await asyncio.to_thread(download_and_save_btcusd, self.symbol)
+        checkpoint = await asyncio.to_thread(load_checkpoint, self.symbol)
+        if checkpoint and checkpoint.get('last_agg_id') is not None:
+            self.last_agg_id = checkpoint['last_agg_id']
+
+    async def flush(self):
+        """Persist the buffered trades and advance the checkpoint if all of them were written."""
+        if not self.buffer:
+            return
+        trades, self.buffer, self.buffer_started = self.buffer, [], None
+        df = pd.DataFrame(agg_trades_to_records(self.symbol, trades))
+        summary = await asyncio.to_thread(insert_data_into_mongo, df, collection_csv)
+        if summary['failed']:
+            # Sem avançar o checkpoint; a reconexão refaz o backfill a partir dele
+            raise StreamWriteError(f"{summary['failed']} streamed {self.symbol} trades failed to persist.")
+        last_trade = trades[-1]
+        await asyncio.to_thread(save_checkpoint, self.symbol, last_trade['a'], last_trade['T'])
+
+    async def handle_trade(self, trade):
+        if self.last_agg_id is not None:
+            if trade['a'] <= self.last_agg_id:
+                # Já gravado pelo backfill REST
+                return
+            if trade['a'] > self.last_agg_id + 1:
+                logging.warning(f"{self.symbol} stream jumped from {self.last_agg_id} to {trade['a']}; backfilling gap.")
+                await self.flush()
+                await self.backfill_gap()
+                if trade['a'] <= (self.last_agg_id or -1):
+                    return
+        self.last_agg_id = trade['a']
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        self.buffer.append(trade)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def read(self, ws, queue):
+        """Move socket messages into the bounded queue; blocks (stops reading) while it is full."""
+        try:
+            while True:
+                message = await ws.receive()
+                await queue.put(message)
+                if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                                    aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                    return
+        except Exception as e:
+            # Repassa o erro para consume() encerrar a conexão
+            await queue.put(e)
+
+    def parse_trade(self, data):
+        """The aggTrade event of a text frame, or None for other events and malformed frames."""
+        try:
+            payload = json.loads(data)
+            # Streams combinados embrulham o evento em {"stream": ..., "data": ...}
+            trade = payload.get('data', payload)
+            if trade.get('e') != 'aggTrade':
+                return None
+            int(trade['a']), int(trade['T'])
+            return trade
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            # Frame inválido: descarta sem derrubar a conexão
+            logging.warning(f"{self.symbol}: frame ignorado ({e}): {str(data)[:200]}")
+            return None
+
+    async def consume(self, queue):
+        while not self.stopped.is_set():
+            timeout = self.flush_interval
+            if self.buffer_started is not None:
+                timeout = max(0.0, self.buffer_started + self.flush_interval - time.monotonic())
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.flush()
+                continue
+            if isinstance(message, Exception):
+                raise message
+            if message.type == aiohttp.WSMsgType.TEXT:
+                trade = self.parse_trade(message.data)
+                if trade is not None:
+                    await self.handle_trade(trade)
+            elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                                  aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                break
+            if self.buffer_started is not None and time.monotonic() - self.buffer_started >= self.flush_interval:
+                await self.flush()
+
+    async def run(self):
+        """Stream until stop() is called, reconnecting with backoff."""
+        attempt = 0
+        async with aiohttp.ClientSession() as session:
+            while not self.stopped.is_set():
+                try:
+                    # Alcança o presente pelo REST antes de conectar: nada se acumula do stream nesse tempo
+                    await self.backfill_gap()
+                    async with session.ws_connect(self.stream_url, heartbeat=STREAM_HEARTBEAT) as ws:
+                        logging.info(f"Connected to {self.stream_url}.")
+                        attempt = 0
+                        queue = asyncio.Queue(maxsize=max(1, self.queue_size))
+                        reader = asyncio.create_task(self.read(ws, queue))
+                        try:
+                            # Novo backfill já conectado cobre os trades entre o REST e o stream
+                            await self.backfill_gap()
+                            await self.consume(queue)
+                        finally:
+                            reader.cancel()
+                            with suppress(asyncio.CancelledError):
+                                await reader
+                    await self.flush()
+                except Exception as e:
+                    # Qualquer falha (rede, MongoDB, lease de escrita) reconecta com backoff;
+                    # CancelledError não é Exception e encerra o stream
+                    logging.warning(f"{self.symbol} stream error ({type(e).__name__}): {e}")
+                    self.buffer, self.buffer_started = [], None
+                if not self.stopped.is_set():
+                    delay = backoff_delay(attempt, base=1.0, cap=60.0)
+                    attempt += 1
+                    logging.info(f"Reconnecting {self.symbol} stream in {delay:.1f}s.")
+                    try:
+                        await asyncio.wait_for(self.stopped.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+
+
+def run_stream(symbol, ws_url=None):
+    """Blocking entry point for a streaming ingestion thread."""
+    asyncio.run(TradeStream(symbol, ws_url=ws_url).run())
@@ -0,0 +1,372 @@
+"""
+Trade storage on a MongoDB time-series collection, tiered retention and the
+migration of an existing `csv_data` collection.
+
+With TRADES_STORAGE=timeseries (default) `csv_data` is created as a
+time-series collection (`time` as timeField, `symbol` as metaField), where
+trades are stored column-compressed in buckets. With TRADES_RETENTION_DAYS
+the raw ticks expire after N days. Before that, the compaction job rebuilds
+the rollup bars (1m/1h/1d) of every whole day about to expire, so the history
+stays available as bars once the ticks are gone.
+
+Time-series collections do not support unique indexes or upserts, so
+`insert_data_into_mongo` deduplicates trades on (symbol, aggId), or on `_id`
+for CSV rows, with `filter_new_trades` before inserting. The lookup and the
+insert run under `trade_write_lock`, a per-symbol lease kept in MongoDB, so
+concurrent writers (stream, jobs, gap repair, backfill CLI) cannot both
+insert the same trade.
+
+Uso:
+    python api/timeseries.py status
+    python api/timeseries.py migrate --batch-size 50000 [--drop-source]
+    python api/timeseries.py compact --symbol BTCUSDT
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+TRADES_COLLECTION = 'csv_data'
+# 'timeseries' cria a coleção de trades como time-series; 'standard' mantém a coleção comum
+TRADES_STORAGE = os.getenv('TRADES_STORAGE', 'timeseries')
+TRADES_TS_GRANULARITY = os.getenv('TRADES_TS_GRANULARITY', 'seconds')
+# Dias de ticks brutos mantidos (0 = sem expiração); o histórico mais antigo fica só nas barras
+TRADES_RETENTION_DAYS = float(os.getenv('TRADES_RETENTION_DAYS', '0'))
+# Antecedência (dias) com que os ticks são compactados em barras antes de expirarem
+TRADES_COMPACTION_LEAD_DAYS = float(os.getenv('TRADES_COMPACTION_LEAD_DAYS', '1'))
+TRADES_COMPACTION_INTERVAL = int(os.getenv('TRADES_COMPACTION_INTERVAL', '3600'))
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '50000'))
+# Duração do lease de escrita por símbolo e tempo máximo de espera por ele (segundos)
+TRADES_WRITE_LOCK_TTL = float(os.getenv('TRADES_WRITE_LOCK_TTL', '60'))
+TRADES_WRITE_LOCK_TIMEOUT = float(os.getenv('TRADES_WRITE_LOCK_TIMEOUT', '120'))
+LEGACY_SUFFIX = '_legacy'
+
+CHECKPOINTS_COLLECTION = 'ingestion_checkpoints'
+WRITE_LOCKS_COLLECTION = 'write_locks'
+
+_collection_types = {}
+
+
+def is_timeseries(db, name=TRADES_COLLECTION, refresh=False):
+    """Whether `name` is a time-series collection (cached per process)."""
+    key = (db.name, name)
+    if refresh or key not in _collection_types:
+        info = next(iter(db.list_collections(filter={"name": name})), None)
+        _collection_types[key] = info is not None and info.get('type') == 'timeseries'
+    return _collection_types[key]
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def retained_since(now=None):
+    """
+    First whole day whose raw ticks are all still retained, or None without
+    retention. Rollups must not be rebuilt from ticks before it.
+    """
+    if TRADES_RETENTION_DAYS <= 0:
+        return None
+    return pd.Timestamp((now or _now()) - timedelta(days=TRADES_RETENTION_DAYS)).ceil('D').to_pydatetime()
+
+
+def create_trades_collection(db, name=TRADES_COLLECTION):
+    """
+    Create the trades collection as time-series when it does not exist yet and
+    keep its expiry in sync with TRADES_RETENTION_DAYS. Returns whether the
+    collection is time-series.
+    """
+    expire = int(TRADES_RETENTION_DAYS * 86400)
+    info = next(iter(db.list_collections(filter={"name": name})), None)
+    if info is None:
+        if TRADES_STORAGE != 'timeseries':
+            return False
+        options = {"expireAfterSeconds": expire} if expire > 0 else {}
+        db.create_collection(
+            name,
+            timeseries={"timeField": "time", "metaField": "symbol", "granularity": TRADES_TS_GRANULARITY},
+            **options
+        )
+        logging.info(f"Coleção time-series '{name}' criada (retenção: {TRADES_RETENTION_DAYS or 'sem'} dias).")
+    elif info.get('type') != 'timeseries':
+        if TRADES_STORAGE == 'timeseries':
+            logging.warning(f"'{name}' é uma coleção comum; converta com `python api/timeseries.py migrate`.")
+        _collection_types[(db.name, name)] = False
+        return False
+    elif info.get('options', {}).get('expireAfterSeconds') != (expire if expire > 0 else None):
+        db.command("collMod", name, expireAfterSeconds=expire if expire > 0 else "off")
+        logging.info(f"Retenção de '{name}' ajustada para {TRADES_RETENTION_DAYS or 'sem'} dias.")
+    _collection_types[(db.name, name)] = True
+    return True
+
+
+def create_timeseries_indexes(collection):
+    # Índices secundários sobre metaField/timeField; aggId e _id servem à deduplicação
+    collection.create_index([("symbol", ASCENDING), ("time", ASCENDING)], name="idx_symbol_time")
+    collection.create_index([("time", ASCENDING)], name="idx_time")
+    collection.create_index([("symbol", ASCENDING), ("aggId", ASCENDING)], name="idx_symbol_aggId")
+    # Paginação por keyset em (time, _id), como na coleção comum
+    collection.create_index([("time", ASCENDING), ("_id", ASCENDING)], name="idx_time_id")
+    collection.create_index([("symbol", ASCENDING), ("time", ASCENDING), ("_id", ASCENDING)], name="idx_symbol_time_id")
+
+
+def _dedupe_key(doc):
+    """(field, value) identifying a trade: aggId for exchange trades, the row _id for CSV rows."""
+    if doc.get('aggId') is not None and doc.get('symbol') is not None:
+        return 'aggId', doc['aggId']
+    if doc.get('_id') is not None:
+        return '_id', doc['_id']
+    return None
+
+
+def filter_new_trades(collection, docs):
+    """
+    Positions of the documents in `docs` not stored yet, keeping the first
+    occurrence of repeats within the batch. Trades are matched on (symbol,
+    aggId); CSV rows, which have no aggId, on the deterministic `_id` given by
+    the bootstrap. Documents with neither are always new. Lookups are bounded by
+    the batch's time range per symbol, so only the overlapping buckets are read.
+    """
+    groups = defaultdict(list)
+    for doc in docs:
+        key = _dedupe_key(doc)
+        if key is not None:
+            groups[(doc.get('symbol'), key[0])].append(doc)
+    existing = set()
+    for (symbol, field), keyed in groups.items():
+        values = [doc[field] for doc in keyed]
+        query = {"symbol": symbol} if symbol is not None else {}
+        if field == 'aggId':
+            query['aggId'] = {"$gte": min(values), "$lte": max(values)}
+        else:
+            query['_id'] = {"$in": values}
+        times = [doc['time'] for doc in keyed if isinstance(doc.get('time'), datetime)]
+        if len(times) == len(keyed):
+            query['time'] = {"$gte": min(times), "$lte": max(times)}
+        existing.update(
+            (symbol, field, doc.get(field)) for doc in collection.find(query, {"_id": 1, field: 1})
+        )
+    fresh = []
+    for i, doc in enumerate(docs):
+        key = _dedupe_key(doc)
+        if key is None:
+            fresh.append(i)
+            continue
+        key = (doc.get('symbol'), *key)
+        if key not in existing:
+            existing.add(key)
+            fresh.append(i)
+    return fresh
+
+
+# Identifica este processo como dono dos leases de escrita
+_lock_owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+_local_locks = defaultdict(threading.Lock)
+_local_locks_guard = threading.Lock()
+
+
+def _acquire_lease(db, key, ttl):
+    now = _now()
+    try:
+        # Upsert só casa com lease expirado ou nosso; outro dono ativo gera chave duplicada
+        db[WRITE_LOCKS_COLLECTION].update_one(
+            {"_id": key, "$or": [{"expires_at": {"$lt": now}}, {"owner": _lock_owner}]},
+            {"$set": {"owner": _lock_owner, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+@contextmanager
+def trade_write_lock(db, symbols, ttl=TRADES_WRITE_LOCK_TTL, timeout=TRADES_WRITE_LOCK_TIMEOUT):
+    """
+    Serialize the dedupe-then-insert of trades per symbol: a thread lock within
+    the process plus a lease document in `write_locks` across processes. Leases
+    expire after `ttl` seconds, so a crashed writer does not block the others.
+    Raises TimeoutError when a lease is not obtained within `timeout` seconds.
+    """
+    # Ordem fixa evita deadlock entre lotes com vários símbolos
+    keys = [f"{TRADES_COLLECTION}:{symbol}" for symbol in sorted({str(symbol) for symbol in symbols})]
+    with _local_locks_guard:
+        local = [_local_locks[key] for key in keys]
+    held_local = []
+    held = []
+    try:
+        for lock in local:
+            lock.acquire()
+            held_local.append(lock)
+        deadline = time.monotonic() + timeout
+        for key in keys:
+            while not _acquire_lease(db, key, ttl):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Lease de escrita '{key}' ocupado há mais de {timeout:.0f}s.")
+                time.sleep(0.05)
+            held.append(key)
+        started = time.monotonic()
+        yield
+        if time.monotonic() - started > ttl:
+            logging.warning(f"Escrita em {keys} durou mais que o lease ({ttl:.0f}s); aumente TRADES_WRITE_LOCK_TTL.")
+    finally:
+        if held:
+            db[WRITE_LOCKS_COLLECTION].delete_many({"_id": {"$in": held}, "owner": _lock_owner})
+        for lock in reversed(held_local):
+            lock.release()
+
+
+def _load_checkpoint(db, checkpoint_id):
+    return db[CHECKPOINTS_COLLECTION].find_one({"_id": checkpoint_id}) or {}
+
+
+def _save_checkpoint(db, checkpoint_id, **fields):
+    db[CHECKPOINTS_COLLECTION].update_one(
+        {"_id": checkpoint_id},
+        {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+def compact_trades(db, symbol, now=None):
+    """
+    Rebuild the rollup bars of the whole days of `symbol` whose ticks expire
+    within TRADES_COMPACTION_LEAD_DAYS, from the compaction watermark up to that
+    horizon. Returns the number of days compacted.
+    """
+    from rollups import rebuild_rollups
+    horizon = retained_since(now)
+    if horizon is None:
+        return 0
+    now = now or _now()
+    until = pd.Timestamp(now - timedelta(days=TRADES_RETENTION_DAYS - TRADES_COMPACTION_LEAD_DAYS)).floor('D').to_pydatetime()
+    checkpoint_id = f"compaction:{symbol}"
+    since = _load_checkpoint(db, checkpoint_id).get('until')
+    if since is None:
+        oldest = db[TRADES_COLLECTION].find_one({"symbol": symbol}, {"_id": 0, "time": 1}, sort=[("time", ASCENDING)])
+        if oldest is None:
+            return 0
+        since = pd.Timestamp(oldest['time']).floor('D').to_pydatetime()
+    if since < horizon:
+        # Ticks desses dias já começaram a expirar: as barras existentes são mantidas como estão
+        logging.warning(f"Compactação de {symbol} atrasada: dias antes de {horizon:%Y-%m-%d} mantidos sem reconstrução.")
+        since = horizon
+    if since >= until:
+        return 0
+    rebuild_rollups(db, symbol=symbol, since=since, until=until)
+    _save_checkpoint(db, checkpoint_id, until=until)
+    days = (until - since).days
+    logging.info(f"{symbol}: {days} dias de ticks compactados em barras ({since:%Y-%m-%d} a {until:%Y-%m-%d}).")
+    return days
+
+
+def migrate_trades(db, batch_size=MIGRATION_BATCH_SIZE, drop_source=False):
+    """
+    Convert a standard `csv_data` collection into a time-series one: the old
+    collection is renamed to `csv_data_legacy`, the time-series collection is
+    created in its place and the documents are copied in `_id` order in bulk
+    batches. Progress is checkpointed, so an interrupted migration resumes.
+    Rollups are left untouched (they already cover the copied trades).
+    """
+    legacy_name = TRADES_COLLECTION + LEGACY_SUFFIX
+    names = set(db.list_collection_names())
+    if TRADES_COLLECTION in names and not is_timeseries(db, refresh=True):
+        if legacy_name in names:
+            raise RuntimeError(f"'{legacy_name}' já existe; remova-a ou conclua a migração anterior.")
+        db[TRADES_COLLECTION].rename(legacy_name)
+        logging.info(f"'{TRADES_COLLECTION}' renomeada para '{legacy_name}'.")
+        names.add(legacy_name)
+    if legacy_name not in names:
+        logging.info("Nada a migrar.")
+        return 0
+    if not create_trades_collection(db):
+        raise RuntimeError("Não foi possível criar a coleção time-series (TRADES_STORAGE=standard?).")
+    create_timeseries_indexes(db[TRADES_COLLECTION])
+
+    legacy = db[legacy_name]
+    target = db[TRADES_COLLECTION]
+    checkpoint_id = f"migration:{TRADES_COLLECTION}"
+    last_id = _load_checkpoint(db, checkpoint_id).get('last_id')
+    copied = failed = 0
+    started = time.monotonic()
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(legacy.find(query).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        # Um lote reprocessado após interrupção não duplica trades (aggId) nem linhas do CSV (_id)
+        with trade_write_lock(db, {doc.get('symbol') for doc in batch}):
+            docs = [batch[i] for i in filter_new_trades(target, batch)]
+            if docs:
+                try:
+                    copied += len(target.insert_many(docs, ordered=False).inserted_ids)
+                except BulkWriteError as e:
+                    copied += e.details.get('nInserted', 0)
+                    failed += len(e.details.get('writeErrors', []))
+                    logging.error(f"{len(e.details.get('writeErrors', []))} documentos não migrados: {e.details.get('writeErrors', [])[:1]}")
+        _save_checkpoint(db, checkpoint_id, last_id=last_id, done=False)
+        elapsed = time.monotonic() - started
+        logging.info(f"Migração: {copied} documentos copiados ({copied / elapsed:.0f}/s).")
+    _save_checkpoint(db, checkpoint_id, last_id=last_id, done=True)
+    if drop_source and not failed:
+        legacy.drop()
+        logging.info(f"'{legacy_name}' removida.")
+    logging.info(f"Migração concluída: {copied} copiados, {failed} com erro.")
+    return copied
+
+
+def storage_status(db):
+    """Type, retention and storage/index size of the trades collection (and of the legacy copy)."""
+    status = {}
+    for name in (TRADES_COLLECTION, TRADES_COLLECTION + LEGACY_SUFFIX):
+        info = next(iter(db.list_collections(filter={"name": name})), None)
+        if info is None:
+            continue
+        stats = db.command("collStats", name)
+        status[name] = {
+            "type": info.get('type'),
+            "expireAfterSeconds": info.get('options', {}).get('expireAfterSeconds'),
+            "count": stats.get('count'),
+            "storageSize": stats.get('storageSize'),
+            "totalIndexSize": stats.get('totalIndexSize'),
+        }
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help="Collection type, retention and storage sizes")
+    migrate = subparsers.add_parser('migrate', help="Convert csv_data into a time-series collection")
+    migrate.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE)
+    migrate.add_argument('--drop-source', action='store_true', help="Drop csv_data_legacy after a clean copy")
+    compact = subparsers.add_parser('compact', help="Compact the ticks about to expire into bars")
+    compact.add_argument('--symbol', action='append', help="Symbol (repeatable); default all symbols")
+    args = parser.parse_args()
+
+    from utils import db, init_storage
+    if args.command == 'status':
+        for name, stats in storage_status(db).items():
+            logging.info(f"{name}: {stats}")
+    elif args.command == 'migrate':
+        migrate_trades(db, batch_size=args.batch_size, drop_source=args.drop_source)
+    elif args.command == 'compact':
+        init_storage()
+        for symbol in args.symbol or db[TRADES_COLLECTION].distinct('symbol'):
+            compact_trades(db, symbol)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 import os
 import pandas as pd
-from pymongo import ASCENDING, MongoClient
+from pymongo import ASCENDING, MongoClient, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.write_concern import WriteConcern
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 import requests
 import logging
-from time import sleep
+import threading
+import time
+from binance_client import get_client
+from metrics import INGEST_SECONDS, LOAD_ROWS, LOAD_SECONDS, MONGO_RECORDS, MONGO_SECONDS, \
+    MONGO_WRITE_RECORDS_PER_SECOND, record_ingest, timer
+from rollups import create_rollup_indexes, update_rollups
+from timeseries import create_timeseries_indexes, create_trades_collection, filter_new_trades, is_timeseries, \
+    trade_write_lock
+from volatility import create_volatility_indexes
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,61 +27,247 @@ load_dotenv()
 BINANCE_API_KEY = os.getenv('BINANCE_API_KEY')
 BINANCE_API_SECRET = os.getenv('BINANCE_API_SECRET')
 
+# Endpoints da Binance (podem apontar para um servidor local em testes)
+BINANCE_API_URL = os.getenv('BINANCE_API_URL', 'https://api.binance.com')
+BINANCE_OPTIONS_API_URL = os.getenv('BINANCE_OPTIONS_API_URL', 'https://eapi.binance.com')
+BINANCE_OPTIONS_WEIGHT_LIMIT = int(os.getenv('BINANCE_OPTIONS_WEIGHT_LIMIT', '400'))
+
+# Peso estimado de cada endpoint (o limitador se corrige pelos headers da Binance)
+AGG_TRADES_WEIGHT = 4
+EXERCISE_HISTORY_WEIGHT = 3
+# Máximo de registros por página aceito por /eapi/v1/exerciseHistory
+EXERCISE_PAGE_LIMIT = 100
+
+# Resultado de uma fatia de ingestão (usado pelo agendador para reagendar o job)
+INGEST_CAUGHT_UP = 'caught_up'
+INGEST_MORE = 'more'
+INGEST_ERROR = 'error'
+
 # MongoDB URI from .env
 MONGO_URI = os.getenv('MONGO_URI')
 
 # Define file paths and MongoDB client
 current_dir = os.path.dirname(os.path.abspath(__file__))
 csv_file_path = os.path.join(current_dir, 'dados_completos.csv')
-client = MongoClient(MONGO_URI)
+# connect=False: a conexão só é aberta na primeira operação, não no import
+client = MongoClient(MONGO_URI, connect=False)
 db = client['binance_data']
 
 # MongoDB collections
 collection_csv = db['csv_data']
 collection_historical_exercise = db['historical_exercise_data']
+collection_checkpoints = db['ingestion_checkpoints']
+
+# Parâmetros de escrita em lote no MongoDB
+MONGO_WRITE_BATCH_SIZE = int(os.getenv('MONGO_WRITE_BATCH_SIZE', '5000'))
+MONGO_WRITE_CONCERN = os.getenv('MONGO_WRITE_CONCERN', '1')
+
+# Chaves naturais usadas para deduplicar registros em cada coleção
+UPSERT_KEYS = {
+    'csv_data': ('symbol', 'aggId'),
+    'historical_exercise_data': ('symbol', 'expiryDate'),
+}
+
+# Janela máxima de aggTrades retornada quando apenas startTime é enviado
+AGG_TRADES_WINDOW_MS = 60 * 60 * 1000
 
 # Create indexes to optimize queries
 def create_indexes():
-    collection_csv.create_index([("time", ASCENDING)], name="idx_time")
-    collection_csv.create_index([("symbol", ASCENDING)], name="idx_symbol")
+    # Coleção de trades time-series (TRADES_STORAGE); a deduplicação por aggId é feita na escrita
+    trades_timeseries = create_trades_collection(db, collection_csv.name)
+    if trades_timeseries:
+        create_timeseries_indexes(collection_csv)
+    else:
+        collection_csv.create_index([("time", ASCENDING)], name="idx_time")
+        collection_csv.create_index([("symbol", ASCENDING)], name="idx_symbol")
+        collection_csv.create_index([("symbol", ASCENDING), ("time", ASCENDING)], name="idx_symbol_time")
+        # Índices para paginação por keyset em (time, _id)
+        collection_csv.create_index([("time", ASCENDING), ("_id", ASCENDING)], name="idx_time_id")
+        collection_csv.create_index([("symbol", ASCENDING), ("time", ASCENDING), ("_id", ASCENDING)], name="idx_symbol_time_id")
     collection_historical_exercise.create_index([("expiryDate", ASCENDING)], name="idx_expiryDate")
+    collection_historical_exercise.create_index([("expiryDate", ASCENDING), ("_id", ASCENDING)], name="idx_expiryDate_id")
     collection_historical_exercise.create_index([("symbol", ASCENDING)], name="idx_symbol")
+    try:
+        if not trades_timeseries:
+            # Linhas importadas do CSV não têm aggId, por isso o índice é parcial
+            collection_csv.create_index(
+                [("symbol", ASCENDING), ("aggId", ASCENDING)],
+                name="uniq_symbol_aggId",
+                unique=True,
+                partialFilterExpression={"aggId": {"$exists": True}}
+            )
+        collection_historical_exercise.create_index(
+            [("symbol", ASCENDING), ("expiryDate", ASCENDING)],
+            name="uniq_symbol_expiryDate",
+            unique=True
+        )
+    except OperationFailure as e:
+        logging.error(f"Could not create unique indexes (existing duplicates?): {e}")
+    create_rollup_indexes(db)
+    create_volatility_indexes(db)
     logging.info("Indexes created for collections.")
 
-# Ensure indexes are created at script startup
-create_indexes()
+_storage_lock = threading.Lock()
+_storage_ready = False
+
+def init_storage():
+    """Create the indexes once per process; called from the startup hooks of each entry point."""
+    global _storage_ready
+    with _storage_lock:
+        if not _storage_ready:
+            create_indexes()
+            _storage_ready = True
 
-def insert_data_into_mongo(df, collection):
+def normalize_time_columns(df):
+    """Convert 'time'/'timestamp' columns to datetime, detecting seconds vs milliseconds."""
+    for column in ('timestamp', 'time'):
+        if column not in df.columns or pd.api.types.is_datetime64_any_dtype(df[column]):
+            continue
+        if pd.api.types.is_numeric_dtype(df[column]):
+            # Verifica se o valor é lido como segundos ou milissegundos
+            unit = 's' if df[column].max() < 10**10 else 'ms'
+            df[column] = pd.to_datetime(df[column], unit=unit, errors='coerce')
+        else:
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    return df
+
+def _build_write_concern(write_concern):
+    if write_concern is None or isinstance(write_concern, WriteConcern):
+        return write_concern
+    w = int(write_concern) if str(write_concern).isdigit() else write_concern
+    return WriteConcern(w=w)
+
+def _write_requests(payload, keys):
+    """Build the bulk requests for a batch, upserting on the natural key when available."""
+    requests_batch = []
+    for doc in payload:
+        if keys and all(doc.get(k) is not None for k in keys):
+            requests_batch.append(UpdateOne({k: doc[k] for k in keys}, {"$setOnInsert": doc}, upsert=True))
+        else:
+            requests_batch.append(InsertOne(doc))
+    return requests_batch
+
+def _write_batch(target, batch, keys, timeseries, counts):
+    """
+    Write one batch and fill `counts`. Returns the batch as written (without the
+    trades already stored, on time-series) and the indexes actually inserted.
+    """
+    if timeseries:
+        with timer(MONGO_SECONDS, operation='dedupe', collection=target.name):
+            fresh = filter_new_trades(target, batch)
+        counts["duplicates"] = len(batch) - len(fresh)
+        batch = [batch[i] for i in fresh]
+        batch_requests = [InsertOne(doc) for doc in batch]
+    else:
+        batch_requests = _write_requests(batch, keys)
+    if not batch_requests:
+        # Lote só com trades já gravados
+        return batch, []
+    # Índices do lote efetivamente inseridos (duplicatas não entram nos rollups)
+    inserted_indexes = []
     try:
-        # Verificação e ajuste para 'timestamp' se presente
-        if 'timestamp' in df.columns:
-            # Verifica e ajusta se o timestamp é lido como segundos ou milissegundos
-            if df['timestamp'].max() < 10**10:
-                df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', errors='coerce')
+        with timer(MONGO_SECONDS, operation='bulk_write', collection=target.name):
+            result = target.bulk_write(batch_requests, ordered=False)
+        if result.acknowledged:
+            counts["inserted"] = result.upserted_count + result.inserted_count
+            counts["duplicates"] += result.matched_count
+            inserted_indexes = [
+                i for i, op in enumerate(batch_requests)
+                if isinstance(op, InsertOne) or i in result.upserted_ids
+            ]
+        else:
+            # Write concern w=0: sem confirmação do servidor
+            counts["inserted"] = len(batch)
+            inserted_indexes = list(range(len(batch)))
+    except BulkWriteError as e:
+        details = e.details
+        counts["inserted"] = details.get('nUpserted', 0) + details.get('nInserted', 0)
+        counts["duplicates"] += details.get('nMatched', 0)
+        error_indexes = {error.get('index') for error in details.get('writeErrors', [])}
+        upserted_indexes = {upserted['index'] for upserted in details.get('upserted', [])}
+        inserted_indexes = [
+            i for i, op in enumerate(batch_requests)
+            if i in upserted_indexes or (isinstance(op, InsertOne) and i not in error_indexes)
+        ]
+        for error in details.get('writeErrors', []):
+            # Corrida entre upserts concorrentes também cai em chave duplicada
+            if error.get('code') == 11000:
+                counts["duplicates"] += 1
             else:
-                df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', errors='coerce')
+                counts["failed"] += 1
+        if counts["failed"]:
+            logging.error(f"{counts['failed']} records failed in '{target.name}': {details.get('writeErrors', [])[:1]}")
+    except Exception as e:
+        counts["failed"] = len(batch)
+        logging.error(f"Error inserting batch into '{target.name}': {e}")
+    return batch, inserted_indexes
 
-        # Verificação e ajuste para 'time' se presente
-        if 'time' in df.columns:
-            # Verifica e ajusta se o time é lido como segundos ou milissegundos
-            if df['time'].max() < 10**10:
-                df['time'] = pd.to_datetime(df['time'], unit='s', errors='coerce')
-            else:
-                df['time'] = pd.to_datetime(df['time'], unit='ms', errors='coerce')
+def _update_rollups_safely(batch, inserted_indexes):
+    if not inserted_indexes:
+        return
+    try:
+        update_rollups(db, [batch[i] for i in inserted_indexes])
+    except Exception as e:
+        # Os rollups podem ser regenerados com `python api/rollups.py rebuild`
+        logging.error(f"Error updating rollups: {e}")
+
+def insert_data_into_mongo(df, collection, batch_size=None, write_concern=None):
+    """
+    Write a DataFrame into MongoDB with idempotent upserts keyed on the collection's
+    natural key (see UPSERT_KEYS). Returns the totals and per-batch counts of
+    inserted, duplicate and failed records.
+    Time-series collections take no upserts: records already stored are
+    filtered out first (`filter_new_trades`, by aggId or CSV row _id) and the
+    rest plainly inserted. Trade batches are written and folded into the rollups
+    under the per-symbol `trade_write_lock`.
+    Trades newly inserted into `csv_data` are folded into the OHLCV rollups.
+    """
+    started = time.perf_counter()
+    batch_size = batch_size or MONGO_WRITE_BATCH_SIZE
+    write_concern = _build_write_concern(write_concern if write_concern is not None else MONGO_WRITE_CONCERN)
+    summary = {"inserted": 0, "duplicates": 0, "failed": 0, "batches": []}
+    if df is None or df.empty:
+        logging.info("No records to insert.")
+        return summary
 
-        # Converte o DataFrame em uma lista de dicionários para inserção no MongoDB
-        payload = df.to_dict(orient='records')
-        if payload:
-            collection.insert_many(payload, ordered=False)
-            logging.info(f"{len(payload)} records inserted into '{collection.name}' collection.")
+    df = normalize_time_columns(df)
+    # Converte o DataFrame em uma lista de dicionários para inserção no MongoDB
+    payload = df.to_dict(orient='records')
+    keys = UPSERT_KEYS.get(collection.name)
+    if keys and not set(keys).issubset(df.columns):
+        keys = None
+    target = collection.with_options(write_concern=write_concern) if write_concern else collection
+    timeseries = is_timeseries(collection.database, collection.name)
+
+    for start in range(0, len(payload), batch_size):
+        batch = payload[start:start + batch_size]
+        counts = {"inserted": 0, "duplicates": 0, "failed": 0}
+        if collection.name == collection_csv.name:
+            try:
+                # Deduplicação, inserção e rollups atômicos em relação a outros escritores dos
+                # mesmos símbolos e à reconstrução dos rollups (rebuild_rollups)
+                with trade_write_lock(collection.database, {doc.get('symbol') for doc in batch}):
+                    batch, inserted_indexes = _write_batch(target, batch, keys, timeseries, counts)
+                    _update_rollups_safely(batch, inserted_indexes)
+            except TimeoutError as e:
+                counts["failed"] = len(batch)
+                logging.error(f"Batch not written into '{collection.name}': {e}")
         else:
-            logging.info("No records to insert.")
-    except KeyError as e:
-        pass
-        #logging.error(f"Column missing for MongoDB insertion: {e}")
-    except Exception as e:
-        pass
-        #logging.error(f"Error inserting data into MongoDB: {e}")
+            _write_batch(target, batch, keys, timeseries, counts)
+        summary["batches"].append(counts)
+        for name, value in counts.items():
+            summary[name] += value
+
+    for name in ("inserted", "duplicates", "failed"):
+        MONGO_RECORDS.inc(summary[name], collection=collection.name, outcome=name)
+    elapsed = time.perf_counter() - started
+    if elapsed > 0:
+        MONGO_WRITE_RECORDS_PER_SECOND.set(len(payload) / elapsed, collection=collection.name)
+    logging.info(
+        f"'{collection.name}': {summary['inserted']} inserted, {summary['duplicates']} duplicates, "
+        f"{summary['failed']} failed in {len(summary['batches'])} batches."
+    )
+    return summary
 
 def fetch_data(collection):
     """
@@ -79,79 +275,177 @@ def fetch_data(collection):
     Converte o campo 'time' de string ISO para datetime.
     """
     try:
-        cursor = collection.find()
-        df = pd.DataFrame(list(cursor))
-        
-        if df.empty:
-            logging.info(f"Nenhum dado encontrado na coleção '{collection.name}'.")
-        else:
-            logging.info(f"{len(df)} registros recuperados da coleção '{collection.name}'.")
-            logging.info(f"Primeiros registros: {df.head()}")
-
-            # Converter a coluna 'time' se presente
-            if 'time' in df.columns:
-                if df['time'].dtype == 'object':
-                    df['time'] = pd.to_datetime(df['time'], errors='coerce')
-                    logging.info("Coluna 'time' convertida para datetime.")
-                elif not pd.api.types.is_datetime64_any_dtype(df['time']):
-                    logging.warning(f"Tipo inesperado para a coluna 'time': {df['time'].dtype}")
-                # Definir 'time' como índice
-                df.set_index('time', inplace=True)
-                logging.info("Coluna 'time' definida como índice.")
-            
-            # Converter a coluna 'timestamp' se presente
-            if 'timestamp' in df.columns:
-                if df['timestamp'].dtype == 'object':
-                    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-                    logging.info("Coluna 'timestamp' convertida para datetime.")
-                elif not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
-                    logging.warning(f"Tipo inesperado para a coluna 'timestamp': {df['timestamp'].dtype}")
-            
-            # Remover a coluna '_id' se presente
-            if '_id' in df.columns:
-                df.drop(columns=['_id'], inplace=True)
-                logging.info("Coluna '_id' removida.")
-        
-        return df
+        with timer(LOAD_SECONDS, function='fetch_data', source=collection.name):
+            return _fetch_data(collection)
     except Exception as e:
         logging.error(f"Erro ao recuperar dados da coleção '{collection.name}': {e}")
         return pd.DataFrame()  # Retornar DataFrame vazio em caso
 
-def get_latest_record():
-    return collection_csv.find_one(sort=[("time", -1)])
+def _fetch_data(collection):
+    with timer(MONGO_SECONDS, operation='find', collection=collection.name):
+        df = pd.DataFrame(list(collection.find()))
+    LOAD_ROWS.set(len(df), function='fetch_data', source=collection.name)
+
+    if df.empty:
+        logging.info(f"Nenhum dado encontrado na coleção '{collection.name}'.")
+    else:
+        # Sem df.head()/dtypes no log: formatar o frame custa caro em coleções grandes
+        logging.info(f"{len(df)} registros recuperados da coleção '{collection.name}'.")
+
+        # Converter a coluna 'time' se presente
+        if 'time' in df.columns:
+            if df['time'].dtype == 'object':
+                df['time'] = pd.to_datetime(df['time'], errors='coerce')
+                logging.info("Coluna 'time' convertida para datetime.")
+            elif not pd.api.types.is_datetime64_any_dtype(df['time']):
+                logging.warning(f"Tipo inesperado para a coluna 'time': {df['time'].dtype}")
+            # Definir 'time' como índice
+            df.set_index('time', inplace=True)
+            logging.info("Coluna 'time' definida como índice.")
+        
+        # Converter a coluna 'timestamp' se presente
+        if 'timestamp' in df.columns:
+            if df['timestamp'].dtype == 'object':
+                df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+                logging.info("Coluna 'timestamp' convertida para datetime.")
+            elif not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+                logging.warning(f"Tipo inesperado para a coluna 'timestamp': {df['timestamp'].dtype}")
+        
+        # Remover a coluna '_id' se presente
+        if '_id' in df.columns:
+            df.drop(columns=['_id'], inplace=True)
+            logging.info("Coluna '_id' removida.")
+
+    return df
+
+def get_latest_record(symbol=None):
+    query = {"symbol": symbol} if symbol else {}
+    return collection_csv.find_one(query, sort=[("time", -1)])
+
+def to_millis(value):
+    """Convert a stored time value (datetime or epoch seconds/ms) to epoch milliseconds."""
+    if isinstance(value, datetime):
+        # PyMongo devolve datetimes "naive" em UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    value = float(value)
+    return int(value * 1000) if value < 10**10 else int(value)
+
+def save_checkpoint(symbol, last_agg_id, last_time):
+    """Persist the ingestion checkpoint (last aggTrade id and time in ms) for a symbol."""
+    collection_checkpoints.update_one(
+        {"_id": symbol},
+        {"$set": {
+            "last_agg_id": last_agg_id,
+            "last_time": last_time,
+            "updated_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+def load_checkpoint(symbol):
+    """
+    Return the ingestion checkpoint for a symbol.
+    On first use the checkpoint is seeded from the latest stored trade.
+    """
+    checkpoint = collection_checkpoints.find_one({"_id": symbol})
+    if checkpoint:
+        return checkpoint
+    latest = get_latest_record(symbol)
+    if latest and latest.get('time') is not None:
+        last_time = to_millis(latest['time'])
+        last_agg_id = latest.get('aggId')
+        save_checkpoint(symbol, last_agg_id, last_time)
+        logging.info(f"Checkpoint for {symbol} seeded from latest stored trade at {last_time}.")
+        return {"_id": symbol, "last_agg_id": last_agg_id, "last_time": last_time}
+    return None
+
+def agg_trades_to_records(symbol, data):
+    """Map raw Binance aggTrades payloads to the documents stored in `csv_data`."""
+    # Corrigir o formato do campo `time`
+    return [
+        {
+            "symbol": symbol,
+            "aggId": int(trade['a']),
+            "price": float(trade['p']),
+            "time": int(trade['T']) / 1000,  # Converte para segundos
+            "quantity": float(trade['q'])
+        }
+        for trade in data
+    ]
+
+def download_trades_slice(symbol, start_time=None, limit=1000, max_pages=None):
+    """
+    Download up to `max_pages` pages of aggTrades for a symbol, resuming from its
+    checkpoint. Pages with `fromId` once an aggTrade id is known. Returns
+    INGEST_CAUGHT_UP once the exchange has no newer trades (tail-follow mode),
+    INGEST_MORE when the page budget ran out first and INGEST_ERROR on failure.
+    """
+    started = time.perf_counter()
+    status = INGEST_ERROR
+    try:
+        status = _download_trades_slice(symbol, start_time, limit, max_pages)
+        return status
+    finally:
+        INGEST_SECONDS.observe(time.perf_counter() - started, source='trades', status=status)
 
-def download_and_save_btcusd(symbol, start_time, end_time, limit=1000):
-    base_url = "https://api.binance.com/api/v3/aggTrades"
-    params = {"symbol": symbol, "startTime": start_time, "endTime": end_time, "limit": limit}
+def _download_trades_slice(symbol, start_time, limit, max_pages):
+    client = get_client(BINANCE_API_URL)
+    params = {"symbol": symbol, "limit": limit}
+    checkpoint = load_checkpoint(symbol)
+    if checkpoint and checkpoint.get('last_agg_id') is not None:
+        params['fromId'] = checkpoint['last_agg_id'] + 1
+    elif checkpoint and checkpoint.get('last_time') is not None:
+        params['startTime'] = checkpoint['last_time'] + 1
+    elif start_time is not None:
+        params['startTime'] = start_time
+    pages = 0
     try:
-        while True:
-            response = requests.get(base_url, params=params)
+        while max_pages is None or pages < max_pages:
+            pages += 1
+            page_started = time.perf_counter()
+            response = client.get("/api/v3/aggTrades", params=params, weight=AGG_TRADES_WEIGHT)
             if response.status_code == 200:
                 data = response.json()
                 if not data:
-                    logging.info("No more BTC/USD data to download.")
-                    break
-                # Corrigir o formato do campo `time`
-                records = [
-                    {
-                        "symbol": symbol,
-                        "price": float(trade['p']),
-                        "time": int(trade['T']) / 1000,  # Converte para segundos
-                        "quantity": float(trade['q'])
-                    }
-                    for trade in data
-                ]
+                    # Com apenas startTime a Binance responde uma janela de 1 hora; avança se ainda houver histórico
+                    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+                    if 'startTime' in params and params['startTime'] + AGG_TRADES_WINDOW_MS < now_ms:
+                        params['startTime'] += AGG_TRADES_WINDOW_MS
+                        # Persiste o avanço para a próxima fatia não reconsultar as janelas vazias
+                        save_checkpoint(symbol, None, params['startTime'] - 1)
+                        continue
+                    logging.info(f"{symbol} is up to date.")
+                    return INGEST_CAUGHT_UP
                 # Adiciona dados ao MongoDB
-                insert_data_into_mongo(pd.DataFrame(records), collection_csv)
-                params['startTime'] = data[-1]['T'] + 1
-            elif response.status_code == 429:
-                logging.warning("Rate limit exceeded. Waiting before retry...")
-                sleep(60)
+                summary = insert_data_into_mongo(pd.DataFrame(agg_trades_to_records(symbol, data)), collection_csv)
+                if summary['failed']:
+                    # Não avança o checkpoint para não deixar buracos no histórico
+                    logging.error(f"{summary['failed']} {symbol} trades failed to persist; checkpoint not advanced.")
+                    return INGEST_ERROR
+                last_trade = data[-1]
+                save_checkpoint(symbol, last_trade['a'], last_trade['T'])
+                record_ingest('trades', symbol, len(data), time.perf_counter() - page_started, last_trade['T'] / 1000)
+                params.pop('startTime', None)
+                params['fromId'] = last_trade['a'] + 1
+                if len(data) < limit:
+                    logging.info(f"{symbol} caught up at aggTrade {last_trade['a']}.")
+                    return INGEST_CAUGHT_UP
             else:
                 logging.error(f"Error downloading data: {response.status_code} - {response.text}")
-                break
+                return INGEST_ERROR
     except Exception as e:
-        logging.error(f"Error in download_and_save_btcusd: {e}")
+        logging.error(f"Error downloading {symbol} trades: {e}")
+        return INGEST_ERROR
+    return INGEST_MORE
+
+def download_and_save_btcusd(symbol, start_time=None, limit=1000):
+    """
+    Download aggTrades for a symbol until caught up. Returns True when the
+    download has caught up with the exchange, False on error.
+    """
+    return download_trades_slice(symbol, start_time, limit) == INGEST_CAUGHT_UP
 
 def resample_daily(df):
     if df.empty:
@@ -167,40 +461,40 @@ def resample_daily(df):
         
         # Flatten MultiIndex columns
         df_daily.columns = ['time', 'price_mean', 'price_min', 'price_max', 'total_quantity']
-        logging.info(f"Daily resampled data:\n{df_daily.head()}")
+        logging.info(f"Daily resampled data: {len(df_daily)} days.")
         return df_daily
     except Exception as e:
         logging.error(f"Error resampling data: {e}")
         return pd.DataFrame()
 
-def fetch_historical_exercise_records(symbol="BTCUSDT", start_time=None, end_time=None, limit=1000):
-    url = "https://eapi.binance.com/eapi/v1/exerciseHistory"
+def fetch_historical_exercise_records(symbol="BTCUSDT", start_time=None, end_time=None, limit=EXERCISE_PAGE_LIMIT):
+    """
+    One page of exercise records of an underlying in [start_time, end_time] (ms).
+    Returns a DataFrame (empty when the window has no records) or None on error.
+    """
+    client = get_client(BINANCE_OPTIONS_API_URL, weight_limit=BINANCE_OPTIONS_WEIGHT_LIMIT)
     headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
     params = {"underlying": symbol, "startTime": start_time, "endTime": end_time, "limit": limit}
+    started = time.perf_counter()
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = client.get("/eapi/v1/exerciseHistory", params=params, headers=headers, weight=EXERCISE_HISTORY_WEIGHT)
         response.raise_for_status()
         data = response.json()
-        if data:
-            for record in data:
-                record['expiryDate'] = datetime.fromtimestamp(record['expiryDate'] / 1000)
-            return pd.DataFrame(data)
-        else:
-            logging.info("No historical exercise records found.")
+        elapsed = time.perf_counter() - started
+        INGEST_SECONDS.observe(elapsed, source='exercise', status='ok')
+        if not data:
+            record_ingest('exercise', symbol, 0, elapsed)
             return pd.DataFrame()
+        df = pd.DataFrame(data)
+        # Datas naive em UTC, como os demais campos de tempo gravados no MongoDB
+        df['expiryDate'] = pd.to_datetime(df['expiryDate'], unit='ms')
+        df['underlying'] = symbol
+        record_ingest('exercise', symbol, len(df), elapsed, df['expiryDate'].max().value / 10**9)
+        return df
     except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching historical exercise records: {e}")
-        return pd.DataFrame()
-
-def fetch_and_store_historical_exercise_data(start_time=None, end_time=None):
-    start_time = start_time or int(datetime(2020, 1, 1).timestamp() * 1000)
-    end_time = end_time or int(datetime(2023, 12, 31, 23, 59, 59).timestamp() * 1000)
-    logging.info("Starting Historical Exercise Records data collection...")
-    df_historical_exercise = fetch_historical_exercise_records(start_time=start_time, end_time=end_time)
-    if not df_historical_exercise.empty:
-        insert_data_into_mongo(df_historical_exercise, collection_historical_exercise)
-    else:
-        logging.info("Historical Exercise Records DataFrame is empty or not loaded correctly.")
+        INGEST_SECONDS.observe(time.perf_counter() - started, source='exercise', status='error')
+        logging.error(f"Error fetching historical exercise records for {symbol}: {e}")
+        return None
 
 def read_csv_file():
     try:
@@ -212,11 +506,3 @@ def read_csv_file():
     except Exception as e:
         logging.error(f"Error reading CSV file: {e}")
         return pd.DataFrame()
-
-# Load initial data and resample it
-df_csv = fetch_data(collection_csv)
-if not df_csv.empty and isinstance(df_csv.index, pd.DatetimeIndex):
-    logging.info("DatetimeIndex is set correctly.")
-    df_daily = resample_daily(df_csv)
-else:
-    logging.warning("The 'time' column could not be converted to a DateTimeIndex or data is empty.")
@@ -0,0 +1,190 @@
+import argparse
+import logging
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from columnar import fetch_trades_frame
+from rollups import ROLLUP_INTERVALS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+VOLATILITY_COLLECTION = 'volatility'
+# Pares intervalo:janela (em barras) mantidos pelo job incremental
+VOLATILITY_SPECS = [
+    (spec.split(':')[0].strip(), int(spec.split(':')[1]))
+    for spec in os.getenv('VOLATILITY_SPECS', '1m:60,1h:24,1d:30').split(',') if ':' in spec
+]
+VOLATILITY_WRITE_BATCH = int(os.getenv('VOLATILITY_WRITE_BATCH', '10000'))
+
+ESTIMATORS = ['close_to_close', 'parkinson', 'garman_klass', 'yang_zhang']
+BAR_SECONDS = {'1m': 60, '1h': 3600, '1d': 86400}
+# Mercado cripto negocia 24/7: anualiza pelo número de barras num ano corrido
+SECONDS_PER_YEAR = 365 * 86400
+
+
+def create_volatility_indexes(db):
+    db[VOLATILITY_COLLECTION].create_index(
+        [("symbol", ASCENDING), ("interval", ASCENDING), ("window", ASCENDING), ("time", ASCENDING)],
+        name="uniq_symbol_interval_window_time", unique=True
+    )
+
+
+def _rolling_sum(values, window):
+    """Sum over each trailing window via a cumulative sum (O(n)); NaN until the window is full."""
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return out
+
+
+def _rolling_mean(values, window):
+    """Trailing mean that is NaN whenever the window contains a missing value."""
+    valid = np.isfinite(values)
+    sums = _rolling_sum(np.where(valid, values, 0.0), window)
+    counts = _rolling_sum(valid.astype('float64'), window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts == window, sums / window, np.nan)
+
+
+def _rolling_var(values, window):
+    """Trailing sample variance (ddof=1) from the rolling sums of x and x²."""
+    valid = np.isfinite(values)
+    # Centraliza para reduzir o cancelamento numérico de sum(x²) - sum(x)²/n
+    mean = values[valid].mean() if valid.any() else 0.0
+    x = np.where(valid, values - mean, 0.0)
+    sums = _rolling_sum(x, window)
+    squares = _rolling_sum(x * x, window)
+    counts = _rolling_sum(valid.astype('float64'), window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (squares - sums * sums / window) / (window - 1)
+    return np.where(counts == window, np.maximum(var, 0.0), np.nan)
+
+
+def compute_volatility(bars, interval, window):
+    """
+    Rolling annualized volatility of OHLC bars (arrays or a frame with
+    open/high/low/close ordered by time) with four estimators:
+    close-to-close, Parkinson, Garman-Klass and Yang-Zhang. Row i uses the
+    `window` bars ending at i (plus the previous close for the return-based
+    terms). Returns a dict of arrays aligned with the input.
+    """
+    o = np.asarray(bars['open'], dtype='float64')
+    h = np.asarray(bars['high'], dtype='float64')
+    l = np.asarray(bars['low'], dtype='float64')
+    c = np.asarray(bars['close'], dtype='float64')
+    periods = SECONDS_PER_YEAR / BAR_SECONDS[interval]
+    previous_close = np.concatenate(([np.nan], c[:-1]))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_hl = np.log(h / l)
+        log_co = np.log(c / o)
+        log_ho = np.log(h / o)
+        log_lo = np.log(l / o)
+        log_hc = np.log(h / c)
+        log_lc = np.log(l / c)
+        returns = np.log(c / previous_close)
+        overnight = np.log(o / previous_close)
+
+    close_to_close = _rolling_var(returns, window)
+    parkinson = _rolling_mean(log_hl ** 2 / (4.0 * math.log(2.0)), window)
+    garman_klass = _rolling_mean(0.5 * log_hl ** 2 - (2.0 * math.log(2.0) - 1.0) * log_co ** 2, window)
+    rogers_satchell = _rolling_mean(log_hc * log_ho + log_lc * log_lo, window)
+    k = 0.34 / (1.34 + (window + 1) / (window - 1))
+    yang_zhang = _rolling_var(overnight, window) + k * _rolling_var(log_co, window) + (1 - k) * rogers_satchell
+
+    result = {}
+    for name, variance in zip(ESTIMATORS, (close_to_close, parkinson, garman_klass, yang_zhang)):
+        result[name] = np.sqrt(np.maximum(variance, 0.0) * periods)
+    return result
+
+
+def _load_bar_frame(db, interval, symbol, start=None):
+    return fetch_trades_frame(
+        db[ROLLUP_INTERVALS[interval][0]], start=start, symbol=symbol, fields=('open', 'high', 'low', 'close')
+    )
+
+
+def update_volatility(db, symbol, interval, window):
+    """
+    Compute and persist the estimators for the bars not yet covered. Only the
+    new bars plus the `window` bars before them are read, so an update costs
+    O(new bars + window) instead of recomputing the whole history. The last
+    persisted bar is recomputed as well, since it may still have been open.
+    """
+    if window < 2:
+        raise ValueError("window must be at least 2 bars")
+    collection = db[VOLATILITY_COLLECTION]
+    key = {"symbol": symbol, "interval": interval, "window": window}
+    last = collection.find_one(key, {"time": 1}, sort=[("time", DESCENDING)])
+    start = None
+    if last is not None:
+        # Contexto: as `window` barras anteriores à última gravada, mais o fechamento antes delas
+        context = list(db[ROLLUP_INTERVALS[interval][0]].find(
+            {"symbol": symbol, "time": {"$lt": last['time']}}, {"_id": 0, "time": 1}
+        ).sort("time", DESCENDING).skip(window).limit(1))
+        start = context[0]['time'] if context else None
+    frame = _load_bar_frame(db, interval, symbol, start=start)
+    if frame.empty:
+        return 0
+    estimates = compute_volatility(frame, interval, window)
+    times = frame.index
+    keep = np.isfinite(estimates['close_to_close'])
+    if last is not None:
+        keep &= times >= pd.Timestamp(last['time'])
+    rows = np.flatnonzero(keep)
+    written = 0
+    for offset in range(0, len(rows), VOLATILITY_WRITE_BATCH):
+        batch = rows[offset:offset + VOLATILITY_WRITE_BATCH]
+        operations = [
+            UpdateOne(
+                {**key, "time": times[i].to_pydatetime()},
+                {"$set": {name: float(estimates[name][i]) for name in ESTIMATORS}},
+                upsert=True
+            )
+            for i in batch
+        ]
+        collection.bulk_write(operations, ordered=False)
+        written += len(operations)
+    if written:
+        logging.info(f"Volatilidade {symbol} {interval}/{window}: {written} barras atualizadas.")
+    return written
+
+
+def update_all_volatility(db, symbol, specs=None):
+    return sum(update_volatility(db, symbol, interval, window) for interval, window in specs or VOLATILITY_SPECS)
+
+
+def load_volatility(db, symbol, interval, window, start=None, end=None):
+    """Persisted estimates of a (symbol, interval, window) as a DataFrame ordered by time."""
+    query = {"symbol": symbol, "interval": interval, "window": window}
+    if start is not None or end is not None:
+        query['time'] = {}
+        if start is not None:
+            query['time']['$gte'] = pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            query['time']['$lte'] = pd.Timestamp(end).to_pydatetime()
+    projection = {"_id": 0, "time": 1, **{name: 1 for name in ESTIMATORS}}
+    return pd.DataFrame(list(db[VOLATILITY_COLLECTION].find(query, projection).sort("time", ASCENDING)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute and persist realized volatility from the rollup bars.")
+    parser.add_argument('--symbol', action='append', help="Symbol (repeatable); default all symbols with bars")
+    parser.add_argument('--spec', action='append', help="interval:window, e.g. 1h:24 (repeatable)")
+    args = parser.parse_args()
+
+    from utils import db, init_storage
+    init_storage()
+    specs = [(spec.split(':')[0], int(spec.split(':')[1])) for spec in args.spec] if args.spec else None
+    for symbol in args.symbol or db[ROLLUP_INTERVALS['1d'][0]].distinct('symbol'):
+        update_all_volatility(db, symbol, specs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+
+# Workers WSGI anexam os snapshots publicados pelo main.py (DASH_SNAPSHOT_MODE=publish)
+# em vez de cada um carregar sua própria cópia dos dados
+os.environ.setdefault('DASH_SNAPSHOT_MODE', 'attach')
+
+from dash_app import app_dash  # noqa: E402
+
+# Ex.: gunicorn -w 4 -b 0.0.0.0:8050 wsgi:server
+server = app_dash.server
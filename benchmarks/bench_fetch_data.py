@@ -0,0 +1,130 @@
+"""
+Compare `utils.fetch_data` (list of dicts -> DataFrame) with the columnar
+loader `columnar.fetch_trades_frame` on the configured `csv_data` collection.
+Reports wall time (of an untraced run), peak traced allocation and the final
+DataFrame size.
+
+Without a MongoDB, `--synthetic-rows N` runs both loaders over N in-memory
+trades kept as BSON and decoded while iterating, as a pymongo cursor does
+(server, network and query time are not included).
+
+Uso:
+    python benchmarks/bench_fetch_data.py --start 2023-01-01 --end 2023-04-01
+    python benchmarks/bench_fetch_data.py --synthetic-rows 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from columnar import DEFAULT_FIELDS, fetch_trades_frame  # noqa: E402
+from queries import build_range_query  # noqa: E402
+from utils import collection_csv, fetch_data  # noqa: E402
+
+
+class _RangeView:
+    """Restrict `fetch_data` (which has no filter) to the benchmark range."""
+
+    def __init__(self, collection, query):
+        self.collection = collection
+        self.query = query
+        self.name = collection.name
+
+    def find(self):
+        return self.collection.find(self.query)
+
+
+class _MemoryCursor:
+    """Decode one BSON document per step, like a pymongo cursor over the network buffer."""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return (bson.decode(data) for data in self.raw)
+
+
+class _MemoryCollection:
+    """Synthetic `csv_data` already sorted by time; the query is ignored (the whole set is read)."""
+
+    name = 'csv_data'
+
+    def __init__(self, rows):
+        start = datetime(2023, 1, 1)
+        self.full = []
+        self.projected = []
+        projected_fields = ('time', *DEFAULT_FIELDS)
+        for i in range(rows):
+            document = {
+                "_id": ObjectId(),
+                "symbol": 'BTCUSDT' if i % 4 else 'ETHUSDT',
+                "aggId": i,
+                "time": start + timedelta(milliseconds=50 * i),
+                "price": 30000.0 + (i % 997) / 10,
+                "quantity": (i * 104729 % 1000) / 1000 + 0.001,
+            }
+            self.full.append(bson.encode(document))
+            # A projeção é aplicada no servidor: o cliente só decodifica os campos pedidos
+            self.projected.append(bson.encode({field: document[field] for field in projected_fields}))
+
+    def find(self, query=None, projection=None):
+        return _MemoryCursor(self.projected if projection else self.full)
+
+
+def measure(func):
+    # O tempo vem de uma execução sem tracemalloc, que deixa as alocações várias vezes mais lentas
+    gc.collect()
+    start = time.perf_counter()
+    df = func()
+    elapsed = time.perf_counter() - start
+    del df
+    gc.collect()
+    tracemalloc.start()
+    df = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "rows": len(df),
+        "wall_s": round(elapsed, 3),
+        "peak_mem_mb": round(peak / 2**20, 1),
+        "frame_mem_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--synthetic-rows', type=int, default=None,
+                        help="Use N in-memory synthetic trades instead of the MongoDB collection")
+    args = parser.parse_args()
+    query = build_range_query('time', start=args.start, end=args.end)
+    collection = collection_csv
+    if args.synthetic_rows:
+        collection = _MemoryCollection(args.synthetic_rows)
+
+    results = {
+        "fetch_data": measure(lambda: fetch_data(_RangeView(collection, query))),
+        "columnar_float64": measure(lambda: fetch_trades_frame(collection, args.start, args.end)),
+        "columnar_float32": measure(lambda: fetch_trades_frame(collection, args.start, args.end, float_dtype='float32')),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the vectorized implied-volatility solver with a scalar per-option
+loop over the same synthetic option quotes (Black-76, no discounting).
+
+Uso:
+    python benchmarks/bench_implied_vol.py --quotes 10000 --quotes 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from implied_vol import black76_price, implied_vol, implied_vol_scalar  # noqa: E402
+
+
+def synthetic_quotes(n, seed=0):
+    """Quotes priced from known volatilities: strikes 50%-150% of the forward, 1 day to 1 year."""
+    rng = np.random.default_rng(seed)
+    forward = np.full(n, 60000.0)
+    strike = forward * rng.uniform(0.5, 1.5, n)
+    t = rng.uniform(1 / 365, 1.0, n)
+    vol = rng.uniform(0.2, 1.5, n)
+    is_call = rng.random(n) < 0.5
+    price = black76_price(forward, strike, t, vol, is_call)
+    return price, forward, strike, t, is_call, vol
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quotes', type=int, action='append', help="Number of quotes (repeatable); default 10000")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for n in args.quotes or [10000]:
+        price, forward, strike, t, is_call, vol = synthetic_quotes(n)
+        vectorized, vectorized_s = timed(lambda: implied_vol(price, forward, strike, t, is_call), args.repeat)
+        scalar, scalar_s = timed(lambda: np.array([
+            implied_vol_scalar(*quote) for quote in zip(price.tolist(), forward.tolist(), strike.tolist(),
+                                                         t.tolist(), is_call.tolist())
+        ]), args.repeat)
+        # Opções muito fora do dinheiro têm preço ~0 e não determinam a volatilidade: ficam fora do erro
+        solved = np.isfinite(vectorized) & np.isfinite(scalar)
+        results.append({
+            "quotes": n,
+            "solved": int(solved.sum()),
+            "vectorized_s": vectorized_s,
+            "scalar_loop_s": scalar_s,
+            "speedup": scalar_s / vectorized_s if vectorized_s else None,
+            "max_abs_error_vs_true_vol": float(np.nanmax(np.abs(vectorized[solved] - vol[solved]))) if solved.any() else None,
+            "max_abs_diff_vs_scalar": float(np.nanmax(np.abs(vectorized[solved] - scalar[solved]))) if solved.any() else None,
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare the MongoDB aggregation pushdown behind /api/ohlc with the pandas
+resample path (fetch_data + resample) over the same time range.
+
+Uso:
+    python benchmarks/bench_ohlc.py --interval 1h --start 2023-01-01 --end 2023-02-01
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from ohlc import fetch_ohlc, resample_ohlc, to_naive_utc  # noqa: E402
+from utils import collection_csv, fetch_data  # noqa: E402
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def pandas_path(symbol, interval, start, end):
+    df = fetch_data(collection_csv)
+    if df.empty:
+        return df
+    if symbol:
+        df = df[df['symbol'] == symbol]
+    if start is not None:
+        df = df[df.index >= start]
+    if end is not None:
+        df = df[df.index < end]
+    return resample_ohlc(df.sort_index(), interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbol', default=None)
+    parser.add_argument('--interval', default='1h')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    start, end = to_naive_utc(args.start), to_naive_utc(args.end)
+
+    results = {"interval": args.interval, "symbol": args.symbol, "start": args.start, "end": args.end}
+    for name, func in (
+        ('pushdown', lambda: fetch_ohlc(collection_csv, args.interval, args.symbol, start, end, use_cache=False)),
+        ('pushdown_cached', lambda: fetch_ohlc(collection_csv, args.interval, args.symbol, start, end)),
+        ('pandas_resample', lambda: pandas_path(args.symbol, args.interval, start, end)),
+    ):
+        timings = []
+        for _ in range(args.repeat):
+            bars, elapsed, peak = measure(func)
+            timings.append(elapsed)
+        results[name] = {"bars": len(bars), "best_s": min(timings), "peak_mem_mb": peak / 2**20}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
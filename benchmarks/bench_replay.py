@@ -0,0 +1,104 @@
+"""
+Throughput of the replay engine (prefetch thread, chunking, multi-symbol
+merge and batching) over synthetic in-memory trades, so the numbers exclude
+MongoDB. For the end-to-end rate on a real database run `python api/replay.py`,
+which prints the same statistics.
+
+Uso:
+    python benchmarks/bench_replay.py --trades 10000000 --symbols 1 --symbols 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from replay import TRADE_DTYPE, TRADES_COLLECTION, Replay  # noqa: E402
+
+
+class SyntheticReplay(Replay):
+    """Replay whose chunks are generated in memory: symbol i trades every `interval_ms`, offset by i ms."""
+
+    def __init__(self, trades, interval_ms, symbols, **options):
+        super().__init__({TRADES_COLLECTION: None}, [f"SYM{i}" for i in range(symbols)], **options)
+        self.interval_ms = interval_ms
+        self.per_symbol = trades // symbols
+
+    def _bounds(self, symbol):
+        return 0, self.per_symbol * self.interval_ms + len(self.symbols)
+
+    def _read_window(self, symbol, start_ms, end_ms, limit):
+        offset = self.symbols.index(symbol)
+        first = max(0, -(-(start_ms - offset) // self.interval_ms))
+        last = min(self.per_symbol, max(first, -(-(end_ms - offset) // self.interval_ms)))
+        if limit:
+            last = min(last, first + limit)
+        ids = np.arange(first, last, dtype=np.int64)
+        rows = np.empty(len(ids), dtype=TRADE_DTYPE)
+        rows['time'] = (ids * self.interval_ms + offset).astype('datetime64[ms]')
+        rows['price'] = 30000.0 + (ids % 997) / 10.0
+        rows['quantity'] = (ids % 1000) / 1000 + 0.001
+        rows['aggId'] = ids
+        return rows
+
+
+def run(trades, symbols, interval_ms, mode, chunk_rows, batch_rows):
+    replay = SyntheticReplay(trades, interval_ms, symbols, chunk_rows=chunk_rows, batch_rows=batch_rows)
+    started = time.perf_counter()
+    checksum = 0.0
+    previous = None
+    ordered = True
+    if mode == 'batches':
+        for batch in replay.batches():
+            checksum += float(batch['price'].sum())
+            if previous is not None and batch['time'][0] < previous:
+                ordered = False
+            previous = batch['time'][-1]
+        rows = replay.stats['rows']
+    else:
+        rows = 0
+        for record in replay.records():
+            rows += 1
+            checksum += record[2]
+    elapsed = time.perf_counter() - started
+    return {
+        "trades": trades,
+        "symbols": symbols,
+        "mode": mode,
+        "rows": rows,
+        "ordered": ordered,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed) if elapsed > 0 else None,
+        "read_seconds": round(replay.stats['read_seconds'], 3),
+        "wait_seconds": round(replay.stats['wait_seconds'], 3),
+        "checksum": round(checksum, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trades', type=int, default=10000000)
+    parser.add_argument('--symbols', type=int, action='append', help="Number of symbols (repeatable); default 1 and 4")
+    parser.add_argument('--interval-ms', type=int, default=10)
+    parser.add_argument('--chunk-rows', type=int, default=200000)
+    parser.add_argument('--batch-rows', type=int, default=65536)
+    parser.add_argument('--records', action='store_true', help="Also time the per-record generator")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for symbols in args.symbols or [1, 4]:
+        for mode in ['batches', 'records'] if args.records else ['batches']:
+            results.append(run(args.trades, symbols, args.interval_ms, mode, args.chunk_rows, args.batch_rows))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
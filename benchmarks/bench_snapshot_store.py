@@ -0,0 +1,130 @@
+"""
+Memory and throughput of dashboard workers reading a published snapshot,
+shared (memory-mapped `SnapshotStore` version) versus private (one in-memory
+copy per worker, as when every worker runs its own `load_data`).
+
+A synthetic exercise-like frame is published once; then 1, 4 and 8 worker
+processes run the candlestick aggregation of `update_historical_exercise_graph`
+on random date ranges for a fixed time. Memory is the sum of the workers'
+PSS (proportional set size, Linux /proc/<pid>/smaps_rollup), so shared pages
+are only counted once.
+
+Uso:
+    python benchmarks/bench_snapshot_store.py --rows 5000000 --workers 1 4 8
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from snapshot_store import SnapshotStore  # noqa: E402
+
+
+def synthetic_frame(rows):
+    rng = np.random.default_rng(0)
+    start = np.datetime64('2020-01-01T00:00:00', 's')
+    offsets = np.sort(rng.integers(0, 4 * 365 * 86400, rows))
+    return pd.DataFrame({
+        'expiryDate': (start + offsets.astype('timedelta64[s]')).astype('datetime64[ns]'),
+        'realStrikePrice': rng.normal(30000, 5000, rows),
+        'strikePrice': rng.normal(30000, 5000, rows),
+    })
+
+
+def memory_kb():
+    """PSS of this process in kB (falls back to max RSS outside Linux)."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def workload(df, rng):
+    dates = df['expiryDate'].to_numpy()
+    lo, hi = np.sort(rng.integers(0, len(dates), 2))
+    window = df.iloc[lo:hi + 1]
+    window.groupby(window['expiryDate'].dt.date).agg(
+        open_price=('realStrikePrice', 'first'),
+        high_price=('realStrikePrice', 'max'),
+        low_price=('realStrikePrice', 'min'),
+        close_price=('realStrikePrice', 'last'),
+    )
+
+
+def worker(root, mode, seconds, barrier, results):
+    _, _, frames = SnapshotStore(root).open()
+    df = frames['df_historical_exercise']
+    if mode == 'private':
+        df = df.copy(deep=True)
+    rng = np.random.default_rng(os.getpid())
+    ops = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        workload(df, rng)
+        ops += 1
+    # Mede com todos os workers vivos, para que o PSS reparta as páginas compartilhadas
+    barrier.wait()
+    results.put({"ops": ops, "pss_kb": memory_kb()})
+    barrier.wait()
+
+
+def run(root, mode, workers, seconds):
+    ctx = mp.get_context('spawn')
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(root, mode, seconds, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    ops = sum(item['ops'] for item in collected)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "ops_per_s": round(ops / seconds, 1),
+        "total_pss_mb": round(sum(item['pss_kb'] for item in collected) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        store = SnapshotStore(root)
+        df = synthetic_frame(args.rows)
+        started = time.perf_counter()
+        store.publish({'df_historical_exercise': df})
+        publish_s = time.perf_counter() - started
+        frame_mb = df.memory_usage(deep=True).sum() / 2**20
+        del df
+
+        results = [run(root, mode, workers, args.seconds)
+                   for workers in args.workers for mode in ('shared', 'private')]
+    print(json.dumps({
+        "rows": args.rows,
+        "frame_mb": round(frame_mb, 1),
+        "publish_s": round(publish_s, 3),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
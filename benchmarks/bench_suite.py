@@ -0,0 +1,328 @@
+"""
+Offline, reproducible benchmark of ingestion, loading and dashboard callbacks.
+
+Runs against a throwaway mongod (started on a free port in a temporary
+directory, or `--mongo-uri` with `--reset`) and the synthetic REST server of
+`fake_binance.py`, then measures:
+
+- ingest rows/s end to end through `download_and_save_btcusd` (HTTP + upserts
+  + rollups) and through `insert_data_into_mongo` alone;
+- exercise-record harvesting through `harvest_underlying`;
+- latency of `render_content` (every tab) and `update_historical_exercise_graph`
+  (cold: distinct ranges, warm: repeated range);
+- `fetch_data` and `resample_daily` time and peak RSS with the trades
+  collection filled to each `--sizes` value, each size in a fresh process.
+
+Results are printed (and written to `--output`) as JSON, so runs can be compared.
+
+Uso:
+    python benchmarks/bench_suite.py --sizes 1000000 10000000 50000000 --output bench.json
+    python benchmarks/bench_suite.py --mongo-uri mongodb://127.0.0.1:27017 --reset --sizes 1000000
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_binance import start_fake_binance  # noqa: E402
+
+DATABASE = 'binance_data'
+FILL_SYMBOL = 'BENCHUSDT'
+FILL_BATCH = 100000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_mongod(binary, dbpath, timeout=30):
+    """Start a private mongod and wait until it answers a ping. Returns (process, uri)."""
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    uri = f"mongodb://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            MongoClient(uri, serverSelectionTimeoutMS=500).admin.command('ping')
+            return process, uri
+        except Exception:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"mongod não iniciou em {uri}")
+            time.sleep(0.2)
+
+
+def configure_environment(mongo_uri, binance_url):
+    """Point the application modules at the local services (must run before importing them)."""
+    os.environ['MONGO_URI'] = mongo_uri
+    os.environ['BINANCE_API_URL'] = binance_url
+    os.environ['BINANCE_OPTIONS_API_URL'] = binance_url
+    # Mede o código, não o limite de peso da exchange
+    os.environ['BINANCE_WEIGHT_LIMIT'] = str(10**9)
+    os.environ['BINANCE_OPTIONS_WEIGHT_LIMIT'] = str(10**9)
+    os.environ['DASH_SNAPSHOT_MODE'] = 'local'
+
+
+def quiet_logging():
+    # Os módulos configuram INFO; o log por lote distorceria os tempos
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def peak_rss_mb():
+    # ru_maxrss: kB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_stats(timings):
+    timings = np.asarray(timings) * 1000
+    return {
+        "calls": len(timings),
+        "mean_ms": round(float(timings.mean()), 3),
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p99_ms": round(float(np.percentile(timings, 99)), 3),
+        "max_ms": round(float(timings.max()), 3),
+    }
+
+
+def bench_ingest(fake, insert_rows):
+    from utils import collection_csv, download_and_save_btcusd, insert_data_into_mongo
+    started = time.perf_counter()
+    ok = download_and_save_btcusd('BTCUSDT', start_time=fake.trades_start)
+    elapsed = time.perf_counter() - started
+    rows = collection_csv.count_documents({"symbol": 'BTCUSDT'})
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'symbol': 'ETHUSDT',
+        'aggId': np.arange(insert_rows),
+        'price': 2000 + rng.normal(0, 10, insert_rows).cumsum() / 100,
+        'time': (fake.trades_start + np.arange(insert_rows) * fake.trade_interval_ms) / 1000,
+        'quantity': rng.uniform(0.001, 2, insert_rows),
+    })
+    insert_started = time.perf_counter()
+    summary = insert_data_into_mongo(df, collection_csv)
+    insert_elapsed = time.perf_counter() - insert_started
+    return {
+        "download_and_save_btcusd": {
+            "caught_up": ok, "rows": rows, "wall_s": round(elapsed, 3),
+            "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        },
+        "insert_data_into_mongo": {
+            "rows": summary['inserted'], "failed": summary['failed'], "wall_s": round(insert_elapsed, 3),
+            "rows_per_s": round(summary['inserted'] / insert_elapsed, 1) if insert_elapsed else None,
+        },
+    }
+
+
+def bench_exercise(fake):
+    from exercise_harvester import harvest_underlying
+    from utils import collection_historical_exercise
+    history_start = datetime.fromtimestamp(fake.exercise_start / 1000, timezone.utc).strftime('%Y-%m-%d')
+    started = time.perf_counter()
+    status = harvest_underlying('BTCUSDT', history_start=history_start)
+    elapsed = time.perf_counter() - started
+    rows = collection_historical_exercise.count_documents({})
+    return {
+        "status": status, "rows": rows, "wall_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+    }
+
+
+def bench_callbacks(repeat):
+    import dash_app
+    from app_state import app_state
+    started = time.perf_counter()
+    app_state.start_warmup(dash_app.load_data).join()
+    results = {"load_data_s": round(time.perf_counter() - started, 3)}
+
+    for tab in ('tab-csv', 'tab-historical-exercise', 'tab-volatility'):
+        timings = []
+        for _ in range(repeat):
+            call_started = time.perf_counter()
+            dash_app.render_content(tab, 0)
+            timings.append(time.perf_counter() - call_started)
+        results[f"render_content[{tab}]"] = latency_stats(timings)
+
+    index = dash_app.exercise_queries.index(dash_app.dashboard_data.snapshot)
+    days = pd.to_datetime(index.dates.astype('datetime64[D]')).unique() if len(index.dates) else []
+    outcomes = [None] + index.results()
+    rng = random.Random(0)
+    cold, warm = [], []
+    for _ in range(repeat):
+        if len(days):
+            start, end = sorted(rng.sample(list(days), 2)) if len(days) > 1 else (days[0], days[0])
+        else:
+            start = end = None
+        strike_result = rng.choice(outcomes)
+        call_started = time.perf_counter()
+        dash_app.update_historical_exercise_graph(strike_result, start, end)
+        cold.append(time.perf_counter() - call_started)
+        call_started = time.perf_counter()
+        dash_app.update_historical_exercise_graph(strike_result, start, end)
+        warm.append(time.perf_counter() - call_started)
+    results["update_historical_exercise_graph[cold]"] = latency_stats(cold)
+    results["update_historical_exercise_graph[warm]"] = latency_stats(warm)
+    return results
+
+
+def fill_trades(collection, target):
+    """Top the trades collection up to `target` documents with synthetic FILL_SYMBOL trades."""
+    count = collection.estimated_document_count()
+    first_id = collection.count_documents({"symbol": FILL_SYMBOL})
+    rng = np.random.default_rng(first_id)
+    base = pd.Timestamp('2020-01-01')
+    started = time.perf_counter()
+    while count < target:
+        rows = min(FILL_BATCH, target - count)
+        ids = np.arange(first_id, first_id + rows)
+        batch = pd.DataFrame({
+            'symbol': FILL_SYMBOL,
+            'aggId': ids,
+            'price': 30000 + rng.normal(0, 50, rows),
+            'time': base + pd.to_timedelta(ids * 250, unit='ms'),
+            'quantity': rng.uniform(0.001, 2, rows),
+        })
+        collection.insert_many(batch.to_dict(orient='records'), ordered=False)
+        first_id += rows
+        count += rows
+    return time.perf_counter() - started
+
+
+def _measure_load(queue):
+    """Child process: fetch_data + resample_daily on the whole trades collection."""
+    from utils import collection_csv, fetch_data, resample_daily
+    quiet_logging()
+    gc.collect()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    df = fetch_data(collection_csv)
+    fetch_s = time.perf_counter() - started
+    fetch_peak = peak_rss_mb()
+    frame_mb = df.memory_usage(deep=True).sum() / 2**20
+    started = time.perf_counter()
+    daily = resample_daily(df)
+    resample_s = time.perf_counter() - started
+    queue.put({
+        "rows": len(df),
+        "days": len(daily),
+        "fetch_data_s": round(fetch_s, 3),
+        "fetch_data_peak_rss_mb": round(fetch_peak - baseline, 1),
+        "frame_mem_mb": round(frame_mb, 1),
+        "resample_daily_s": round(resample_s, 3),
+        "resample_daily_peak_rss_mb": round(peak_rss_mb() - baseline, 1),
+    })
+
+
+def bench_load(sizes):
+    from utils import collection_csv
+    results = []
+    context = mp.get_context('spawn')
+    for size in sorted(sizes):
+        fill_s = fill_trades(collection_csv, size)
+        queue = context.Queue()
+        worker = context.Process(target=_measure_load, args=(queue,))
+        worker.start()
+        worker.join()
+        entry = {"target_rows": size, "fill_s": round(fill_s, 1)}
+        if worker.exitcode == 0 and not queue.empty():
+            entry.update(queue.get())
+        else:
+            # Ex.: morto pelo OOM killer em tamanhos que não cabem na memória
+            entry["error"] = f"worker exited with code {worker.exitcode}"
+        results.append(entry)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongod', default=shutil.which('mongod'), help="mongod binary for the private instance")
+    parser.add_argument('--mongo-uri', help="Use an existing server instead (requires --reset)")
+    parser.add_argument('--reset', action='store_true', help=f"Drop the '{DATABASE}' database of --mongo-uri first")
+    parser.add_argument('--ingest-trades', type=int, default=200000)
+    parser.add_argument('--insert-rows', type=int, default=200000)
+    parser.add_argument('--exercise-days', type=int, default=365)
+    parser.add_argument('--exercise-per-day', type=int, default=40)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Simulated exchange latency per request")
+    parser.add_argument('--callback-repeat', type=int, default=50)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000000, 10000000, 50000000])
+    parser.add_argument('--output', help="Also write the JSON results to this file")
+    args = parser.parse_args()
+    if args.mongo_uri and not args.reset:
+        parser.error(f"--mongo-uri apaga o banco '{DATABASE}': confirme com --reset")
+    if not args.mongo_uri and not args.mongod:
+        parser.error("mongod não encontrado no PATH: use --mongod ou --mongo-uri")
+
+    fake, server, binance_url = start_fake_binance(
+        trades=args.ingest_trades, exercise_days=args.exercise_days,
+        exercise_per_day=args.exercise_per_day, latency_ms=args.latency_ms
+    )
+    dbpath = None
+    mongod = None
+    mongo_uri = args.mongo_uri
+    if not mongo_uri:
+        dbpath = tempfile.mkdtemp(prefix='bench-mongod-')
+        mongod, mongo_uri = start_mongod(args.mongod, dbpath)
+    MongoClient(mongo_uri).drop_database(DATABASE)
+    configure_environment(mongo_uri, binance_url)
+
+    try:
+        from utils import client, init_storage
+        quiet_logging()
+        init_storage()
+        results = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "mongodb": client.server_info().get('version'),
+                "pandas": pd.__version__,
+                "numpy": np.__version__,
+            },
+            "config": {name: value for name, value in vars(args).items() if name not in ('mongod', 'mongo_uri', 'output')},
+            "ingest": bench_ingest(fake, args.insert_rows),
+            "exercise": bench_exercise(fake),
+            "callbacks": bench_callbacks(args.callback_repeat),
+            "fetch_resample": bench_load(args.sizes),
+        }
+    finally:
+        server.shutdown()
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+            shutil.rmtree(dbpath, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, default=str)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Local stand-in for the Binance REST endpoints used by the ingestion code,
+serving deterministic synthetic data so benchmarks run offline:
+
+- /api/v3/aggTrades (fromId, startTime with the 1 hour window, or latest page);
+- /eapi/v1/exerciseHistory (one expiry per day at 08:00 UTC, most recent first).
+
+Every symbol/underlying gets the same series. Point the code at it with
+BINANCE_API_URL / BINANCE_OPTIONS_API_URL.
+
+Uso:
+    python benchmarks/fake_binance.py --trades 1000000 --port 9000
+"""
+import argparse
+import json
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+AGG_TRADES_WINDOW_MS = 60 * 60 * 1000
+DAY_MS = 86400 * 1000
+EXPIRY_HOUR_MS = 8 * 60 * 60 * 1000
+
+
+class FakeBinance:
+    """Synthetic aggTrades (ids 0..trades-1, ending a minute ago) and daily exercise records."""
+
+    def __init__(self, trades=100000, trade_interval_ms=50, exercise_days=365, exercise_per_day=40, latency_ms=0):
+        self.trades = trades
+        self.trade_interval_ms = trade_interval_ms
+        self.latency = latency_ms / 1000
+        self.trades_end = int(time.time() * 1000) - 60 * 1000
+        self.trades_start = self.trades_end - trades * trade_interval_ms
+        self.exercise_per_day = exercise_per_day
+        today = self.trades_end // DAY_MS * DAY_MS
+        self.expiries = [
+            day + EXPIRY_HOUR_MS for day in range(today - exercise_days * DAY_MS, today + DAY_MS, DAY_MS)
+            if day + EXPIRY_HOUR_MS < self.trades_end
+        ]
+        self.exercise_start = self.expiries[0] if self.expiries else self.trades_end
+
+    def price(self, time_ms):
+        return 30000.0 * (1.0 + 0.2 * math.sin(time_ms / (30 * DAY_MS))) + (time_ms // 1000 % 997) / 10.0
+
+    def trade(self, agg_id):
+        trade_time = self.trades_start + agg_id * self.trade_interval_ms
+        return {
+            "a": agg_id,
+            "p": f"{self.price(trade_time):.2f}",
+            "q": f"{(agg_id * 104729 % 1000) / 1000 + 0.001:.3f}",
+            "f": agg_id,
+            "l": agg_id,
+            "T": trade_time,
+            "m": agg_id % 2 == 0,
+            "M": True,
+        }
+
+    def agg_trades(self, params):
+        limit = min(int(params.get('limit', 500)), 1000)
+        if 'fromId' in params:
+            first = max(0, int(params['fromId']))
+            last = min(self.trades, first + limit)
+        elif 'startTime' in params:
+            start = int(params['startTime'])
+            end = min(start + AGG_TRADES_WINDOW_MS, int(params.get('endTime', start + AGG_TRADES_WINDOW_MS)))
+            first = max(0, -(-(start - self.trades_start) // self.trade_interval_ms))
+            last = min(self.trades, first + limit, max(first, (end - self.trades_start) // self.trade_interval_ms + 1))
+        else:
+            last = self.trades
+            first = max(0, last - limit)
+        return [self.trade(agg_id) for agg_id in range(first, last)]
+
+    def exercise_history(self, params):
+        underlying = params.get('underlying', 'BTCUSDT')
+        base = underlying[:-4] if underlying.endswith('USDT') else underlying
+        start = int(params.get('startTime', 0))
+        end = int(params.get('endTime', self.trades_end))
+        limit = min(int(params.get('limit', 100)), 100)
+        records = []
+        for expiry in reversed(self.expiries):
+            if expiry > end:
+                continue
+            if expiry < start or len(records) >= limit:
+                break
+            settle = self.price(expiry)
+            label = datetime.fromtimestamp(expiry / 1000, timezone.utc).strftime('%y%m%d')
+            for i in range(self.exercise_per_day):
+                strike = round(settle, -3) + 1000 * (i // 2 - self.exercise_per_day // 4)
+                side = 'C' if i % 2 == 0 else 'P'
+                in_the_money = settle > strike if side == 'C' else settle < strike
+                records.append({
+                    "symbol": f"{base}-{label}-{int(strike)}-{side}",
+                    "strikePrice": f"{strike:.0f}",
+                    "realStrikePrice": f"{settle:.8f}",
+                    "expiryDate": expiry,
+                    "strikeResult": "REALISTIC_VALUE_STRICKEN" if in_the_money else "EXTRINSIC_VALUE_EXPIRED",
+                })
+        return records[:limit]
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                routes = {'/api/v3/aggTrades': fake.agg_trades, '/eapi/v1/exerciseHistory': fake.exercise_history}
+                if url.path not in routes:
+                    self.send_error(404)
+                    return
+                if fake.latency:
+                    time.sleep(fake.latency)
+                body = json.dumps(routes[url.path](params)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-MBX-USED-WEIGHT-1M', '0')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def start_fake_binance(port=0, **options):
+    """Serve a FakeBinance in a daemon thread. Returns (fake, server, base_url)."""
+    fake = FakeBinance(**options)
+    server = ThreadingHTTPServer(('127.0.0.1', port), fake.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-binance', daemon=True).start()
+    return fake, server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--trades', type=int, default=100000)
+    parser.add_argument('--trade-interval-ms', type=int, default=50)
+    parser.add_argument('--exercise-days', type=int, default=365)
+    parser.add_argument('--exercise-per-day', type=int, default=40)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+    fake, server, base_url = start_fake_binance(
+        args.port, trades=args.trades, trade_interval_ms=args.trade_interval_ms,
+        exercise_days=args.exercise_days, exercise_per_day=args.exercise_per_day, latency_ms=args.latency_ms
+    )
+    print(f"Fake Binance em {base_url} (trades a partir de {fake.trades_start} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'api'))
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+import backfill  # noqa: E402
+from fake_binance import start_fake_binance  # noqa: E402
+
+
+class FakeStore:
+    """In-memory stand-in for the trades collection and the backfill_shards state."""
+
+    def __init__(self):
+        self.trades = {}
+        self.done = {}
+        self.fail_between = None
+
+    def insert(self, df, collection):
+        times = df['time'] * 1000
+        if self.fail_between and times.between(*self.fail_between).any():
+            raise TimeoutError("write lease timed out")
+        inserted = duplicates = 0
+        for record in df.to_dict('records'):
+            if record['aggId'] in self.trades:
+                duplicates += 1
+            else:
+                self.trades[record['aggId']] = record
+                inserted += 1
+        return {"inserted": inserted, "duplicates": duplicates, "failed": 0}
+
+    def pending(self, shards):
+        return [shard for shard in shards if shard['_id'] not in self.done]
+
+    def mark_done(self, shard, records):
+        self.done[shard['_id']] = records
+
+
+@pytest.fixture
+def fake_binance():
+    fake, server, url = start_fake_binance(trades=3600, trade_interval_ms=1000)
+    yield fake, url
+    server.shutdown()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(backfill, 'insert_data_into_mongo', store.insert)
+    monkeypatch.setattr(backfill, 'pending_shards', store.pending)
+    monkeypatch.setattr(backfill, 'mark_shard_done', store.mark_done)
+    return store
+
+
+def test_failed_shard_is_counted_and_resumed_on_the_next_run(fake_binance, store):
+    fake, url = fake_binance
+    start, end = fake.trades_start, fake.trades_end
+    shards = backfill.build_shards('BTCUSDT', start, end, shard_hours=0.25)
+    broken = shards[1]
+    broken_trades = sum(1 for agg_id in range(fake.trades) if broken['start'] <= fake.trade(agg_id)['T'] <= broken['end'])
+    store.fail_between = (broken['start'], broken['end'])
+
+    stats = asyncio.run(backfill.run_backfill('BTCUSDT', start, end, shard_hours=0.25, concurrency=4, base_url=url))
+
+    assert stats['shards'] == len(shards)
+    assert stats['shards_failed'] == 1
+    assert stats['shards_done'] == len(shards) - 1
+    assert stats['failed'] == broken_trades
+    assert broken['_id'] not in store.done
+    assert len(store.trades) == fake.trades - broken_trades
+
+    # Segunda execução: só o shard que falhou é refeito
+    store.fail_between = None
+    stats = asyncio.run(backfill.run_backfill('BTCUSDT', start, end, shard_hours=0.25, concurrency=4, base_url=url))
+
+    assert stats['shards'] == 1
+    assert stats['shards_done'] == 1
+    assert stats['shards_failed'] == 0
+    assert stats['inserted'] == broken_trades
+    assert sorted(store.trades) == list(range(fake.trades))
+    assert set(store.done) == {shard['_id'] for shard in shards}
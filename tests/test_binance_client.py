@@ -0,0 +1,26 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from binance_client import parse_retry_after  # noqa: E402
+
+
+def test_parse_retry_after_delta_seconds():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after('0') == 0.0
+    assert parse_retry_after('-5') == 0.0
+
+
+def test_parse_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25.0 <= parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30.0
+    # Data já passada: tenta de novo imediatamente
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_parse_retry_after_missing_or_invalid_uses_default():
+    assert parse_retry_after(None) == 60.0
+    assert parse_retry_after('soon', default=5.0) == 5.0
@@ -0,0 +1,44 @@
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from dashboard_data import DashboardData, _parts_from_bars, daily_from_parts  # noqa: E402
+
+
+class FakeFeed:
+    available = True
+
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+
+    def drain(self):
+        documents, self.documents = self.documents, []
+        return documents
+
+
+def bar(time, volume, price=100.0):
+    return {
+        'symbol': 'BTCUSDT', 'time': time, 'open': price, 'high': price, 'low': price, 'close': price,
+        'mean': price, 'price_sum': price * volume, 'count': volume, 'volume': float(volume),
+    }
+
+
+def test_refresh_keeps_only_the_last_update_of_a_bar():
+    day = datetime(2024, 1, 2)
+    data = DashboardData({'bars_1d': None}, None, None)
+    parts = _parts_from_bars(pd.DataFrame([bar(day, 1)]))
+    data.snapshot = data.snapshot._replace(
+        version=1, source='bars', daily_parts=parts, df_daily=daily_from_parts(parts), csv_watermark=pd.Timestamp(day)
+    )
+    # O mesmo bucket atualizado duas vezes entre duas atualizações do dashboard
+    data.bars_feed = FakeFeed([bar(day, 3), bar(day, 4)])
+    data.exercise_feed = FakeFeed()
+
+    snapshot = data.refresh()
+
+    assert snapshot.df_daily['total_quantity'].tolist() == [4.0]
+    assert snapshot.daily_parts.loc[('BTCUSDT', pd.Timestamp(day)), 'count'] == 4
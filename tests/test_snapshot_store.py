@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from snapshot_store import SnapshotStore, _version_dir  # noqa: E402
+
+
+def test_publish_skips_a_version_orphaned_before_current_was_flipped(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), keep=3)
+    assert store.publish({'daily': pd.DataFrame({'x': [1]})}) == 1
+    # Queda depois do rename do diretório e antes de reescrever o CURRENT
+    os.makedirs(tmp_path / _version_dir(2))
+
+    version = store.publish({'daily': pd.DataFrame({'x': [2]})})
+
+    assert version == 3
+    assert store.current_version() == 3
+    _, _, frames = store.open()
+    assert frames['daily']['x'].tolist() == [2]
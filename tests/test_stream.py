@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'api'))
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+import stream  # noqa: E402
+import utils  # noqa: E402
+from fake_binance import start_fake_binance  # noqa: E402
+
+
+class FakeStore:
+    """In-memory trades and ingestion checkpoints shared by the REST and stream paths."""
+
+    def __init__(self):
+        self.trades = {}
+        self.checkpoints = {}
+
+    def insert(self, df, collection):
+        for record in df.to_dict('records'):
+            self.trades[record['aggId']] = record
+        return {"inserted": len(df), "duplicates": 0, "failed": 0}
+
+    def save_checkpoint(self, symbol, last_agg_id, last_time):
+        self.checkpoints[symbol] = {"_id": symbol, "last_agg_id": last_agg_id, "last_time": last_time}
+
+    def load_checkpoint(self, symbol):
+        return self.checkpoints.get(symbol)
+
+
+@pytest.fixture
+def fake_binance(monkeypatch):
+    fake, server, url = start_fake_binance(trades=2500, trade_interval_ms=1000)
+    monkeypatch.setattr(utils, 'BINANCE_API_URL', url)
+    yield fake
+    server.shutdown()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    for module in (utils, stream):
+        monkeypatch.setattr(module, 'insert_data_into_mongo', store.insert)
+        monkeypatch.setattr(module, 'save_checkpoint', store.save_checkpoint)
+        monkeypatch.setattr(module, 'load_checkpoint', store.load_checkpoint)
+    monkeypatch.setattr(utils, 'record_ingest', lambda *args, **kwargs: None)
+    return store
+
+
+def test_id_jump_backfills_the_gap_and_advances_the_checkpoint(fake_binance, store):
+    fake = fake_binance
+    store.save_checkpoint('BTCUSDT', 99, fake.trade(99)['T'])
+    trade_stream = stream.TradeStream('BTCUSDT', batch_size=10)
+    trade_stream.last_agg_id = 99
+
+    async def scenario():
+        await trade_stream.handle_trade(fake.trade(100))
+        # Mensagens perdidas entre 100 e 1500: o salto dispara o catch-up pelo REST
+        await trade_stream.handle_trade(fake.trade(1500))
+        # O trade que revelou o salto já veio pelo REST e não é gravado de novo
+        assert trade_stream.buffer == []
+        assert store.checkpoints['BTCUSDT']['last_agg_id'] == fake.trades - 1
+        assert trade_stream.last_agg_id == fake.trades - 1
+        latest = dict(fake.trade(fake.trades - 1), a=fake.trades, T=fake.trades_end)
+        await trade_stream.handle_trade(latest)
+        await trade_stream.flush()
+
+    asyncio.run(scenario())
+
+    assert sorted(store.trades) == list(range(100, fake.trades + 1))
+    assert store.checkpoints['BTCUSDT'] == {"_id": 'BTCUSDT', "last_agg_id": fake.trades, "last_time": fake.trades_end}
+    assert trade_stream.last_agg_id == fake.trades
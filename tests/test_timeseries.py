@@ -0,0 +1,60 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from timeseries import filter_new_trades  # noqa: E402
+
+
+def _matches(doc, query):
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            if '$in' in condition and value not in condition['$in']:
+                return False
+            if '$gte' in condition and (value is None or value < condition['$gte']):
+                return False
+            if '$lte' in condition and (value is None or value > condition['$lte']):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return [doc for doc in self.documents if _matches(doc, query)]
+
+
+def trade(agg_id, symbol='BTCUSDT', second=0):
+    return {'symbol': symbol, 'aggId': agg_id, 'time': datetime(2024, 1, 1, 0, 0, second), 'price': 1.0}
+
+
+def test_filter_new_trades_skips_stored_and_repeated_trades():
+    collection = FakeCollection([trade(1), trade(2, second=1), trade(2, symbol='ETHUSDT', second=1)])
+    docs = [trade(1), trade(2, second=1), trade(3, second=2), trade(3, second=2), trade(2, symbol='ETHUSDT', second=1),
+            trade(4, symbol='ETHUSDT', second=3)]
+
+    assert filter_new_trades(collection, docs) == [2, 5]
+    # Uma consulta por símbolo, limitada ao intervalo de aggId e de tempo do lote
+    assert {query['symbol'] for query in collection.queries} == {'BTCUSDT', 'ETHUSDT'}
+    btc = next(query for query in collection.queries if query['symbol'] == 'BTCUSDT')
+    assert btc['aggId'] == {'$gte': 1, '$lte': 3}
+    assert btc['time'] == {'$gte': datetime(2024, 1, 1), '$lte': datetime(2024, 1, 1, 0, 0, 2)}
+
+
+def test_filter_new_trades_matches_csv_rows_by_id():
+    collection = FakeCollection([{'_id': 'row-1', 'time': datetime(2024, 1, 1), 'price': 1.0}])
+    docs = [
+        {'_id': 'row-1', 'time': datetime(2024, 1, 1), 'price': 1.0},
+        {'_id': 'row-2', 'time': datetime(2024, 1, 1), 'price': 1.0},
+        {'time': datetime(2024, 1, 1), 'price': 1.0},
+    ]
+
+    assert filter_new_trades(collection, docs) == [1, 2]